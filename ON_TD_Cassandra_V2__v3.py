@@ -2,16 +2,23 @@ import os
 import pandas as pd
 import json
 import logging
-import time
 from time import sleep
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 import pytz
-import yfinance as yf
 from pathlib import Path
 from api.dwx_client import dwx_client
+from bar_aggregator import TickBarProvider
+from clock import WALL_CLOCK, CachedClock
+from dwx_transport import EventDrivenDwxMixin
+from fibo_zones import LevelSchedule, ZoneEngine, fibonacci_levels
+from market_data import CachedBarProvider, YahooBarProvider, from_ns
+from scheduler import Scheduler
+from session_calendar import SessionCalendar
+from strategy_worker import QUEUE_SIZE, StrategyWorker
+from zone_store import ZoneStateStore
 from functools import lru_cache
-from threading import Timer
+from threading import Lock, RLock
 
 # -----------------
 # Cuenta demo para evaluacion de Viridis Cassandra V2 (Python, WorldTime, Yahho Finance).
@@ -57,9 +64,18 @@ INITIAL_STATE_DATE = datetime(2025, 1, 1, 0, 0, 0)
 INHIBIT_STATES = [-5, -3, 3, 4, 5, 6, 7, 9]
 
 TIME_TOLERANCE_WINDOW = 1800  # seconds
+CLOSE_RETRY_INTERVAL = 10  # seconds
+CLOSE_RETRY_WINDOW = 4 * 60  # seconds; afterwards only close in profit
+MILESTONE_TOLERANCE_WINDOW = 4 * 3600  # seconds
+STATE_REFRESH_INTERVAL = 2 * 3600  # seconds
+NS_PER_SECOND = 10**9
 
+# Events a strategy can handle, each through its on_<event> method
+EVENTS = ('tick', 'message', 'order_event')
+
+# Created on first use
 ORDERS_DIR = Path('./orders')
-ORDERS_DIR.mkdir(exist_ok=True)
+STATE_DIR = Path('./state')
 
 # Configure logging
 logging.basicConfig(
@@ -69,9 +85,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def get_nyc_yesterday_milestone_date():
+def get_nyc_yesterday_milestone_date(clock=WALL_CLOCK):
     """Get yesterday's closing time in NYC market with weekend adjustment."""
-    current_datetime = datetime.now()
+    current_datetime = clock.now()
     yesterday = current_datetime - timedelta(days=1)
 
     # Adjust for weekends
@@ -86,21 +102,47 @@ def get_nyc_yesterday_milestone_date():
     return ny_tz.localize(adjusted_date_deadline)
 
 
+def _read_only(array):
+    """A view of `array` that cannot be written through."""
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
 class Strategy:
     """Base strategy class for trading strategies."""
 
-    def __init__(self, dwx=None):
+    # Routing: the events the processor passes on, and the symbols whose ticks do (None: all)
+    events = EVENTS
+    symbols = None
+    # On a worker thread, whether a tick still waiting may be replaced by a newer one
+    # (for strategies that only need the latest price)
+    conflate_ticks = False
+
+    def __init__(self, dwx=None, clock=None, scheduler=None):
         self.dwx = dwx
+        self.clock = clock if clock is not None else WALL_CLOCK
+        self.scheduler = scheduler
 
     def set_dwx(self, dwx):
         self.dwx = dwx
 
+    def set_clock(self, clock):
+        self.clock = clock
+
+    def set_scheduler(self, scheduler):
+        self.scheduler = scheduler
+
     def initialize(self):
         if self.dwx is None:
             raise ValueError("Trading client (dwx) must be initialized first")
+        if self.scheduler is None:
+            raise ValueError("Scheduler must be set first")
 
-    def on_tick(self, symbol, bid, ask):
-        pass
+    def on_tick(self, symbol, bid, ask, time_ns=None):
+        """
+        :param time_ns: Arrival time of a tick handled later on a worker thread; None means now.
+        """
 
     def on_message(self, message):
         pass
@@ -108,67 +150,165 @@ class Strategy:
     def on_order_event(self):
         pass
 
+    def stop(self):
+        pass
+
+
+class EventDrivenDwxClient(EventDrivenDwxMixin, dwx_client):
+    """dwx_client that reads the bridge files when MT4 writes them instead of polling (inotify on Linux)."""
+
 
 class TickProcessor:
     """Main processor class for handling tick data and routing to strategies."""
 
-    def __init__(self, mt4_files_dir, sleep_delay=0.005, max_retry_seconds=10, verbose=True):
+    def __init__(self, mt4_files_dir, sleep_delay=0.005, max_retry_seconds=10, verbose=True, event_driven=False,
+                 dwx=None, clock=None, scheduler=None, symbols=(SYMBOL,)):
+        """
+        :param dwx: Trading client to use instead of a dwx_client on `mt4_files_dir`,
+            e.g. an `mt4_simulator.MT4Simulator` to replay ticks; it gets this processor as event handler.
+        :param clock: Clock of the strategies (the wall clock by default); a `CachedClock` is
+            refreshed once per tick, a `SimulatedClock` is driven by the replay.
+        :param scheduler: Scheduler of the strategies' timed events, e.g. the one a replay drives;
+            by default one running on its own thread in real time.
+        :param symbols: Symbols to subscribe to besides those the strategies take ticks of.
+        """
         self.strategies = []
+        self.workers = []
         self.mt4_files_dir = mt4_files_dir
+        self.clock = clock if clock is not None else WALL_CLOCK
+        if scheduler is None:
+            scheduler = Scheduler(self.clock)
+            scheduler.start()
+        self.scheduler = scheduler
+        self.symbols = set(symbols)
+
+        # Routing tables: handlers per event, tick handlers per symbol (and of every symbol)
+        self._routes = {event: [] for event in EVENTS if event != 'tick'}
+        self._tick_routes = {}
+        self._any_symbol = []
+        # Only a real bridge needs time to pick up the files MT4 writes
+        settle = sleep if dwx is None else (lambda seconds: None)
 
         # Initialize trading client
-        self.dwx = dwx_client(self, mt4_files_dir, sleep_delay, max_retry_seconds, verbose=verbose)
-        sleep(1)
+        if dwx is None:
+            client = EventDrivenDwxClient if event_driven else dwx_client
+            dwx = client(self, mt4_files_dir, sleep_delay, max_retry_seconds, verbose=verbose)
+        else:
+            dwx.event_handler = self
+        self.dwx = dwx
+        settle(1)
         self.dwx.start()
 
         logger.info(f"Account info: {self.dwx.account_info}")
 
         # Subscribe to tick data
-        sleep(1)
-        self.dwx.subscribe_symbols(['EURUSD', SYMBOL])
+        settle(1)
+        self.dwx.subscribe_symbols(sorted(self.symbols))
 
         # Log existing orders
-        sleep(2)
+        settle(2)
         if self.dwx.open_orders:
             logger.info(f"Existing open orders: {self.dwx.open_orders}")
         else:
             logger.info("No open orders.")
 
-    def set_strategy(self, strategy):
-        """Add a strategy to the processor."""
+    def set_strategy(self, strategy, threaded=False, queue_size=None):
+        """
+        Add a strategy to the processor, which passes it the events it declares.
+
+        :param threaded: Run the strategy's event handlers on their own worker thread
+            (a `StrategyWorker`, conflating ticks if the strategy's `conflate_ticks` says so),
+            so a slow strategy cannot delay the others. Not for replays, which need the
+            handlers to run in step with the simulated clock.
+        :param queue_size: Bound of the worker's event queue.
+        """
+        unknown = set(strategy.events) - set(EVENTS)
+        if unknown:
+            raise ValueError(f"Unknown events {sorted(unknown)}; expected some of {EVENTS}")
+
         strategy.set_dwx(self.dwx)
+        strategy.set_clock(self.clock)
+        strategy.set_scheduler(self.scheduler)
         strategy.initialize()
         self.strategies.append(strategy)
 
+        handler = strategy
+        if threaded:
+            handler = StrategyWorker(strategy, queue_size or QUEUE_SIZE, clock=self.clock)
+            self.workers.append(handler)
+        self._route(handler, strategy.events, strategy.symbols)
+
+    def _route(self, handler, events, symbols):
+        for event in events:
+            if event != 'tick':
+                self._routes[event].append(getattr(handler, f'on_{event}'))
+        if 'tick' not in events:
+            return
+
+        if symbols is None:
+            self._any_symbol.append(handler.on_tick)
+            for handlers in self._tick_routes.values():
+                handlers.append(handler.on_tick)
+        else:
+            for symbol in symbols:
+                self._tick_routes.setdefault(symbol, list(self._any_symbol)).append(handler.on_tick)
+            if not self.symbols.issuperset(symbols):
+                self.symbols.update(symbols)
+                self.dwx.subscribe_symbols(sorted(self.symbols))
+
     def on_tick(self, symbol, bid, ask):
-        """Route tick data to all registered strategies."""
-        for strategy in self.strategies:
-            strategy.on_tick(symbol, bid, ask)
+        """Route tick data to the strategies taking ticks of `symbol`."""
+        if isinstance(self.clock, CachedClock):
+            self.clock.refresh()
+        for on_tick in self._tick_routes.get(symbol, self._any_symbol):
+            on_tick(symbol, bid, ask)
 
     def on_message(self, message):
-        """Route messages to all registered strategies."""
-        for strategy in self.strategies:
-            strategy.on_message(message)
+        """Route messages to the strategies handling them."""
+        if isinstance(self.clock, CachedClock):
+            self.clock.refresh()
+        for on_message in self._routes['message']:
+            on_message(message)
 
     def on_order_event(self):
-        """Route order events to all registered strategies."""
+        """Route order events to the strategies handling them."""
+        if isinstance(self.clock, CachedClock):
+            self.clock.refresh()
+        for on_order_event in self._routes['order_event']:
+            on_order_event()
+
+    def stop(self):
+        """Stop all registered strategies and the trading client."""
         for strategy in self.strategies:
-            strategy.on_order_event()
+            strategy.stop()
+        for worker in self.workers:
+            worker.stop()
+        self.scheduler.stop()
+        self.dwx.ACTIVE = False
 
 
 class CassandraTickProcessor(Strategy):
     """Base Cassandra trading strategy class."""
 
-    def __init__(self, dwx=None):
-        super().__init__(dwx)
+    # Orders run on timers, so only the order flow is needed
+    events = ('message', 'order_event')
+    symbols = (SYMBOL,)
+
+    def __init__(self, dwx=None, clock=None, scheduler=None, orders_dir=ORDERS_DIR):
+        """
+        :param orders_dir: Where the strategy keeps a file per order it found (a replay
+            should use its own, e.g. `MT4Simulator.orders_dir`).
+        """
+        super().__init__(dwx, clock, scheduler)
+        self.orders_dir = Path(orders_dir)
         self.master_orders_collector = {}
         self.order_id = None
         self.lots = TD_LOT_SIZE
         self.executed_order_time = None
         self.order_sent = False
         self.check_order_closed = False
-        self.order_close_dt = None
-        self.last_order_close_trial_dt = None
+        self.order_close_ns = None
+        self.last_order_close_trial_ns = None
 
         # Default to TD settings, will be overridden in subclasses
         self.open_hour = TD_OPEN_HOUR
@@ -178,34 +318,51 @@ class CassandraTickProcessor(Strategy):
         self.comment = COMMENT_PATTERN.format('TD', VERSION)
         self.magic_number = TD_CASSANDRA_MAGIC_NUMBER
 
-        self.open_time = None
-        self.close_time = None
+        # Next open/close instants as int64 ns UTC, each with a scheduler timer
+        self.calendar = None
+        self.open_ns = None
+        self.close_ns = None
+        self._timers = {}
+        # Timers fire on the scheduler thread while messages and order events arrive on the
+        # client's: each of them holds this lock, so the order state is only changed by one
+        self._order_lock = RLock()
+
+    @property
+    def open_time(self):
+        return self._ny_datetime(self.open_ns)
+
+    @property
+    def close_time(self):
+        return self._ny_datetime(self.close_ns)
+
+    @staticmethod
+    def _ny_datetime(ns):
+        if ns is None:
+            return None
+        return datetime.fromtimestamp(ns // NS_PER_SECOND, tz=ZoneInfo("America/New_York"))
 
     def initialize(self):
         """Initialize the strategy and look for existing orders."""
-        super().initialize()
-        self._setup_order_timing()
-        self._scan_market_for_order()
+        with self._order_lock:
+            super().initialize()
+            # Built here since subclasses set their session hours after the base constructor
+            self.calendar = SessionCalendar({
+                'open': (self.open_hour, self.open_minute),
+                'close': (self.close_hour, self.close_minute),
+            })
+            self._setup_order_timing()
+            self._scan_market_for_order()
 
     def _setup_order_timing(self):
         """Set up order timing based on strategy parameters."""
         if self.order_id is not None:
             return  # Don't update if there's an active order
 
-        now_ny = datetime.now(tz=ZoneInfo("America/New_York"))
-        self.open_time = now_ny.replace(hour=self.open_hour, minute=self.open_minute, second=0, microsecond=0)
-        self.close_time = now_ny.replace(hour=self.close_hour, minute=self.close_minute, second=0, microsecond=0)
-
-        # If the open time has already passed today, schedule for the next day
-        if now_ny >= self.open_time:
-            self.open_time += timedelta(days=1)
-            self.close_time += timedelta(days=1)
-
-        # Adjust for weekends
-        if self.open_time.weekday() >= 5:  # Weekend
-            days_to_add = (7 - self.open_time.weekday()) + (0 if self.open_time.weekday() == 6 else 1)
-            self.open_time += timedelta(days=days_to_add)
-            self.close_time += timedelta(days=days_to_add)
+        # Next weekday open still ahead of us, and the first close after it
+        self.open_ns = self.calendar.next('open', self.clock.time_ns())
+        self.close_ns = self.calendar.next('close', self.open_ns)
+        self._schedule('open', self.open_ns, self._on_open_time)
+        self._schedule('close', self.close_ns, self._on_close_time)
 
     def _scan_market_for_order(self):
         """Scan for existing orders in the market."""
@@ -221,7 +378,7 @@ class CassandraTickProcessor(Strategy):
                     logger.error(f"Error parsing open_time for order {order_id}: {e}")
                     continue
 
-                order_file = ORDERS_DIR / f'{order_id}_cassandra.json'
+                order_file = self.orders_dir / f'{order_id}_cassandra.json'
 
                 if order_file.is_file():
                     try:
@@ -241,23 +398,24 @@ class CassandraTickProcessor(Strategy):
                     order['order_id'] = order_id
 
                     try:
+                        self.orders_dir.mkdir(parents=True, exist_ok=True)
                         with order_file.open('w') as fp:
                             json.dump(order, fp, indent=4)
                     except Exception as e:
                         logger.error(f"Error writing order file {order_file}: {e}")
 
                 # Update close time based on execution time
-                dt_ref = self.executed_order_time
-                self.close_time = datetime(
-                    dt_ref.year, dt_ref.month, dt_ref.day,
-                    self.close_hour, self.close_minute,
-                    tzinfo=ZoneInfo("America/New_York")
-                )
+                self.close_ns = self.calendar.next('close', self.executed_order_time)
 
-                if datetime.now(tz=ZoneInfo("America/New_York")) > self.close_time:
+                now = self.clock.time_ns()
+                if now > self.close_ns:
+                    # Overdue (e.g. found after a restart): straight to the retries
                     self.check_order_closed = True
-                    self.order_close_dt = self.close_time
-                    self.last_order_close_trial_dt = self.close_time
+                    self.order_close_ns = self.close_ns
+                    self.last_order_close_trial_ns = self.close_ns
+                    self._schedule('retry', now, self._retry_close)
+                elif not self.check_order_closed:
+                    self._schedule('close', self.close_ns, self._on_close_time)
 
                 logger.info(f"{self.comment} order found ({order_id}): {order}")
 
@@ -265,74 +423,111 @@ class CassandraTickProcessor(Strategy):
         """Check if current state is valid for trading."""
         return True
 
-    def on_tick(self, symbol, bid, ask):
-        """Process tick data for trading decisions."""
-        now = datetime.now(tz=ZoneInfo("America/New_York"))
-        td_position_opened = self.order_id is not None
-
-        # Check if it's time to open an order
-        if (self.open_time <= now < (self.open_time + timedelta(seconds=TIME_TOLERANCE_WINDOW))
-                and not td_position_opened and not self.order_sent and self.valid_state()):
-            self.dwx.open_order(
-                symbol=SYMBOL,
-                order_type='buy',
-                lots=self.lots,
-                magic=self.magic_number,
-                comment=self.comment
-            )
-            self.order_sent = True
+    def on_tick(self, symbol, bid, ask, time_ns=None):
+        """Process tick data; opens and closes run off scheduler timers, so there is nothing to do per tick."""
+
+    def _schedule(self, name, when_ns, callback):
+        """(Re)arm the strategy's `name` timer."""
+        timer = self._timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[name] = self.scheduler.call_at(when_ns, callback)
+
+    def _cancel(self, name):
+        timer = self._timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _on_open_time(self):
+        """Open the position at the session open (unless late, e.g. after a suspend)."""
+        with self._order_lock:
+            now = self.clock.time_ns()
+            if (now < self.open_ns + TIME_TOLERANCE_WINDOW * NS_PER_SECOND
+                    and self.order_id is None and not self.order_sent and self.valid_state()):
+                self.dwx.open_order(
+                    symbol=SYMBOL,
+                    order_type='buy',
+                    lots=self.lots,
+                    magic=self.magic_number,
+                    comment=self.comment
+                )
+                self.order_sent = True
+
+    def _on_close_time(self):
+        """Close the position at the session close, then keep retrying until it is closed."""
+        with self._order_lock:
+            if self.order_id is None:
+                # Nothing was opened (or filled) this session: arm the next one
+                self.order_sent = False
+                self._setup_order_timing()
+                return
+            if self.check_order_closed:
+                return
 
-        # Check if it's time to close an order
-        elif now >= self.close_time and td_position_opened and not self.check_order_closed:
+            now = self.clock.time_ns()
             self.dwx.close_order(
                 ticket=self.order_id,
                 lots=self.lots
             )
             self.check_order_closed = True
-            self.order_close_dt = now
-            self.last_order_close_trial_dt = now
-            logger.info(f"[{self.comment}] Buy Time: {self.executed_order_time}, Sell Time: {now}")
-
-        # Retry closing order if needed
-        if self.order_id and self.check_order_closed:
-            if now - self.last_order_close_trial_dt > timedelta(seconds=10):
-                self.last_order_close_trial_dt = now
+            self.order_close_ns = now
+            self.last_order_close_trial_ns = now
+            logger.info(f"[{self.comment}] Buy Time: {self.executed_order_time}, Sell Time: {self._ny_datetime(now)}")
+            self._schedule('retry', now + CLOSE_RETRY_INTERVAL * NS_PER_SECOND, self._retry_close)
+
+    def _retry_close(self):
+        """Retry closing every CLOSE_RETRY_INTERVAL until the close is confirmed."""
+        with self._order_lock:
+            if not (self.order_id and self.check_order_closed):
+                return
+            now = self.clock.time_ns()
+            self.last_order_close_trial_ns = now
 
-                if now - self.order_close_dt < timedelta(minutes=4):
+            if now - self.order_close_ns < CLOSE_RETRY_WINDOW * NS_PER_SECOND:
+                self.dwx.close_order(ticket=self.order_id, lots=self.lots)
+            else:
+                # Close only if profitable after 4 minutes
+                if self.dwx.open_orders.get(self.order_id, {}).get('pnl', 0) > 0:
                     self.dwx.close_order(ticket=self.order_id, lots=self.lots)
-                else:
-                    # Close only if profitable after 4 minutes
-                    if self.dwx.open_orders.get(self.order_id, {}).get('pnl', 0) > 0:
-                        self.dwx.close_order(ticket=self.order_id, lots=self.lots)
+            self._schedule('retry', now + CLOSE_RETRY_INTERVAL * NS_PER_SECOND, self._retry_close)
 
     def on_message(self, message):
         """Process messages from the trading client."""
-        msg_type = message.get('type')
-
-        if msg_type == 'ERROR':
-            logger.error(f"{msg_type} | {message.get('error_type')} | {message.get('description')}")
-        elif msg_type == 'INFO':
-            logger.info(f"{msg_type} | {message.get('message')}")
-
-            # Check if our order was closed
-            if ('Successfully closed order' in message.get('message', '') and
-                    str(self.order_id) in message.get('message', '')):
-                self.check_order_closed = False
-                self.order_sent = False
-                self.order_id = None
-                self._setup_order_timing()
+        with self._order_lock:
+            msg_type = message.get('type')
+
+            if msg_type == 'ERROR':
+                logger.error(f"{msg_type} | {message.get('error_type')} | {message.get('description')}")
+            elif msg_type == 'INFO':
+                logger.info(f"{msg_type} | {message.get('message')}")
+
+                # Check if our order was closed
+                if ('Successfully closed order' in message.get('message', '') and
+                        str(self.order_id) in message.get('message', '')):
+                    self.check_order_closed = False
+                    self.order_sent = False
+                    self.order_id = None
+                    self._cancel('retry')
+                    self._setup_order_timing()
 
     def on_order_event(self):
         """Handle order events."""
-        logger.info(f"on_order_event. Open orders count: {len(self.dwx.open_orders)}")
-        self._scan_market_for_order()
+        with self._order_lock:
+            logger.info(f"on_order_event. Open orders count: {len(self.dwx.open_orders)}")
+            self._scan_market_for_order()
+
+    def stop(self):
+        """Cancel the strategy's timers."""
+        with self._order_lock:
+            for name in list(self._timers):
+                self._cancel(name)
 
 
 class TDCassandraTickProcessor(CassandraTickProcessor):
     """TD (Trading Day) Cassandra strategy implementation."""
 
-    def __init__(self, dwx=None):
-        super().__init__(dwx)
+    def __init__(self, dwx=None, clock=None, scheduler=None, orders_dir=ORDERS_DIR):
+        super().__init__(dwx, clock, scheduler, orders_dir)
 
         # Override with TD-specific settings
         self.open_hour = TD_OPEN_HOUR
@@ -352,8 +547,20 @@ class ONCassandraTickProcessor(CassandraTickProcessor):
                  nti=FIBONACCI_TOP_PRICE,
                  Zin=INITIAL_STATE_VALUE,
                  Vstr=INHIBIT_STATES,
-                 Zdin=INITIAL_STATE_DATE):
-        super().__init__(dwx)
+                 Zdin=INITIAL_STATE_DATE,
+                 state_dir=STATE_DIR,
+                 bar_provider=None,
+                 bar_symbol=TICKER_SYMBOL,
+                 clock=None,
+                 scheduler=None,
+                 orders_dir=ORDERS_DIR):
+        """
+        :param nbi: Fibonacci base price. If it differs from the one the zone store was
+            last started with, the levels switch to it from now on, as with `reanchor`;
+            otherwise the anchors in force are kept, including any set by `reanchor`.
+        :param nti: Fibonacci top price, likewise.
+        """
+        super().__init__(dwx, clock, scheduler, orders_dir)
 
         # Override with ON-specific settings
         self.open_hour = ON_OPEN_HOUR
@@ -364,7 +571,7 @@ class ONCassandraTickProcessor(CassandraTickProcessor):
         self.comment = COMMENT_PATTERN.format('ON', VERSION)
         self.magic_number = ON_CASSANDRA_MAGIC_NUMBER
 
-        # Fibonacci parameters
+        # Fibonacci parameters (the anchors in force are settled with the zone store below)
         self.nbi = nbi  # Fibonacci base price
         self.nti = nti  # Fibonacci top price
         self.Zin = Zin  # Initial state value
@@ -372,66 +579,89 @@ class ONCassandraTickProcessor(CassandraTickProcessor):
         self.Vstr = Vstr  # Inhibit state list
         self.Z = None
         self.V = Vstr
-        self.Zs = []
-        self.Zdts = []
-        self.Zs_close = []
+
+        # Hourly bars come from Yahoo Finance through an on-disk cache unless a provider is given
+        if bar_provider is None:
+            bar_provider = CachedBarProvider(YahooBarProvider(), Path(state_dir) / 'bars', self.clock)
+        self.bar_provider = bar_provider
+        self.bar_symbol = bar_symbol
+        if isinstance(bar_provider, TickBarProvider):
+            # Build the hourly bars from our own broker's ticks
+            self.events = EVENTS
+
+        # Persistent Z history with the schedule of every anchor version, so levels switched
+        # by `reanchor` survive restarts
+        self.zone_store = ZoneStateStore(Path(state_dir) / 'zones')
+        self._zdts = None  # (store version, Zdts)
+        self._settle_anchors(nbi, nti)
 
         # Global variables for Fibonacci levels
         self.fibo_levels = {}
         self._calculate_fibonacci_levels()
 
         # Create timestamp for file naming
-        self.timestamp_str = datetime.now(tz=ZoneInfo("UTC")).strftime("%Y%m%d_%H%M%S")
+        self.timestamp_str = self.clock.now(tz=ZoneInfo("UTC")).strftime("%Y%m%d_%H%M%S")
 
         # Save initial data
         self.save_fibo_levels_to_csv()
 
-        # State tracking
-        self.last_trading_times_update = time.time()  # For periodic updates
+        # State tracking; later refreshes run on a scheduler timer, off the tick thread
+        self._state_lock = Lock()
         self.update_state()
         self.save_state_data_to_csv()
 
+    def set_clock(self, clock):
+        super().set_clock(clock)
+        if isinstance(self.bar_provider, CachedBarProvider):
+            # Its coverage cut-off must follow the strategy's time
+            self.bar_provider.clock = clock
+
     def initialize(self):
         """Initialize the ON strategy."""
-        self.last_trading_times_update = time.time()
         super().initialize()
+        with self._order_lock:
+            self._timers['refresh'] = self.scheduler.call_every(STATE_REFRESH_INTERVAL * NS_PER_SECOND,
+                                                                self.refresh_state, offload=True)
+
+    def _settle_anchors(self, nbi, nti):
+        """
+        Settle the configured anchors with the zone store's.
+
+        Anchors other than those the store was last started with (e.g. an edited
+        FIBONACCI_BASE_PRICE) are switched to from now on; unchanged ones keep the
+        anchors in force, so a runtime `reanchor` survives restarts.
+        """
+        store = self.zone_store
+        configured = (float(nbi), float(nti))
+        current = store.schedule.current if store.schedule is not None else store.anchors
+
+        if current is None:
+            if len(store):
+                logger.info("Stored zones have unknown anchors - recomputing them")
+                store.recompute(LevelSchedule.single(*configured), anchors=configured)
+            else:
+                store.schedule = LevelSchedule.single(*configured)
+                store.anchors = store.schedule.current
+        elif configured != (store.configured_anchors or tuple(current)):
+            logger.info(f"Fibonacci anchors changed to {configured} (in force: {tuple(current)}) - "
+                        f"switching to them from now on")
+            store.reanchor(self.clock.now(tz=ZoneInfo("UTC")), *configured)
+        else:
+            if tuple(current) != configured:
+                logger.info(f"Keeping the Fibonacci anchors {tuple(current)} set by reanchor")
+            if store.schedule is None:
+                store.schedule = LevelSchedule.single(*current)
+            store.anchors = tuple(current)
 
-    def _setup_order_timing(self):
-        """Set up order timing for ON strategy."""
-        super()._setup_order_timing()
-
-        if self.order_id is None:  # Only update if no active order
-            self.close_time += timedelta(days=1)
-
-            # Adjust for weekends
-            if self.close_time.weekday() >= 5:
-                days_to_add = (7 - self.close_time.weekday()) + (0 if self.close_time.weekday() == 6 else 1)
-                self.close_time += timedelta(days=days_to_add)
+        store.configured_anchors = configured
+        store.flush()
+        self.nbi, self.nti = store.anchors
 
     def _calculate_fibonacci_levels(self):
         """Calculate all Fibonacci levels based on the base and top prices."""
-        # Input validation
-        if self.nti <= self.nbi:
-            raise ValueError("'nti' must be greater than 'nbi' for Fibonacci calculations")
-
-        # Calculate price range
-        size_ = self.nti - self.nbi
-
-        # Store all Fibonacci levels in a dictionary
-        self.fibo_levels = {
-            'fibo_base': self.nbi,
-            'fibo_38': self.nbi + 0.382 * size_,
-            'fibo_50': self.nbi + 0.50 * size_,
-            'fibo_61': self.nbi + 0.618 * size_,
-            'fibo_top': self.nti,
-            'fibo_138': self.nbi + 1.382 * size_,
-            'fibo_150': self.nbi + 1.50 * size_,
-            'fibo_161': self.nbi + 1.618 * size_,
-            'fibo_200': self.nbi + 2.0 * size_,
-            'fibo_n200': self.nbi - 1.0 * size_,
-            'fibo_n161': self.nbi - 0.618 * size_,
-            'fibo_n138': self.nbi - 0.382 * size_
-        }
+        # Raises ValueError unless nti > nbi
+        self.fibo_levels = fibonacci_levels(self.nbi, self.nti)
+        self.zone_engine = ZoneEngine(self.fibo_levels)
 
         # Also set individual attributes for backward compatibility
         for key, value in self.fibo_levels.items():
@@ -449,16 +679,34 @@ class ONCassandraTickProcessor(CassandraTickProcessor):
         df.to_csv(filename, index=False)
         logger.info(f"Saved Fibonacci levels to {filename}")
 
+    @property
+    def Zs(self):
+        """Zones of the stored bars, as a read-only view of the zone store's column."""
+        return _read_only(self.zone_store.zones)
+
+    @property
+    def Zdts(self):
+        """New York times of the stored bars, converted once per change of the zone store."""
+        store = self.zone_store
+        if self._zdts is None or self._zdts[0] != store.version:
+            self._zdts = (store.version, from_ns(store.times))
+        return self._zdts[1]
+
+    @property
+    def Zs_close(self):
+        """Closes of the stored bars, as a read-only view of the zone store's column."""
+        return _read_only(self.zone_store.closes)
+
     def save_state_data_to_csv(self):
         """Save state arrays to CSV with timestamp."""
-        if not self.Zs or len(self.Zs) != len(self.Zdts) or len(self.Zs) != len(self.Zs_close):
-            logger.warning("State arrays are empty or of unequal length - skipping CSV export")
+        if not len(self.zone_store):
+            logger.warning("State arrays are empty - skipping CSV export")
             return
 
         state_data = {
-            'Z': self.Zs,
-            'Zdt': self.Zdts,
-            'Z_close': self.Zs_close
+            'Z': self.zone_store.zones,
+            'Zdt': from_ns(self.zone_store.times),
+            'Z_close': self.zone_store.closes
         }
 
         df = pd.DataFrame(state_data)
@@ -466,154 +714,101 @@ class ONCassandraTickProcessor(CassandraTickProcessor):
         df.to_csv(filename, index=False)
         logger.info(f"Saved state data to {filename}")
 
+    def refresh_state(self):
+        """Update the Z history and publish yesterday's milestone Z (runs on a scheduler timer thread)."""
+        with self._state_lock:
+            self.update_state()
+            self._update_milestone_zone()
+
+    def reanchor(self, nbi, nti, when=None):
+        """
+        Switch the Fibonacci levels at runtime, effective from `when` (default: now).
+
+        Only the zones of the bars at or after `when` are recomputed; earlier
+        zones and the previous level sets are kept in the zone store's schedule.
+        The strategy takes the store's anchors in force afterwards, so a switch
+        back-dated before a later version leaves that version's levels current.
+        """
+        if when is None:
+            when = self.clock.now(tz=ZoneInfo("UTC"))
+
+        with self._state_lock:
+            # Raises ValueError unless nti > nbi, before anything is changed
+            self.zone_store.reanchor(when, nbi, nti)
+            self.zone_store.flush()
+
+            self.nbi, self.nti = self.zone_store.anchors
+            self._calculate_fibonacci_levels()
+            self.save_fibo_levels_to_csv()
+            self._update_milestone_zone()
+
+    def _update_milestone_zone(self):
+        """Publish the Z of yesterday's milestone candle."""
+        # Get yesterday's state at market close
+        nyc_yesterday_milestone_date = get_nyc_yesterday_milestone_date(self.clock)
+
+        # Find the closest state to the milestone date
+        Z = self.zone_store.zone_at(nyc_yesterday_milestone_date, method='nearest',
+                                    tolerance=MILESTONE_TOLERANCE_WINDOW)
+
+        if Z is not None:
+            # A single attribute assignment, so on_tick never sees a partial update
+            self.Z = Z
+            logger.info(f"New Z state: {self.Z}")
+            self.save_state_data_to_csv()
+        else:
+            logger.warning(f"No state data near {nyc_yesterday_milestone_date} available to update Z")
+
     def update_state(self, verbose=False):
         """Update state based on market data."""
         # Determine date range for the data fetch
-        if len(self.Zs) == 0:
+        last = self.zone_store.last()
+        if last is None:
             start_date = "2025-01-01"
         else:
             # Get last date and go back 3 days to ensure overlap
-            start_date = (self.Zdts[-1] - timedelta(days=3)).strftime("%Y-%m-%d")
+            start_date = (from_ns([last[0]])[0] - timedelta(days=3)).strftime("%Y-%m-%d")
 
-        end_date = datetime.now().strftime("%Y-%m-%d")
+        end_date = self.clock.now().strftime("%Y-%m-%d")
 
-        # Download the data
+        # Fetch the bars (only missing ranges go to the network)
         try:
-            data = yf.download(TICKER_SYMBOL, start=start_date, end=end_date, interval="1h")
-            if data.empty:
-                logger.warning("No data returned from Yahoo Finance")
+            bars = self.bar_provider.get_bars(self.bar_symbol, '1h', start_date, end_date)
+            if not len(bars):
+                logger.warning("No data returned from the bar provider")
                 return
         except Exception as e:
-            logger.error(f'Yahoo Finance API error: {e}')
+            logger.error(f'Bar provider error: {e}')
             return
 
-        # Process the data
-        df = data.reset_index()
-        df.columns = ['Datetime', 'Close', 'High', 'Low', 'Open', 'Volume']
-        df_dict = df.to_dict(orient='records')
-
-        # Convert times to NYC timezone
-        nyc_tz = pytz.timezone('America/New_York')
-        for item in df_dict:
-            item['Datetime'] = item['Datetime'].to_pydatetime().astimezone(nyc_tz)
-
-        # Handle overlap with existing data
-        if len(self.Zs):
-            # Find where to start in the existing data (avoid duplicates)
-            for idx, Zdt in enumerate(self.Zdts):
-                if Zdt >= df_dict[0]['Datetime']:
-                    break
-            else:
-                idx = 0
-
-            # Truncate existing data to avoid duplicates
-            if idx > 0:
-                self.Zs = self.Zs[:idx]
-                self.Zdts = self.Zdts[:idx]
-                self.Zs_close = self.Zs_close[:idx]
-
-        # Initialize state tracking variables
-        if len(self.Zs):
-            Z_close_prev = self.Zs_close[-1]
-            Z = self.Zs[-1]
-        else:
-            Z_close_prev, Z = 0.0, 0
-
-        # Process each data point
-        for item in df_dict:
-            Z = self._compute_state(ref_price=item['Close'], prev_ref_price=Z_close_prev, Z=Z)
-            Z_close_prev = item['Close']
-            self.Zs.append(Z)
-            self.Zdts.append(item['Datetime'])
-            self.Zs_close.append(item['Close'])
+        # Replace the overlapping bars and compute zones for the new ones only,
+        # with the levels in force at each bar
+        self.zone_store.merge(bars.time, bars.close, self.zone_store.schedule)
+        self.zone_store.flush()
 
     def _compute_state(self, ref_price: float, prev_ref_price: float, Z: int, verbose=False):
         """Compute state based on price crossing Fibonacci levels."""
-        # Use dictionary of transition conditions to simplify code
-        bearish_transitions = [
-            (self.fibo_n200, -5),
-            (self.fibo_n161, -3),
-            (self.fibo_n138, -1),
-            (self.fibo_base, 1),
-            (self.fibo_38, 3),
-            (self.fibo_50, 5),
-            (self.fibo_61, 7),
-            (self.fibo_top, 9),
-            (self.fibo_138, 11),
-            (self.fibo_161, 13),
-            (self.fibo_200, 15)
-        ]
-
-        bullish_transitions = [
-            (self.fibo_200, 16),
-            (self.fibo_161, 14),
-            (self.fibo_138, 12),
-            (self.fibo_top, 10),
-            (self.fibo_61, 8),
-            (self.fibo_50, 6),
-            (self.fibo_38, 4),
-            (self.fibo_base, 2),
-            (self.fibo_n138, 0),
-            (self.fibo_n161, -2),
-            (self.fibo_n200, -4)
-        ]
-
-        # Check bearish transitions (crossing down)
-        for level, new_state in bearish_transitions:
-            if ref_price < level and prev_ref_price >= level:
-                Z = new_state
-                break
-
-        # Check bullish transitions (crossing up)
-        for level, new_state in bullish_transitions:
-            if ref_price > level and prev_ref_price <= level:
-                Z = new_state
-                break
+        Z = self.zone_engine.step(ref_price, prev_ref_price, Z)
 
         if verbose:
             logger.debug(f"Price: {ref_price:.2f} Prev: {prev_ref_price:.2f} State: {Z}")
 
         return Z
 
-    def _scan_market_for_order(self):
-        super()._scan_market_for_order()
-        if self.order_id is None : # Update only if there is no market order.
-            self.close_time += timedelta(days=1)
-            # Adjust for weekends (assuming trading on Monday if order falls on Saturday/Sunday)
-            if self.close_time.weekday() >= 5:
-                days_to_add = (7 - self.close_time.weekday())
-                self.close_time += timedelta(days=days_to_add)
-
     def valid_state(self):
         """Check if current state allows for trading."""
         return self.Z not in self.V
 
-    def on_tick(self, symbol, bid, ask):
-        """Process tick data for ON strategy."""
-        # Call parent implementation
-        super().on_tick(symbol, bid, ask)
-
-        # Check if it's time to update state (every 2 hours)
-        current_time = time.time()
-        if current_time - self.last_trading_times_update > 2 * 3600:
-            self.last_trading_times_update = current_time
-
-            # Update state
-            self.update_state()
-
-            # Get yesterday's state at market close
-            nyc_yesterday_milestone_date = get_nyc_yesterday_milestone_date()
+    def on_tick(self, symbol, bid, ask, time_ns=None):
+        """Process tick data for ON strategy; Z is kept current by the state refresh timer."""
+        # Only routed here with a TickBarProvider, which needs every tick at its arrival time
+        self.bar_provider.on_tick(self.clock.time_ns() if time_ns is None else time_ns, bid, ask)
 
-            # Find the closest state to the milestone date
-            dt_Z_pairs = list(zip(self.Zdts, self.Zs))
-            dt_Z_pairs.sort(key=lambda x: abs((x[0] - nyc_yesterday_milestone_date).total_seconds()))
-
-            if dt_Z_pairs:
-                self.Z = dt_Z_pairs[0][1]
-                logger.info(f"New Z state: {self.Z}")
-                self.save_state_data_to_csv()
-            else:
-                logger.warning("No state data available to update Z")
+    def stop(self):
+        """Cancel the timers and store the bars built from ticks so far."""
+        super().stop()
+        if isinstance(self.bar_provider, TickBarProvider):
+            self.bar_provider.save()
 
 
 def main():
@@ -621,14 +816,20 @@ def main():
     # MT4 files directory path
     MT4_FILES_DIR = r'C:\Users\maxim\AppData\Roaming\MetaQuotes\Terminal\33F10EB7DA1E64855A7E700316574D86\MQL4\Files'
 
-    # Create tick processor
+    # Create tick processor (event_driven=True waits for file changes instead of polling,
+    # e.g. when running MT4 under Wine on Linux)
     processor = TickProcessor(MT4_FILES_DIR)
 
     # Create strategies
     td_strat = TDCassandraTickProcessor()
     on_strat = ONCassandraTickProcessor()
+    # To compute the zones from the broker's own SPXm bars instead of Yahoo's ^GSPC
+    # (backfill the store first with `python bar_aggregator.py`):
+    # from bar_store import BarStore
+    # on_strat = ONCassandraTickProcessor(bar_provider=TickBarProvider(BarStore('./data/store'), SYMBOL),
+    #                                     bar_symbol=SYMBOL)
 
-    # Register strategies
+    # Register strategies (threaded=True runs one on its own worker thread)
     processor.set_strategy(td_strat)
     processor.set_strategy(on_strat)
 
@@ -640,7 +841,7 @@ def main():
     except KeyboardInterrupt:
         logger.info("Shutting down Cassandra trading system...")
     finally:
-        processor.dwx.ACTIVE = False
+        processor.stop()
         logger.info("Cassandra trading system stopped")
 
 
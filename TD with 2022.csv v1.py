@@ -6,15 +6,24 @@ import datetime
 import pytz
 import json
 
+from backtest import TD_SESSION, ColumnarBacktest, TDBacktest
+from bar_loader import load_bars
+from bar_store import BarStore
+from event_stream import EventStream, records
+from session_calendar import SessionCalendar, day_ordinal
+
 
 # #### Load the dataset
-data = pd.read_csv('./data/2022.csv', sep=';', parse_dates=['Date'], dayfirst=True)
-data['Date'] = pd.to_datetime(data['Date'], utc=True)
+# Bars come from the columnar store, imported from the CSV on the first run
+# (delete ./data/store to re-import); reads are memory-mapped, not parsed
+STORE_DIR = './data/store'
+SYMBOL = 'SPX'
 
-# data.set_index('time', inplace=True)
-data=data.loc[:, ['Date', 'open', 'high', 'low', 'close']]
-data.rename(columns={'Date': 'time'}, inplace=True)
-data.head(12)
+store = BarStore(STORE_DIR)
+if not store.days(SYMBOL, '1h'):
+    store.write(SYMBOL, '1h', load_bars('./data/2022.csv'))
+bars = store.read(SYMBOL, '1h')
+bars.to_frame().head(12)
 
 
 # #### TD bot code
@@ -30,8 +39,12 @@ class TDTradingBot:
 
         self.verbose = verbose
         self.market_timezone = pytz.timezone(market_timezone)
+        self.calendar = SessionCalendar(TD_SESSION)
+        self.trading_day = None
         self.buy_time = None
-        self.close_time = None
+        self.sell_time = None
+        self.buy_ns = None
+        self.sell_ns = None
         self.position_open = False
         self.last_candle_time = None
         self.set_trading_times(datetime.datetime.now(self.market_timezone))
@@ -67,11 +80,11 @@ class TDTradingBot:
         """
 
         ts = current_time.astimezone(self.market_timezone)
-        ny_timezone = pytz.timezone('America/New_York')
-        aware_datetime = ny_timezone.localize(datetime(ts.year, ts.month, ts.day, 9+2+1, 0))
-        self.buy_time = aware_datetime.astimezone(self.market_timezone).time()
-        aware_datetime = ny_timezone.localize(datetime(ts.year, ts.month, ts.day, 9+7+1, 55))
-        self.sell_time = aware_datetime.astimezone(self.market_timezone).time()
+        self.trading_day = day_ordinal(ts)
+        self.buy_ns = self.calendar.instant('buy', self.trading_day)
+        self.sell_ns = self.calendar.instant('sell', self.trading_day)
+        self.buy_time = pd.Timestamp(self.buy_ns, tz='UTC').tz_convert(self.market_timezone).time()
+        self.sell_time = pd.Timestamp(self.sell_ns, tz='UTC').tz_convert(self.market_timezone).time()
 
         if verbose:
             print(f"[TDTradingBot] Buy Time: {self.buy_time}, Sell Time: {self.sell_time}")
@@ -87,19 +100,20 @@ class TDTradingBot:
                        Example: {'time': datetime_object, 'close': price}
         """
         candle_time = candle['time'].astimezone(self.market_timezone)
-        candle_hour = candle_time.time()
+        candle_ns = candle['time'].value
         self.last_candle_time = candle_time
 
-        # Update trading times in case of DST change
-        self.set_trading_times(candle_time)
+        # Update trading times when the day changes (DST is handled by the calendar)
+        if day_ordinal(candle_time) != self.trading_day:
+            self.set_trading_times(candle_time)
 
         # Check if it's time to buy
-        if candle_hour == self.buy_time and not self.position_open:
+        if candle_ns == self.buy_ns and not self.position_open:
             self.execute_order('BUY', candle['close'], candle_time)
             self.position_open = True
 
         # Check if it's time to sell
-        elif candle_hour == self.close_time and self.position_open:
+        elif candle_ns == self.sell_ns and self.position_open:
             self.execute_order('STOP', candle['close'], candle_time)
             self.position_open = False
 
@@ -164,26 +178,16 @@ class TDTradingBot:
     def run(self, candles, ticks):
         """
         Simulates running the bot with streams of candles and ticks.
-        This is a simple simulation where candles and ticks are processed in order.
+        The streams are merged lazily in time order (see event_stream.EventStream);
+        a candle goes before the ticks at its time.
 
-        :param candles: List of candle dictionaries.
-        :param ticks: List of tick dictionaries.
+        :param candles: Time-ordered iterable of candle dictionaries.
+        :param ticks: Time-ordered iterable of tick dictionaries.
         """
-        # Sort candles and ticks by time
-        candles_sorted = sorted(candles, key=lambda x: x['time'])
-        ticks_sorted = sorted(ticks, key=lambda x: x['time'])
-
-        i, j = 0, 0
-        while i < len(candles_sorted) or j < len(ticks_sorted):
-            next_candle_time = candles_sorted[i]['time'] if i < len(candles_sorted) else None
-            next_tick_time = ticks_sorted[j]['time'] if j < len(ticks_sorted) else None
-
-            if next_candle_time and (not next_tick_time or next_candle_time <= next_tick_time):
-                self.receive_hourly_candle(candles_sorted[i])
-                i += 1
-            elif next_tick_time:
-                self.receive_tick(ticks_sorted[j])
-                j += 1
+        events = EventStream()
+        events.add('candle', records(candles), self.receive_hourly_candle)
+        events.add('tick', records(ticks), self.receive_tick)
+        events.run()
 
     def get_orders(self):
         """
@@ -224,10 +228,9 @@ class TDTradingBot:
 # In[ ]:
 
 
-bot = TDTradingBot()
-
-for idx, row in data.iterrows():
-    bot.receive_hourly_candle(row)
+# Replay the candles on typed columns; TDBacktest reproduces TDTradingBot.receive_hourly_candle
+backtest = ColumnarBacktest(bars, market_timezone='Europe/Madrid')
+bot = backtest.run(TDBacktest(verbose=True))
 
 # Retrieve and print all orders
 orders = bot.get_orders()
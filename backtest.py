@@ -0,0 +1,477 @@
+import copy
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from fibo_zones import LevelSchedule, ZoneEngine, fibonacci_levels
+from fill_simulator import FillSimulator, simulated_fill
+from market_data import Bars
+from session_calendar import NS_PER_MINUTE, SessionCalendar, local_day_and_time
+
+
+# Session events in New York time; ON's milestone is the candle whose zone closes the session
+ON_SESSION = {'buy': (16, 0), 'sell': (9, 0), 'milestone': (16, 0)}
+TD_SESSION = {'buy': (9 + 2 + 1, 0), 'sell': (9 + 7 + 1, 55)}
+
+
+class ZoneCache:
+    """
+    LRU memo of zone sequences shared by backtest runs.
+
+    The hourly Z sequence only depends on the closes, the Fibonacci anchors and
+    the initial state, and the session-close zones additionally on the session
+    times - neither depends on the inhibit vector. Keys start with the bar data
+    fingerprint, then the anchors ((nbi, nti) or a schedule key), Z, ... Cached
+    arrays are read-only.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, compute):
+        """Return the cached value for `key`, calling `compute()` on a miss."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+        value = compute()
+        for array in value:
+            array.flags.writeable = False
+        self._entries[key] = value
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+
+# Process-wide default, so sweeps over V in one process share the zone sequences
+ZONE_CACHE = ZoneCache()
+
+
+def summarize_orders(orders):
+    """Total profit, trade count, hit rate and maximum drawdown of the equity curve of closed orders."""
+    profits = np.array([order['Profit'] for order in orders], dtype=np.float64)
+    if not profits.size:
+        return {'total_profit': 0.0, 'trades': 0, 'hit_rate': np.nan, 'max_drawdown': 0.0}
+
+    equity = np.cumsum(profits)
+    peak = np.maximum.accumulate(np.concatenate(([0.0], equity)))[1:]
+    return {
+        'total_profit': float(equity[-1]),
+        'trades': int(profits.size),
+        'hit_rate': float(np.mean(profits > 0)),
+        'max_drawdown': float(np.max(peak - equity)),
+    }
+
+
+def save_orders_to_json(orders, filename):
+    """Save orders to a JSON file, converting datetimes to ISO format."""
+    orders_serializable = []
+    for order in orders:
+        serializable_order = {}
+        for key, value in order.items():
+            if isinstance(value, datetime):
+                serializable_order[key] = value.isoformat()
+            else:
+                serializable_order[key] = value
+        orders_serializable.append(serializable_order)
+
+    with open(filename, 'w') as f:
+        json.dump(orders_serializable, f, indent=4)
+
+
+class ColumnarBacktest:
+    """
+    Event-driven backtest core over typed bar columns.
+
+    Local day/time columns are computed once for the whole data set. Each
+    strategy precomputes what it can in `prepare`, which returns a boolean mask
+    of the bars it needs to see (or None for all of them); only those bars are
+    walked, with plain Python scalars instead of pandas rows.
+    """
+
+    def __init__(self, bars: Bars, market_timezone='UTC'):
+        self.bars = bars
+        self.market_timezone = pytz.timezone(market_timezone) if isinstance(market_timezone, str) else market_timezone
+        self.day, self.time_of_day = local_day_and_time(bars.time, self.market_timezone)
+
+    @cached_property
+    def fingerprint(self) -> str:
+        """Hash of the bar times and closes, identifying the data in cache keys."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.ascontiguousarray(self.bars.time).tobytes())
+        digest.update(np.ascontiguousarray(self.bars.close).tobytes())
+        return digest.hexdigest()
+
+    @cached_property
+    def bar_ns(self) -> int:
+        """Most common spacing of the bars, in nanoseconds: the bar length."""
+        spacing, counts = np.unique(np.diff(self.bars.time), return_counts=True)
+        return int(spacing[np.argmax(counts)]) if spacing.size else 0
+
+    def timestamp(self, time_ns):
+        """Bar time as a timestamp in the market timezone."""
+        return pd.Timestamp(time_ns, tz='UTC').tz_convert(self.market_timezone)
+
+    def run(self, strategy):
+        mask = strategy.prepare(self)
+        index = np.arange(len(self.bars)) if mask is None else np.flatnonzero(mask)
+
+        bars = self.bars
+        on_bar = strategy.on_bar
+        for row in zip(index.tolist(),
+                       bars.time[index].tolist(),
+                       bars.open[index].tolist(),
+                       bars.high[index].tolist(),
+                       bars.low[index].tolist(),
+                       bars.close[index].tolist(),
+                       self.day[index].tolist()):
+            on_bar(*row)
+
+        strategy.finish(self)
+        return strategy
+
+
+class ONBacktest:
+    """
+    Columnar version of the ON (overnight) strategy of `ontd_fibo_v4.ONTradingBot`.
+
+    Buys at the close of the 16:00 NY candle unless the zone of the previous
+    session close is inhibited, and sells at the open of the 09:00 NY candle of
+    a later day (both configurable through `session`). Produces the same
+    orders, session log and status log.
+
+    Zone sequences are memoized in `zone_cache`. With `collect_logs=False` the
+    session and status logs are skipped and only buy/sell bars are walked,
+    which is what sweeps over the inhibit vector need.
+
+    A `schedule` (LevelSchedule) replaces nbi/nti to simulate re-anchoring:
+    each hourly candle is zoned with the levels in force at its time.
+
+    With `fills` (FillSimulator), orders are filled from ticks like the live
+    bot's instead of at the bar prices: the buy when the buy candle closes,
+    the sell when the sell candle opens.
+    """
+
+    def __init__(self, item='spxm', size=1, contract_size=1,
+                 nbi: float = 3594.52, nti: float = 4808.93,
+                 Z: int = 9, V=(3, 5, 6, 7, 9), session=ON_SESSION,
+                 session_debug: bool = True, collect_logs: bool = True, verbose: bool = False,
+                 zone_cache: ZoneCache = ZONE_CACHE, schedule: LevelSchedule = None,
+                 fills: FillSimulator = None):
+        self.item = item
+        self.size = size
+        self.contract_size = contract_size
+        self.nbi = nbi
+        self.nti = nti
+        self.Z = Z
+        self.V = set(V)
+        self.session_debug = session_debug
+        self.collect_logs = collect_logs
+        self.verbose = verbose
+        self.zone_cache = zone_cache
+        self.schedule = schedule
+        self.fills = fills
+
+        self.zone_engine = ZoneEngine(fibonacci_levels(nbi, nti))
+        self.calendar = SessionCalendar(session)
+        self.initial_prev_ref_price = 10000.0
+
+        # Commission and fees
+        self.commission = 3.0
+        self.taxes = 0.0
+        self.swap = 0.0
+
+        self.reset()
+
+    def reset(self):
+        self.position_open = False
+        self.close_fill_ns = None  # Fill time of the last close, which can come well after its decision
+        self.current_order = None
+        self.orders = []
+        self.ticket_counter = 1
+        self.open_day = None
+        self.prev_session_last_candle_zone = self.Z
+        self.current_session_last_candle_zone = self.Z
+        self.session_log = {}
+        self.session_log_collector = []
+        self.status_collector = []
+
+    def hourly_zones(self, backtest):
+        """Zone after each hourly candle (minute == 0), as (mask, zones)."""
+        hourly = (backtest.time_of_day // NS_PER_MINUTE) % 60 == 0
+        if self.schedule is not None:
+            zones = self.schedule.compute(backtest.bars.time[hourly], backtest.bars.close[hourly],
+                                          Z=self.Z, prev_close=self.initial_prev_ref_price)
+        else:
+            zones = self.zone_engine.compute(backtest.bars.close[hourly], Z=self.Z,
+                                             prev_close=self.initial_prev_ref_price)
+        return hourly, zones
+
+    def session_events(self, backtest, hourly, hourly_zones):
+        """
+        Per-bar session columns: (is_buy, is_sell, is_milestone, milestone zone,
+        session zone), where the session zone is the zone of the last milestone
+        strictly before the bar (the initial Z before the first one).
+        """
+        # Session instants of each bar's market day; bars match them exactly or not at all
+        times = backtest.bars.time
+        is_buy = times == self.calendar.instants('buy', backtest.day)
+        is_sell = times == self.calendar.instants('sell', backtest.day)
+        is_milestone = hourly & (times == self.calendar.instants('milestone', backtest.day))
+
+        zones = np.full(len(backtest.bars), self.Z, dtype=np.int8)
+        zones[hourly] = hourly_zones
+        closed = np.concatenate(([self.Z], zones[is_milestone])).astype(np.int8)
+        session_zones = closed[np.cumsum(is_milestone) - is_milestone]
+        return is_buy, is_sell, is_milestone, zones, session_zones
+
+    def prepare(self, backtest):
+        self.reset()
+        self._backtest = backtest
+
+        anchors = self.schedule.key if self.schedule is not None else (self.nbi, self.nti)
+        key = (backtest.fingerprint, anchors, self.Z, self.initial_prev_ref_price)
+        self._hourly, self._hourly_zones = self.zone_cache.get(key, lambda: self.hourly_zones(backtest))
+
+        session_key = key + (str(backtest.market_timezone), tuple(sorted(self.calendar.events.items())))
+        (self._is_buy, self._is_sell, self._is_milestone,
+         self._zones, self._session_zones) = self.zone_cache.get(
+            session_key, lambda: self.session_events(backtest, self._hourly, self._hourly_zones))
+
+        if self.collect_logs or self.verbose:
+            return self._is_buy | self._is_sell | self._is_milestone
+        return self._is_buy | self._is_sell
+
+    def on_bar(self, i, time_ns, open_, high, low, close, day):
+        is_buy = self._is_buy[i]
+        is_sell = self._is_sell[i]
+        self.current_session_last_candle_zone = int(self._session_zones[i])
+
+        # ----- Session level debug -----
+        if self.session_debug and self.collect_logs:
+            if is_buy:
+                self.session_log['ON_Close'] = close
+            if is_sell:
+                self.session_log['ON_Open'] = close
+
+        # ----- BUY / SELL LOGIC -----
+        if (not self.position_open and is_buy and self.current_session_last_candle_zone not in self.V
+                and (self.close_fill_ns is None or time_ns + self._backtest.bar_ns >= self.close_fill_ns)):
+            # Like the live bot, no open while the previous close is still pending
+            filled = simulated_fill(self.fills, 'BUY', time_ns, close, time_ns + self._backtest.bar_ns)
+            if filled is not None:
+                self.execute_order('BUY', filled[1], self._backtest.timestamp(filled[0]),
+                                   self.current_session_last_candle_zone)
+                self.open_day = day
+                self.position_open = True
+        elif self.position_open and day > self.open_day and is_sell:
+            fill_ns, price = simulated_fill(self.fills, 'STOP', time_ns, open_, time_ns, self.current_order['Price'])
+            self.execute_order('STOP', price, self._backtest.timestamp(fill_ns), None)
+            self.position_open = False
+            self.close_fill_ns = fill_ns
+            self.open_day = None
+
+        # ----- Session close zone -----
+        if self._is_milestone[i]:
+            self.prev_session_last_candle_zone = self.current_session_last_candle_zone
+            self.current_session_last_candle_zone = int(self._zones[i])
+
+            if self.collect_logs:
+                self.session_log['Date'] = str(np.datetime64(day, 'D'))
+                self.session_log['K_Close'] = self.current_session_last_candle_zone
+                self.session_log_collector.append(copy.deepcopy(self.session_log))
+
+            if self.verbose:
+                print(f'ts: {self._backtest.timestamp(time_ns)}  open: {open_}  '
+                      f'prev_session_last_candle_zone: {self.prev_session_last_candle_zone}  '
+                      f'current_session_last_candle_zone: {self.current_session_last_candle_zone}')
+
+    def finish(self, backtest):
+        # Zone in force after the last bar, also when milestones were not walked
+        milestone_zones = self._zones[self._is_milestone]
+        self.current_session_last_candle_zone = int(milestone_zones[-1]) if milestone_zones.size else self.Z
+        if self.collect_logs:
+            times = pd.to_datetime(backtest.bars.time[self._hourly], utc=True)
+            self.status_collector = [{'Time': ts, 'Status': int(z)} for ts, z in zip(times, self._hourly_zones)]
+
+    def generate_ticket(self):
+        ticket = self.ticket_counter
+        self.ticket_counter += 1
+        return ticket
+
+    def execute_order(self, order_type, price, time, k):
+        if order_type == 'BUY':
+            self.current_order = {
+                'Ticket': self.generate_ticket(),
+                'Open Time': time,
+                'Type': order_type,
+                'Size': self.size,
+                'Item': self.item,
+                'Price': price,
+                'S/L': None,
+                'T/P': None,
+                'Close Time': None,
+                'Close Price': None,
+                'Commission': 0.0,
+                'Taxes': 0.0,
+                'Swap': 0.0,
+                'raw_profit': None,
+                'Profit': None,
+                'K': k
+            }
+            if self.verbose:
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - [ONBacktest] Executing BUY @ {price}; "
+                      f"Z: {self.prev_session_last_candle_zone}")
+        elif order_type == 'STOP' and self.current_order is not None:
+            profit_raw = (price - self.current_order['Price']) * self.size * self.contract_size
+            total_commission = self.commission * self.size
+            self.current_order.update({
+                'Close Time': time,
+                'Close Price': price,
+                'Profit': profit_raw - total_commission,
+                'Commission': total_commission,
+                'Taxes': self.taxes,
+                'Swap': self.swap,
+                'raw_profit': profit_raw
+            })
+            if self.verbose:
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - [ONBacktest] Executing SELL @ {price}")
+                print(f"         Profit: {self.current_order['Profit']:.2f}")
+            self.orders.append(self.current_order)
+            self.current_order = None
+
+    def get_orders(self):
+        return self.orders
+
+    def save_orders_to_json(self, filename):
+        save_orders_to_json(self.orders, filename)
+        print(f"[ONBacktest] All orders have been saved to {filename}")
+
+
+class TDBacktest:
+    """
+    Columnar version of the TD (trading day) strategy of `TDTradingBot`.
+
+    Buys at the close of the 12:00 NY candle and closes at the close of the
+    17:55 NY candle (both configurable through `session`), or fills both
+    from ticks at those closes with `fills` (FillSimulator).
+    """
+
+    def __init__(self, item='spxm', size=1, contract_size=10, session=TD_SESSION, verbose: bool = False,
+                 fills: FillSimulator = None):
+        self.item = item
+        self.size = size
+        self.contract_size = contract_size
+        self.verbose = verbose
+        self.fills = fills
+        self.calendar = SessionCalendar(session)
+
+        # Fee assumptions
+        self.commission = 3.0
+        self.taxes = 0.0
+        self.swap = 0.0
+
+        self.reset()
+
+    def reset(self):
+        self.position_open = False
+        self.close_fill_ns = None  # Fill time of the last close, which can come well after its decision
+        self.current_order = None
+        self.orders = []
+        self.ticket_counter = 1
+
+    def prepare(self, backtest):
+        self.reset()
+        self._backtest = backtest
+
+        times = backtest.bars.time
+        self._is_buy = times == self.calendar.instants('buy', backtest.day)
+        self._is_sell = times == self.calendar.instants('sell', backtest.day)
+        return self._is_buy | self._is_sell
+
+    def on_bar(self, i, time_ns, open_, high, low, close, day):
+        close_ns = time_ns + self._backtest.bar_ns
+        if (self._is_buy[i] and not self.position_open
+                and (self.close_fill_ns is None or close_ns >= self.close_fill_ns)):
+            # Like the live bot, no open while the previous close is still pending
+            filled = simulated_fill(self.fills, 'BUY', time_ns, close, close_ns)
+            if filled is not None:
+                self.execute_order('BUY', filled[1], self._backtest.timestamp(filled[0]))
+                self.position_open = True
+        elif self._is_sell[i] and self.position_open:
+            fill_ns, price = simulated_fill(self.fills, 'STOP', time_ns, close, close_ns, self.current_order['Price'])
+            self.execute_order('STOP', price, self._backtest.timestamp(fill_ns))
+            self.position_open = False
+            self.close_fill_ns = fill_ns
+
+    def finish(self, backtest):
+        pass
+
+    def generate_ticket(self):
+        ticket = self.ticket_counter
+        self.ticket_counter += 1
+        return ticket
+
+    def execute_order(self, order_type, price, time):
+        if order_type == 'BUY':
+            self.current_order = {
+                'Ticket': self.generate_ticket(),
+                'Open Time': time,
+                'Type': order_type,
+                'Size': self.size,
+                'Item': self.item,
+                'Price': price,
+                'S/L': None,
+                'T/P': None,
+                'Close Time': None,
+                'Close Price': None,
+                'Commission': self.commission,
+                'Taxes': self.taxes,
+                'Swap': self.swap,
+                'Profit': None
+            }
+            if self.verbose:
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - Executing BUY order: {self.current_order}")
+        elif order_type == 'STOP' and self.current_order is not None:
+            open_price = self.current_order['Price']
+            profit_raw = (price - open_price) * self.size if self.current_order['Type'] == 'BUY' else (
+                          open_price - price) * self.size
+            self.current_order.update({
+                'Close Time': time,
+                'Close Price': price,
+                'Profit': profit_raw - self.commission * self.size,
+                'Commission': self.commission * self.size,
+                'Taxes': self.taxes,
+                'Swap': self.swap
+            })
+            self.orders.append(self.current_order)
+            if self.verbose:
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {self._backtest.market_timezone} - "
+                      f"Executing CLOSE order: {self.current_order}")
+
+    def get_orders(self):
+        return self.orders
+
+    def save_orders_to_json(self, filename):
+        save_orders_to_json(self.orders, filename)
+        print(f"All orders have been saved to {filename}")
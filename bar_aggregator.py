@@ -0,0 +1,250 @@
+import logging
+import re
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+from bar_store import BarStore
+from market_data import INTERVALS, BarProvider, Bars, Ticks
+from session_calendar import MARKET_TIMEZONE, NS_PER_DAY, NS_PER_MINUTE, local_day_and_time
+
+
+logger = logging.getLogger(__name__)
+
+_INTERVAL = re.compile(r'^(\d+)([smhd])$')
+_UNIT_NS = {'s': 10**9, 'm': NS_PER_MINUTE, 'h': 60 * NS_PER_MINUTE, 'd': NS_PER_DAY}
+
+PRICES = ('bid', 'ask', 'mid')
+
+# Yahoo's hourly ^GSPC bars open on the half hour from the 9:30 NY cash open, so tick bars
+# on this grid line up with them (e.g. the 15:30 candle the ON milestone looks up)
+YAHOO_SESSION_START = (9, 30)
+
+
+def interval_ns(interval) -> int:
+    """Length of an interval such as '5m', '4h' or '1d' (or int nanoseconds) in nanoseconds."""
+    if isinstance(interval, (int, np.integer)):
+        return int(interval)
+    if interval in INTERVALS:
+        return INTERVALS[interval]
+    match = _INTERVAL.match(interval)
+    if not match or not int(match.group(1)):
+        raise ValueError(f"Invalid bar interval: {interval!r}")
+    return int(match.group(1)) * _UNIT_NS[match.group(2)]
+
+
+def bar_boundaries(start_ns: int, end_ns: int, interval, tz=MARKET_TIMEZONE, session_start=(0, 0)) -> np.ndarray:
+    """
+    UTC open times of the bars covering [start_ns, end_ns].
+
+    Bars follow the wall clock of `tz`, aligned so that one opens at
+    `session_start` (hour, minute) every day when the interval divides a day.
+    Across DST changes the clock grid is kept: the skipped spring hour has no
+    bars and the repeated autumn hour gets bars for both of its passes.
+    """
+    step = interval_ns(interval)
+    offset = (session_start[0] * 60 + session_start[1]) * NS_PER_MINUTE
+    day, time_of_day = local_day_and_time([start_ns, end_ns], tz)
+    local_start, local_end = day * NS_PER_DAY + time_of_day
+
+    first = local_start - (local_start - offset) % step - step
+    grid = pd.DatetimeIndex(np.arange(first, local_end + 2 * step, step, dtype=np.int64).view('datetime64[ns]'))
+    instants = [grid.tz_localize(tz, ambiguous=ambiguous, nonexistent='shift_forward').as_unit('ns').asi8
+                for ambiguous in (True, False)]
+    return np.unique(np.concatenate(instants))
+
+
+def tick_prices(ticks: Ticks, price: str = 'bid') -> np.ndarray:
+    if price == 'mid':
+        return (ticks.bid + ticks.ask) / 2
+    if price not in PRICES:
+        raise ValueError(f"Unknown tick price: {price!r}")
+    return getattr(ticks, price)
+
+
+def aggregate_ticks(ticks: Ticks, interval, price: str = 'bid', tz=MARKET_TIMEZONE, session_start=(0, 0)) -> Bars:
+    """
+    OHLCV bars of time-ordered ticks, vectorized (see `bar_boundaries` for the alignment).
+
+    Bars are stamped with their open time and only exist where there were
+    ticks; the volume is the tick count, as in MT4.
+    """
+    if not len(ticks):
+        return Bars.empty()
+    bounds = bar_boundaries(int(ticks.time[0]), int(ticks.time[-1]), interval, tz, session_start)
+    return _group(bounds, ticks.time, tick_prices(ticks, price))
+
+
+def _group(bounds, times, prices):
+    bucket = np.searchsorted(bounds, times, side='right') - 1
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    ends = np.concatenate((starts[1:], [times.size]))
+    return Bars(bounds[bucket[starts]], prices[starts],
+                np.maximum.reduceat(prices, starts), np.minimum.reduceat(prices, starts),
+                prices[ends - 1], (ends - starts).astype(np.float64))
+
+
+class BarAggregator:
+    """
+    Incremental tick-to-bar aggregation for live ticks, matching `aggregate_ticks`.
+
+    `on_tick` handles one tick in O(1) except when a bar closes; `add` takes
+    a whole `Ticks` chunk vectorized. Both return the bars closed by the new
+    ticks; the bar still forming is `current` and `flush` closes it.
+    """
+
+    def __init__(self, interval, price: str = 'bid', tz=MARKET_TIMEZONE, session_start=(0, 0)):
+        self.interval = interval
+        self.step = interval_ns(interval)
+        self.price = price
+        self.tz = tz
+        self.session_start = tuple(session_start)
+        tick_prices(Ticks.empty(), price)  # Validate before the first tick
+
+        self._bounds = np.empty(0, dtype=np.int64)
+        self._bar = None  # [time, open, high, low, close, volume] of the forming bar
+        self._bar_end = None
+
+    @property
+    def current(self):
+        """(time, open, high, low, close, volume) of the bar still forming, or None."""
+        return tuple(self._bar) if self._bar is not None else None
+
+    def on_tick(self, time_ns: int, bid: float, ask: float):
+        """Add one tick; returns the bar it closed as a one-bar `Bars`, or None."""
+        price = bid if self.price == 'bid' else ask if self.price == 'ask' else (bid + ask) / 2
+        bar = self._bar
+        if bar is not None and time_ns < self._bar_end:
+            if price > bar[2]:
+                bar[2] = price
+            elif price < bar[3]:
+                bar[3] = price
+            bar[4] = price
+            bar[5] += 1
+            return None
+
+        closed = self.flush()
+        start, self._bar_end = self._bucket(time_ns)
+        self._bar = [start, price, price, price, price, 1.0]
+        return closed
+
+    def add(self, ticks: Ticks) -> Bars:
+        """Add a time-ordered chunk of ticks; returns the bars it closed."""
+        if not len(ticks):
+            return Bars.empty()
+        self._cover(int(ticks.time[0]), int(ticks.time[-1]))
+        bars = _group(self._bounds, ticks.time, tick_prices(ticks, self.price))
+
+        if self._bar is not None:
+            if bars.time[0] == self._bar[0]:
+                _, open_, high, low, _, volume = self._bar
+                bars.open[0] = open_
+                bars.high[0] = max(high, bars.high[0])
+                bars.low[0] = min(low, bars.low[0])
+                bars.volume[0] += volume
+            else:
+                bars = Bars(*(np.concatenate(([value], getattr(bars, name)))
+                              for value, name in zip(self._bar, Bars.COLUMNS)))
+
+        last = len(bars) - 1
+        self._bar = [getattr(bars, name)[last].item() for name in Bars.COLUMNS]
+        self._bar_end = self._bucket(self._bar[0])[1]
+        return Bars(*(getattr(bars, name)[:last] for name in Bars.COLUMNS))
+
+    def flush(self):
+        """Close the forming bar; returns it as a one-bar `Bars`, or None."""
+        if self._bar is None:
+            return None
+        bar, self._bar = self._bar, None
+        return Bars(*([value] for value in bar))
+
+    def _cover(self, start_ns, end_ns):
+        """Make the cached bar boundaries cover [start_ns, end_ns]."""
+        bounds = self._bounds
+        if not bounds.size or not bounds[0] <= start_ns or not end_ns < bounds[-1]:
+            # Cache about a week of boundaries ahead, so this is rarely recomputed
+            horizon = max(7 * NS_PER_DAY, 16 * self.step)
+            self._bounds = bar_boundaries(start_ns, end_ns + horizon, self.step, self.tz, self.session_start)
+
+    def _bucket(self, time_ns):
+        """(start, end) of the bar containing `time_ns`."""
+        self._cover(time_ns, time_ns)
+        i = int(np.searchsorted(self._bounds, time_ns, side='right')) - 1
+        return int(self._bounds[i]), int(self._bounds[i + 1])
+
+
+class TickBarProvider(BarProvider):
+    """
+    Bars built from our own broker's live ticks and kept in a `BarStore`.
+
+    Feed it from the tick handler with `on_tick`. Bars are aligned to
+    `session_start`, by default Yahoo's half-hour grid, so they can stand in
+    for its ^GSPC bars. The tick handler only queues the bars it closes;
+    they are written to the store by `save`, which `get_bars` and `flush`
+    call first, so disk writes happen on the reading thread.
+    """
+
+    def __init__(self, store: BarStore, symbol: str, intervals=('1h',), price: str = 'bid',
+                 tz=MARKET_TIMEZONE, session_start=YAHOO_SESSION_START):
+        self.store = store
+        self.symbol = symbol
+        self.aggregators = {interval: BarAggregator(interval, price, tz, session_start) for interval in intervals}
+        self._pending = []  # (interval, closed bars) not written yet
+        self._lock = Lock()  # Guards _pending: ticks arrive on the client thread
+        self._store_lock = Lock()  # Reads and writes come from the state refresh timer and backfills
+
+    def on_tick(self, time_ns: int, bid: float, ask: float):
+        for interval, aggregator in self.aggregators.items():
+            closed = aggregator.on_tick(time_ns, bid, ask)
+            if closed is not None:
+                with self._lock:
+                    self._pending.append((interval, closed))
+
+    def add(self, ticks: Ticks):
+        """Aggregate a batch of historical ticks, e.g. to backfill the store from tick files."""
+        for interval, aggregator in self.aggregators.items():
+            closed = aggregator.add(ticks)
+            with self._lock:
+                self._pending.append((interval, closed))
+        self.save()
+
+    def flush(self):
+        """Store the bars still forming, e.g. at the end of a backfill."""
+        for interval, aggregator in self.aggregators.items():
+            closed = aggregator.flush()
+            if closed is not None:
+                with self._lock:
+                    self._pending.append((interval, closed))
+        self.save()
+
+    def save(self):
+        """Write the closed bars queued by `on_tick` to the store."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            with self._store_lock:
+                for interval, closed in pending:
+                    self.store.write(self.symbol, interval, closed)
+
+    def get_bars(self, symbol, interval, start, end):
+        if symbol != self.symbol:
+            raise KeyError(f"Only {self.symbol} bars are built from ticks, not {symbol}")
+        self.save()
+        with self._store_lock:
+            # Copy, so no file mapping outlives the call
+            return self.store.read(symbol, interval, start, end).copy()
+
+
+if __name__ == '__main__':
+    from tick_stream import stream_ticks
+
+    logging.basicConfig(level=logging.INFO)
+
+    # Backfill 5-minute and hourly SPXm bars from the daily tick files unpacked under ./spxm_data
+    provider = TickBarProvider(BarStore('./data/store'), 'SPXm', intervals=('5m', '1h'))
+    for ticks in stream_ticks('./spxm_data/*_ticks_*.csv'):
+        provider.add(ticks)
+    provider.flush()
+    for interval in provider.aggregators:
+        logger.info(f"SPXm {interval}: {provider.store.read('SPXm', interval)}")
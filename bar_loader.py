@@ -0,0 +1,206 @@
+import glob
+import hashlib
+import logging
+import os
+import re
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from market_data import DATA_DIR, Bars
+
+
+logger = logging.getLogger(__name__)
+
+# Parsed files are cached here as .npz column sets, keyed by their resolved path
+CACHE_DIR = DATA_DIR / '.bars'
+# Bump when parsing changes, so stale caches are re-parsed
+CACHE_VERSION = 1
+
+# MT4 server clock: New York time + 7h (GMT+2/+3 following US DST), so the
+# 17:00 NY daily break is the server's midnight
+MT4_SERVER_NY_OFFSET = pd.Timedelta(hours=7)
+
+TIME_COLUMNS = ('time', 'date', 'datetime', 'data')
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+# How a CSV file is laid out:
+#   name: dialect name, for logs
+#   sep, skiprows: pd.read_csv arguments
+#   time_column: raw header name of the timestamp column
+#   time_format: 'epoch', 'iso' (timestamps with offsets), or a strptime format for naive timestamps
+#   timezone: zone of naive timestamps ('mt4' for the MT4 server clock)
+CsvDialect = namedtuple('CsvDialect', 'name sep skiprows time_column time_format timezone')
+
+_DAY_FIRST = re.compile(r'^\d{1,2}-\d{1,2}-\d{2} \d{1,2}:\d{2}$')
+_NAIVE_ISO = re.compile(r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?$')
+
+
+def sniff_dialect(path) -> CsvDialect:
+    """
+    Detect the layout of a bar CSV file from its first lines.
+
+    Recognized: ';'-separated day-first exports (2022.csv, UTC), Yahoo
+    downloads (two extra header rows), MT4 exports (' High' column, server
+    time), pandas exports (unnamed index column) and TradingView exports
+    (ISO timestamps with offsets or epoch seconds).
+    """
+    with open(path, encoding='utf-8-sig') as fp:
+        lines = [fp.readline().rstrip('\r\n') for _ in range(4)]
+
+    header = lines[0]
+    sep = ';' if header.count(';') > header.count(',') else ','
+    names = header.split(sep)
+    skiprows = None
+    first_row = 1
+
+    if names[0] == 'Price' and lines[1].startswith('Ticker'):
+        name, skiprows, first_row = 'yahoo', [1, 2], 3
+    elif ' High' in names:
+        name = 'mt4'
+    elif names[0] == '':
+        name = 'pandas'
+    elif sep == ';':
+        name = 'semicolon'
+    else:
+        name = 'tradingview'
+
+    if name == 'yahoo':
+        time_column = names[0]  # The 'Date' label sits on the skipped third row
+    else:
+        time_column = next((column for column in names if column.strip().lower() in TIME_COLUMNS), None)
+    if time_column is None:
+        raise ValueError(f"No time column in {path}: {header!r}")
+
+    sample = lines[first_row].split(sep)[names.index(time_column)].strip()
+    timezone = 'UTC'
+    if sample.isdigit():
+        time_format = 'epoch'
+    elif _DAY_FIRST.match(sample):
+        time_format = '%d-%m-%y %H:%M'
+    elif _NAIVE_ISO.match(sample):
+        time_format = '%Y-%m-%d %H:%M:%S' if len(sample) == 19 and sample[10] == ' ' else 'ISO8601'
+        if name == 'mt4':
+            timezone = 'mt4'
+    else:
+        time_format = 'iso'
+
+    return CsvDialect(name, sep, skiprows, time_column, time_format, timezone)
+
+
+def parse_times(values, dialect: CsvDialect) -> np.ndarray:
+    """Parse a column of timestamps to int64 ns UTC, vectorized."""
+    if dialect.time_format == 'epoch':
+        values = np.asarray(values, dtype=np.int64)
+        # Seconds, milliseconds or already nanoseconds, by magnitude
+        scale = 10**9 if values.max(initial=0) < 10**11 else 10**6 if values.max() < 10**14 else 1
+        return values * scale
+
+    if dialect.time_format == 'iso':
+        return pd.to_datetime(values, format='ISO8601', utc=True).as_unit('ns').asi8
+
+    return localize(pd.to_datetime(values, format=dialect.time_format), dialect.timezone)
+
+
+def localize(naive, timezone) -> np.ndarray:
+    """int64 ns UTC of naive timestamps in `timezone` ('mt4' for the MT4 server clock)."""
+    naive = pd.DatetimeIndex(naive)
+    if timezone == 'mt4':
+        local = (naive - MT4_SERVER_NY_OFFSET).tz_localize('America/New_York', ambiguous=False,
+                                                           nonexistent='shift_forward')
+    else:
+        local = naive.tz_localize(timezone)
+    return local.as_unit('ns').asi8
+
+
+def read_csv_bars(path, dialect: CsvDialect = None) -> Bars:
+    """Parse one bar CSV file (auto-detected unless `dialect` is given), sorted and deduplicated."""
+    dialect = dialect or sniff_dialect(path)
+    # round_trip parses prices exactly; the default C parser can be one ulp off
+    df = pd.read_csv(path, sep=dialect.sep, skiprows=dialect.skiprows, encoding='utf-8-sig',
+                     float_precision='round_trip',
+                     dtype={dialect.time_column: str if dialect.time_format != 'epoch' else np.int64})
+    columns = {str(column).strip().lower(): column for column in df.columns}
+    missing = [name for name in PRICE_COLUMNS[:4] if name not in columns]
+    if missing:
+        raise ValueError(f"{path} has no {', '.join(missing)} column")
+
+    volume = df[columns['volume']].to_numpy(dtype=np.float64) if 'volume' in columns else None
+    bars = Bars(parse_times(df[dialect.time_column].to_numpy(), dialect),
+                *(df[columns[name]].to_numpy(dtype=np.float64) for name in PRICE_COLUMNS[:4]),
+                volume)
+    logger.debug(f"Parsed {len(bars)} bars from {path} ({dialect.name} dialect)")
+    return Bars.concat([bars])
+
+
+def _cache_path(path: Path, cache_dir: Path) -> Path:
+    digest = hashlib.blake2b(str(path).encode(), digest_size=8).hexdigest()
+    return cache_dir / f'{path.stem}-{digest}.npz'
+
+
+def _source_stamp(path: Path):
+    stat = path.stat()
+    return np.array([CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def load_file(path, cache_dir=CACHE_DIR) -> Bars:
+    """
+    Bars of one CSV file, from the binary cache when it is up to date.
+
+    The cache entry records the file size and modification time and is
+    re-parsed when either changed; `cache_dir=None` disables caching.
+    """
+    path = Path(path).resolve()
+    if cache_dir is None:
+        return read_csv_bars(path)
+
+    cache_path = _cache_path(path, Path(cache_dir))
+    stamp = _source_stamp(path)
+    if cache_path.is_file():
+        with np.load(cache_path) as cached:
+            if np.array_equal(cached['source'], stamp):
+                return Bars(*(cached[name] for name in Bars.COLUMNS))
+
+    bars = read_csv_bars(path)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix('.tmp.npz')
+        np.savez(tmp_path, source=stamp, **{name: getattr(bars, name) for name in Bars.COLUMNS})
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not cache {path}: {e}")
+    return bars
+
+
+def expand_sources(sources):
+    """CSV paths of a file, directory (its *.csv files), glob pattern, or a list of these."""
+    if isinstance(sources, (str, os.PathLike)):
+        sources = [sources]
+
+    paths = []
+    for source in sources:
+        source = Path(source)
+        if source.is_dir():
+            paths.extend(sorted(source.glob('*.csv')))
+        elif source.is_file():
+            paths.append(source)
+        else:
+            matches = sorted(glob.glob(str(source)))
+            if not matches:
+                raise FileNotFoundError(f"No bar files match {source}")
+            paths.extend(Path(match) for match in matches)
+    return paths
+
+
+def load_bars(sources, cache_dir=CACHE_DIR) -> Bars:
+    """
+    Load bars from any of the CSV dialects in data/ (see `sniff_dialect`).
+
+    Split exports are concatenated in path order and deduplicated by
+    timestamp, later files winning (see `Bars.concat`).
+
+    :param sources: A file, directory, glob pattern, or a list of these.
+    """
+    return Bars.concat([load_file(path, cache_dir=cache_dir) for path in expand_sources(sources)])
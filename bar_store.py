@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from market_data import Bars, Ticks, datetime_to_ns
+from session_calendar import NS_PER_DAY
+
+
+logger = logging.getLogger(__name__)
+
+TICK_INTERVAL = 'tick'
+
+
+class BarStore:
+    """
+    On-disk columnar store of bars and ticks, partitioned by symbol/interval/day.
+
+    Each partition is a directory of raw fixed-width column files (int64 ns
+    UTC times, float64 values) holding one UTC day of data, and every
+    symbol/interval keeps an index of its partitions' first/last times and
+    row counts. Reads consult the index and `np.memmap` only the partitions
+    overlapping the requested range, so opening the store costs nothing and
+    a read costs as much as the range it returns, whatever the archive size.
+
+    Layout: root/<symbol>/<interval>/<YYYY-MM-DD>/<column>.bin, plus
+    root/<symbol>/<interval>/index.json. The 'tick' interval holds `Ticks`,
+    every other interval `Bars`.
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._indexes = {}
+
+    @staticmethod
+    def kind(interval):
+        """Columnar class stored under `interval`."""
+        return Ticks if interval == TICK_INTERVAL else Bars
+
+    def symbols(self):
+        """Stored symbols, as directory names (non-alphanumerics replaced by '_')."""
+        if not self.root.is_dir():
+            return []
+        return sorted(path.name for path in self.root.iterdir() if path.is_dir())
+
+    def intervals(self, symbol):
+        series = self.root / self._safe_symbol(symbol)
+        if not series.is_dir():
+            return []
+        return sorted(path.name for path in series.iterdir() if (path / self.INDEX_FILE).is_file())
+
+    def days(self, symbol, interval):
+        """UTC dates of the stored partitions, in order."""
+        return [self._date(day) for day in sorted(self._index(symbol, interval))]
+
+    def extent(self, symbol, interval):
+        """(first, last) int64 ns times stored, or None when empty."""
+        index = self._index(symbol, interval)
+        if not index:
+            return None
+        return index[min(index)][0], index[max(index)][1]
+
+    def write(self, symbol, interval, data):
+        """
+        Store time-ordered bars or ticks.
+
+        Within each day the stored rows from the first to the last new
+        timestamp are replaced by the new ones and the rest of the day is
+        kept; rows newer than the whole stored day are simply appended
+        (for ticks, also those at the same time as the last stored tick).
+        """
+        if not len(data):
+            return
+        cls = self.kind(interval)
+        index = self._index(symbol, interval)
+
+        days = data.time // NS_PER_DAY
+        bounds = np.flatnonzero(np.diff(days)) + 1
+        for start, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(data)]))):
+            day = int(days[start])
+            part = cls(*(getattr(data, name)[start:end] for name in cls.COLUMNS))
+            if day in index:
+                first, last = part.time[0], part.time[-1]
+                stored_last = index[day][1]
+                # Ticks, unlike bars, can share a timestamp with the last stored one
+                if first > stored_last or (cls is Ticks and first == stored_last):
+                    # Newer than the stored day (e.g. streamed chunks): append to the column files
+                    self._append_partition(symbol, interval, day, part)
+                    index[day] = (index[day][0], int(last), index[day][2] + len(part))
+                    continue
+
+                # Read without mapping, so the files can be replaced (mapped files are locked on Windows)
+                stored = self._open(symbol, interval, day, index[day][2], mmap=False)
+                lo = int(np.searchsorted(stored.time, first, side='left'))
+                hi = int(np.searchsorted(stored.time, last, side='right'))
+                part = cls(*(np.concatenate((getattr(stored, name)[:lo], getattr(part, name),
+                                             getattr(stored, name)[hi:]))
+                             for name in cls.COLUMNS))
+            self._write_partition(symbol, interval, day, part)
+            index[day] = (int(part.time[0]), int(part.time[-1]), len(part))
+
+        self._save_index(symbol, interval)
+
+    def read(self, symbol, interval, start=None, end=None):
+        """
+        Rows with start <= time < end.
+
+        A range within one partition is returned as read-only memory-mapped
+        views; longer ranges are concatenated from the partition slices.
+        """
+        parts = list(self.iter_days(symbol, interval, start, end))
+        cls = self.kind(interval)
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+        return cls(*(np.concatenate([getattr(part, name) for part in parts]) for name in cls.COLUMNS))
+
+    def iter_days(self, symbol, interval, start=None, end=None):
+        """Yield the rows with start <= time < end one day at a time, as memory-mapped views."""
+        start_ns = None if start is None else datetime_to_ns(start)
+        end_ns = None if end is None else datetime_to_ns(end)
+        index = self._index(symbol, interval)
+
+        for day in sorted(index):
+            first, last, rows = index[day]
+            if (start_ns is not None and last < start_ns) or (end_ns is not None and first >= end_ns):
+                continue
+            part = self._open(symbol, interval, day, rows)
+            if (start_ns is not None and first < start_ns) or (end_ns is not None and last >= end_ns):
+                part = part.slice(start_ns, end_ns)
+            if len(part):
+                yield part
+
+    def _open(self, symbol, interval, day, rows, mmap=True):
+        cls = self.kind(interval)
+        partition = self._partition_dir(symbol, interval, day)
+        columns = []
+        for name in cls.COLUMNS:
+            dtype = np.int64 if name == 'time' else np.float64
+            path = partition / f'{name}.bin'
+            if mmap:
+                columns.append(np.memmap(path, dtype=dtype, mode='r', shape=(rows,)))
+            else:
+                columns.append(np.fromfile(path, dtype=dtype, count=rows))
+        return cls(*columns)
+
+    def _write_partition(self, symbol, interval, day, data):
+        partition = self._partition_dir(symbol, interval, day)
+        partition.mkdir(parents=True, exist_ok=True)
+        for name in data.COLUMNS:
+            dtype = np.int64 if name == 'time' else np.float64
+            tmp_path = partition / f'{name}.bin.tmp'
+            np.ascontiguousarray(getattr(data, name), dtype=dtype).tofile(tmp_path)
+            os.replace(tmp_path, partition / f'{name}.bin')
+
+    def _append_partition(self, symbol, interval, day, data):
+        partition = self._partition_dir(symbol, interval, day)
+        rows = self._index(symbol, interval)[day][2]
+        for name in data.COLUMNS:
+            dtype = np.int64 if name == 'time' else np.float64
+            with open(partition / f'{name}.bin', 'r+b') as fp:
+                # Drop anything past the indexed rows, e.g. from an interrupted append
+                fp.truncate(rows * np.dtype(dtype).itemsize)
+                fp.seek(0, os.SEEK_END)
+                fp.write(np.ascontiguousarray(getattr(data, name), dtype=dtype).tobytes())
+
+    def _index(self, symbol, interval):
+        key = (symbol, interval)
+        if key not in self._indexes:
+            path = self._series_dir(symbol, interval) / self.INDEX_FILE
+            entries = json.loads(path.read_text()) if path.is_file() else {}
+            self._indexes[key] = {int(day): tuple(entry) for day, entry in entries.items()}
+        return self._indexes[key]
+
+    def _save_index(self, symbol, interval):
+        series = self._series_dir(symbol, interval)
+        series.mkdir(parents=True, exist_ok=True)
+        entries = {str(day): list(entry) for day, entry in sorted(self._index(symbol, interval).items())}
+        tmp_path = series / (self.INDEX_FILE + '.tmp')
+        tmp_path.write_text(json.dumps(entries))
+        os.replace(tmp_path, series / self.INDEX_FILE)
+
+    @staticmethod
+    def _safe_symbol(symbol):
+        return ''.join(char if char.isalnum() else '_' for char in symbol)
+
+    def _series_dir(self, symbol, interval):
+        return self.root / self._safe_symbol(symbol) / interval
+
+    def _partition_dir(self, symbol, interval, day):
+        return self._series_dir(symbol, interval) / self._date(day).isoformat()
+
+    @staticmethod
+    def _date(day):
+        return date(1970, 1, 1) + timedelta(days=day)
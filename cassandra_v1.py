@@ -1,14 +1,32 @@
+from collections import deque
+
 import numpy as np
 import pandas as pd
 from pandas import Timestamp
 
 
 class FibonacciRetracement:
+    """
+    Streaming Fibonacci retracement between support and resistance.
+
+    Prices are kept in a fixed-capacity ring buffer of the last
+    `back_window_length` values, with monotonic deques tracking the window
+    minimum and maximum, so `go` is amortized O(1) and memory is bounded by the
+    window length. Once the first window is full, support and resistance start
+    at its extremes and are then pushed out by every new low/high, each of
+    which logs a new retracement.
+    """
+
     def __init__(self, back_window_length: int):
         self.back_window_length = back_window_length
 
-        # Initialize data as an empty DataFrame with Timestamp as index
-        self.data = pd.DataFrame(columns=['Adj Close'])
+        # Ring buffer of the last `back_window_length` prices and timestamps
+        self._prices = np.empty(back_window_length, dtype=np.float64)
+        self._timestamps = [None] * back_window_length
+        self._count = 0  # Number of prices seen so far
+        # Sequence numbers of candidate window minima/maxima (prices increasing/decreasing)
+        self._min_candidates = deque()
+        self._max_candidates = deque()
 
         # Initialize additional members with null values (None)
         self.current_datetime = None
@@ -21,12 +39,50 @@ class FibonacciRetracement:
 
         self.fibonacci_retracement_collector = []
 
+    @property
+    def data(self) -> pd.DataFrame:
+        """The prices in the current window, oldest first, indexed by timestamp."""
+        start = max(0, self._count - self.back_window_length)
+        slots = [seq % self.back_window_length for seq in range(start, self._count)]
+        return pd.DataFrame({'Adj Close': self._prices[slots]},
+                            index=[self._timestamps[slot] for slot in slots])
+
+    def window_min(self):
+        """(price, timestamp) of the lowest price in the window (earliest on ties)."""
+        return self._at(self._min_candidates[0]) if self._count else None
+
+    def window_max(self):
+        """(price, timestamp) of the highest price in the window (earliest on ties)."""
+        return self._at(self._max_candidates[0]) if self._count else None
+
+    def _at(self, seq):
+        slot = seq % self.back_window_length
+        return self._prices[slot], self._timestamps[slot]
+
+    def _push(self, price, timestamp):
+        seq = self._count
+        slot = seq % self.back_window_length
+        self._prices[slot] = price
+        self._timestamps[slot] = timestamp
+        self._count += 1
+
+        # Drop the candidates that left the window, then the ones the new price dominates
+        oldest = self._count - self.back_window_length
+        for candidates in (self._min_candidates, self._max_candidates):
+            if candidates and candidates[0] < oldest:
+                candidates.popleft()
+        while self._min_candidates and self._prices[self._min_candidates[-1] % self.back_window_length] > price:
+            self._min_candidates.pop()
+        self._min_candidates.append(seq)
+        while self._max_candidates and self._prices[self._max_candidates[-1] % self.back_window_length] < price:
+            self._max_candidates.pop()
+        self._max_candidates.append(seq)
+
     def go(self, adj_close: np.float64, timestamp: pd.Timestamp):
-        # Add the new value with the timestamp as index
-        self.data.loc[timestamp] = adj_close
+        self._push(adj_close, timestamp)
         self.current_datetime = timestamp
 
-        if self.data.loc[timestamp].shape[0] < self.back_window_length:
+        if self._count < self.back_window_length:
             return
 
         if self.support_price is not None and self.resistance_price is not None:
@@ -37,19 +93,17 @@ class FibonacciRetracement:
                 self._log() # Log new entry.
             elif adj_close < self.support_price:
                 self.support_price = adj_close
-                self.resistance_datetime = timestamp
+                self.support_datetime = timestamp
                 self._compute_fibonacci_retracement()
                 self._log()  # Log new entry.
             else:
                 #
                 pass
         else:
-            self.support_price = self.data['Adj Close'].min()
-            self.resistance_price = self.data['Adj Close'].max()
-            self.support_datetime = self.data['Adj Close'].idxmin()
-            self.resistance_datetime = self.data['Adj Close'].idxmax()
-
+            self.support_price, self.support_datetime = self.window_min()
+            self.resistance_price, self.resistance_datetime = self.window_max()
             self._compute_fibonacci_retracement()
+            self._log()  # Log new entry.
 
     def _compute_fibonacci_retracement(self):
         if self.support_datetime < self.resistance_datetime:
@@ -81,9 +135,72 @@ class FibonacciRetracement:
         pd.DataFrame(self.fibonacci_retracement_collector).to_csv(fname, index=False)
 
 
-
-# Example usage:
-fibonacci = FibonacciRetracement(back_window_length=5)
-fibonacci.go(np.float64(359.69000244140625), Timestamp('1990-01-02 00:00:00+0000', tz='UTC'))
-print(fibonacci.data)
-print(fibonacci.current_datetime)
+def fibonacci_retracement_log(closes, timestamps, back_window_length: int, fibo_ratios=None):
+    """
+    Batch version of `FibonacciRetracement`: the whole retracement log of a
+    price series in one vectorized pass.
+
+    Support and resistance start at the extremes of the first window and are
+    then running minima/maxima; a log row is written at initialization and at
+    every new low or high, where the corresponding timestamp resets.
+
+    :param closes: Prices, oldest first.
+    :param timestamps: Timestamps of the prices (any array-like, increasing).
+    :param fibo_ratios: Mapping of output column to retracement ratio,
+                        by default {'fibo38': 0.382, 'fibo68': 0.683}.
+    :return: Dict of columnar arrays with the same columns as the streaming log.
+    """
+    if fibo_ratios is None:
+        fibo_ratios = {'fibo38': 0.382, 'fibo68': 0.683}
+    closes = np.asarray(closes, dtype=np.float64)
+    timestamps = np.asarray(timestamps)
+    first = back_window_length - 1
+
+    if closes.size < back_window_length:
+        empty = {'support_price': closes[:0], 'resistance_price': closes[:0],
+                 'support_datetime': timestamps[:0], 'resistance_datetime': timestamps[:0]}
+        empty.update({name: closes[:0] for name in fibo_ratios})
+        empty['trend'] = np.empty(0, dtype=object)
+        return empty
+
+    # Running extremes from the first full window on; np.argmin/argmax pick the earliest on ties
+    window = closes[:back_window_length]
+    support = np.minimum.accumulate(np.concatenate(([window.min()], closes[back_window_length:])))
+    resistance = np.maximum.accumulate(np.concatenate(([window.max()], closes[back_window_length:])))
+
+    # Strict new lows/highs (a new high takes precedence, as in `go`)
+    new_high = np.zeros(support.size, dtype=bool)
+    new_low = np.zeros(support.size, dtype=bool)
+    new_high[1:] = resistance[1:] > resistance[:-1]
+    new_low[1:] = (support[1:] < support[:-1]) & ~new_high[1:]
+
+    # Index of the bar that set the current support/resistance, reset at every new extreme
+    position = np.arange(support.size) + first
+    support_index = np.maximum.accumulate(np.where(new_low, position, int(np.argmin(window))))
+    resistance_index = np.maximum.accumulate(np.where(new_high, position, int(np.argmax(window))))
+
+    rows = np.flatnonzero(new_low | new_high)
+    rows = np.concatenate(([0], rows))
+    support, resistance = support[rows], resistance[rows]
+    support_index, resistance_index = support_index[rows], resistance_index[rows]
+
+    rising = support_index < resistance_index
+    span = resistance - support
+    log = {
+        'support_price': support,
+        'resistance_price': resistance,
+        'support_datetime': timestamps[support_index],
+        'resistance_datetime': timestamps[resistance_index],
+    }
+    for name, ratio in fibo_ratios.items():
+        log[name] = np.where(rising, support + span * ratio, resistance - span * ratio)
+    log['trend'] = np.where(rising, 'Alcista', 'Bajista').astype(object)
+    return log
+
+
+if __name__ == '__main__':
+    # Example usage:
+    fibonacci = FibonacciRetracement(back_window_length=5)
+    fibonacci.go(np.float64(359.69000244140625), Timestamp('1990-01-02 00:00:00+0000', tz='UTC'))
+    print(fibonacci.data)
+    print(fibonacci.current_datetime)
@@ -0,0 +1,109 @@
+import time
+from datetime import datetime
+from threading import Lock
+
+
+NS_PER_SECOND = 10**9
+
+
+class WallClock:
+    """The system clock; the default of every strategy and scheduler."""
+
+    @staticmethod
+    def time_ns() -> int:
+        return time.time_ns()
+
+    @staticmethod
+    def now(tz=None) -> datetime:
+        return datetime.now(tz)
+
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
+
+class SimulatedClock:
+    """
+    Clock of a replay: time only moves when the replay calls `advance_to`
+    (or `sleep`), so live code runs on the data's time as fast as it can.
+
+    With `speed`, the clock instead runs by itself from `start_ns` at
+    `speed` times real time, e.g. 1000 to watch a replay at 1000x.
+    """
+
+    def __init__(self, start_ns: int = 0, speed: float = None):
+        self.now_ns = int(start_ns)
+        self.speed = speed
+        self._started = time.monotonic_ns()
+
+    def time_ns(self) -> int:
+        if self.speed is not None:
+            return self.now_ns + int((time.monotonic_ns() - self._started) * self.speed)
+        return self.now_ns
+
+    def now(self, tz=None) -> datetime:
+        """`datetime.now` at the simulated time (naive local time without `tz`, as datetime.now)."""
+        return datetime.fromtimestamp(self.time_ns() / NS_PER_SECOND, tz)
+
+    def advance_to(self, time_ns: int):
+        """Move the clock forward to `time_ns`; it never goes back."""
+        if self.speed is not None:
+            # Re-base the free-running clock, so it carries on from the new time
+            time_ns = max(time_ns, self.time_ns())
+            self._started = time.monotonic_ns()
+        if time_ns > self.now_ns:
+            self.now_ns = int(time_ns)
+
+    def sleep(self, seconds):
+        if self.speed is not None:
+            time.sleep(seconds / self.speed)
+        else:
+            self.advance_to(self.now_ns + int(seconds * NS_PER_SECOND))
+
+
+class CachedClock:
+    """
+    Clock read once per event: `refresh` takes a snapshot that `time_ns`
+    and `now` return until the next refresh.
+
+    The tick processor refreshes it once per event, so every strategy
+    handling that event sees the same instant for the price of one read,
+    and the scheduler refreshes it before firing timers. Snapshots come
+    from the monotonic clock anchored to the wall clock every
+    `resync_interval` seconds, so a system clock step between re-anchors
+    cannot make time go backwards within a session. Threads reading it
+    between refreshes (e.g. strategy workers) see the time of the last
+    refresh.
+    """
+
+    def __init__(self, resync_interval: float = 60.0):
+        self.resync_interval = int(resync_interval * NS_PER_SECOND)
+        self._lock = Lock()  # Refreshed from the event and scheduler threads
+        self._anchor()
+        self.now_ns = self._wall_ns
+
+    def refresh(self) -> int:
+        with self._lock:
+            elapsed = time.monotonic_ns() - self._monotonic_ns
+            if elapsed >= self.resync_interval:
+                self._anchor()
+                elapsed = 0
+            self.now_ns = max(self.now_ns, self._wall_ns + elapsed)
+            return self.now_ns
+
+    def time_ns(self) -> int:
+        return self.now_ns
+
+    def now(self, tz=None) -> datetime:
+        return datetime.fromtimestamp(self.now_ns / NS_PER_SECOND, tz)
+
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
+    def _anchor(self):
+        self._wall_ns = time.time_ns()
+        self._monotonic_ns = time.monotonic_ns()
+
+
+WALL_CLOCK = WallClock()
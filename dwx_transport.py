@@ -0,0 +1,361 @@
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import sys
+from os.path import join
+from pathlib import Path
+from threading import Thread
+from time import perf_counter_ns, process_time, sleep
+
+
+logger = logging.getLogger(__name__)
+
+# Files of the DWX Connect bridge, in <MQL4/Files>/DWX
+DWX_DIR = 'DWX'
+MARKET_DATA_FILE = 'DWX_Market_Data.txt'
+MESSAGES_FILE = 'DWX_Messages.txt'
+ORDERS_FILE = 'DWX_Orders.txt'
+BAR_DATA_FILE = 'DWX_Bar_Data.txt'
+
+# Without a change event the files are still checked this often, to catch up after start()
+# and to survive missed events (e.g. on network shares)
+RESYNC_INTERVAL = 1.0  # seconds
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """
+    Change notifications for files of one directory through Linux inotify.
+
+    Only completed writes are reported (IN_CLOSE_WRITE, or a file renamed
+    into place), so a file is never read while MT4 is still writing it.
+    """
+
+    def __init__(self, directory, names):
+        self.directory = Path(directory)
+        self.names = set(names)
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(self.directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f'inotify_add_watch failed for {self.directory}')
+
+    def wait(self, timeout):
+        """Names of the watched files written since the last call, waiting up to `timeout` seconds for one."""
+        changed = set()
+        while not changed:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return changed
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(buffer):
+                _, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                offset += _EVENT_HEADER.size
+                name = buffer[offset:offset + length].rstrip(b'\0').decode()
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    changed |= self.names  # Events were lost: re-check everything
+                elif name in self.names:
+                    changed.add(name)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PollingWatcher:
+    """
+    Portable fallback of `InotifyWatcher`: polls the files' size and
+    modification time every `sleep_delay` seconds, so unchanged files are
+    never read.
+    """
+
+    def __init__(self, directory, names, sleep_delay=0.005):
+        self.directory = Path(directory)
+        self.names = set(names)
+        self.sleep_delay = sleep_delay
+        self._stamps = {}
+
+    def wait(self, timeout):
+        deadline = perf_counter_ns() + int(timeout * 1e9)
+        while True:
+            changed = set()
+            for name in self.names:
+                try:
+                    stat = os.stat(self.directory / name)
+                except OSError:
+                    continue
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                if self._stamps.get(name) != stamp:
+                    self._stamps[name] = stamp
+                    changed.add(name)
+            if changed or perf_counter_ns() >= deadline:
+                return changed
+            sleep(self.sleep_delay)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def file_watcher(directory, names, sleep_delay=0.005):
+    """An `InotifyWatcher` where the platform has inotify, a `PollingWatcher` otherwise."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directory, names)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable ({e}); polling {directory}")
+    return PollingWatcher(directory, names, sleep_delay)
+
+
+class EventDrivenDwxMixin:
+    """
+    Event-driven replacement of the sleep-polling loops of `dwx_client`.
+
+    dwx_client starts one thread per bridge file that re-reads the file
+    every `sleep_delay`. Mixed in ahead of it, these loops instead block on a
+    `file_watcher` of the DWX directory and only read and parse a file when
+    MT4 finished writing it, calling the same event handler methods
+    (`on_tick`, `on_message`, `on_order_event`, `on_bar_data`):
+
+        class EventDrivenDwxClient(EventDrivenDwxMixin, dwx_client):
+            pass
+
+    Commands and historic data requests are left to dwx_client.
+    """
+
+    resync_interval = RESYNC_INTERVAL
+    make_watcher = staticmethod(file_watcher)
+
+    def check_market_data(self):
+        self._watch_file(MARKET_DATA_FILE, self.handle_market_data)
+
+    def check_messages(self):
+        self._watch_file(MESSAGES_FILE, self.handle_messages)
+
+    def check_open_orders(self):
+        self._watch_file(ORDERS_FILE, self.handle_open_orders)
+
+    def check_bar_data(self):
+        self._watch_file(BAR_DATA_FILE, self.handle_bar_data)
+
+    def handle_market_data(self, data):
+        if self.event_handler is not None:
+            for symbol, quote in data.items():
+                if self.market_data.get(symbol) != quote:
+                    self.event_handler.on_tick(symbol, quote['bid'], quote['ask'])
+        self.market_data = data
+
+    def handle_messages(self, data):
+        for millis, message in sorted(data.items(), key=lambda item: int(item[0])):
+            if int(millis) > self._last_messages_millis:
+                self._last_messages_millis = int(millis)
+                if self.event_handler is not None:
+                    self.event_handler.on_message(message)
+
+    def handle_open_orders(self, data):
+        orders = data['orders']
+        new_event = orders.keys() != self.open_orders.keys()
+        if self.verbose:
+            for order_id in self.open_orders.keys() - orders.keys():
+                logger.info(f"Order removed: {self.open_orders[order_id]}")
+            for order_id in orders.keys() - self.open_orders.keys():
+                logger.info(f"New order: {orders[order_id]}")
+        self.account_info = data['account_info']
+        self.open_orders = orders
+        if getattr(self, 'load_orders_from_file', False):
+            with open(self.path_orders_stored, 'w') as f:
+                f.write(json.dumps(data))
+        if self.event_handler is not None and new_event:
+            self.event_handler.on_order_event()
+
+    def handle_bar_data(self, data):
+        on_bar_data = getattr(self.event_handler, 'on_bar_data', None)
+        for symbol_timeframe, bar in data.items():
+            if self.bar_data.get(symbol_timeframe) != bar and on_bar_data is not None:
+                symbol, timeframe = symbol_timeframe.rsplit('_', 1)
+                on_bar_data(symbol, timeframe, bar['time'], bar['open'], bar['high'], bar['low'],
+                            bar['close'], bar['tick_volume'])
+        self.bar_data = data
+
+    def _watch_file(self, name, handle):
+        path = join(self.metatrader_dir_path, DWX_DIR, name)
+        last_text = None
+        with self.make_watcher(Path(path).parent, [name], self.sleep_delay) as watcher:
+            while self.ACTIVE:
+                # Also re-checks on timeout, which is a cheap compare when nothing changed
+                watcher.wait(self.resync_interval)
+                if not self.START:
+                    continue
+                text = self.try_read_file(path)
+                if not text.strip() or text == last_text:
+                    continue
+                try:
+                    data = json.loads(text)
+                except json.JSONDecodeError:
+                    continue  # Caught mid-write by the resync; the close event follows
+                last_text = text
+                handle(data)
+
+
+class FileBridge(EventDrivenDwxMixin):
+    """
+    Receiving side of the DWX file bridge on its own, without dwx_client:
+    enough to test the transport and strategies against `FakeMT4Writer`.
+    """
+
+    def __init__(self, event_handler, metatrader_dir_path, sleep_delay=0.005, verbose=False, make_watcher=None):
+        """
+        :param make_watcher: Watcher class or factory taking (directory, names, sleep_delay);
+            `file_watcher` by default.
+        """
+        if make_watcher is not None:
+            self.make_watcher = make_watcher
+        self.event_handler = event_handler
+        self.metatrader_dir_path = str(metatrader_dir_path)
+        self.sleep_delay = sleep_delay
+        self.verbose = verbose
+        self.market_data = {}
+        self.bar_data = {}
+        self.open_orders = {}
+        self.account_info = {}
+        self._last_messages_millis = 0
+        self.ACTIVE = True
+        self.START = False
+
+        self.threads = [Thread(target=check, daemon=True)
+                        for check in (self.check_market_data, self.check_messages,
+                                      self.check_open_orders, self.check_bar_data)]
+        for thread in self.threads:
+            thread.start()
+
+    def start(self):
+        self.START = True
+
+    def stop(self):
+        self.ACTIVE = False
+        for thread in self.threads:
+            thread.join()
+
+    @staticmethod
+    def try_read_file(path):
+        try:
+            with open(path) as f:
+                return f.read()
+        except OSError:
+            return ''
+
+
+class FakeMT4Writer:
+    """
+    Writes the DWX bridge files the way the MT4 expert does (the whole file
+    re-written on each update), to exercise the transport without a terminal.
+    """
+
+    def __init__(self, metatrader_dir_path):
+        self.directory = Path(metatrader_dir_path) / DWX_DIR
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.market_data = {}
+        self.messages = {}
+        self.orders = {}
+        self.account_info = {'name': 'fake', 'currency': 'USD', 'balance': 10000.0, 'equity': 10000.0}
+
+    def tick(self, symbol, bid, ask):
+        self.market_data[symbol] = {'bid': bid, 'ask': ask, 'tick_value': 1.0}
+        self._write(MARKET_DATA_FILE, self.market_data)
+
+    def message(self, message, millis=None):
+        millis = millis if millis is not None else perf_counter_ns() // 10**6
+        self.messages[str(millis)] = message
+        self._write(MESSAGES_FILE, self.messages)
+
+    def set_orders(self, orders):
+        self.orders = orders
+        self._write(ORDERS_FILE, {'account_info': self.account_info, 'orders': orders})
+
+    def _write(self, name, data):
+        with open(self.directory / name, 'w') as f:
+            f.write(json.dumps(data))
+
+
+def benchmark(metatrader_dir_path, ticks=1000, interval=0.002, polling=False):
+    """
+    Tick-to-callback latency of the transport against `FakeMT4Writer`.
+
+    :param polling: Benchmark `PollingWatcher` (the dwx_client-style sleep loop) instead of inotify.
+    :return: Dict of latency percentiles (microseconds), ticks lost and CPU seconds used.
+    """
+    sent = {}
+    latencies = []
+
+    class Handler:
+        def on_tick(self, symbol, bid, ask):
+            latencies.append(perf_counter_ns() - sent[bid])
+
+        def on_message(self, message):
+            pass
+
+        def on_order_event(self):
+            pass
+
+    writer = FakeMT4Writer(metatrader_dir_path)
+    bridge = FileBridge(Handler(), metatrader_dir_path, make_watcher=PollingWatcher if polling else None)
+    bridge.start()
+    sleep(0.2)
+    cpu = process_time()
+    for i in range(ticks):
+        bid = 5000.0 + i * 0.25
+        sent[bid] = perf_counter_ns()
+        writer.tick('SPXm', bid, bid + 0.5)
+        sleep(interval)
+    sleep(0.1)
+    cpu = process_time() - cpu
+    bridge.stop()
+
+    micros = sorted(latency / 1000 for latency in latencies)
+    percentile = lambda q: micros[min(len(micros) - 1, int(q * len(micros)))] if micros else float('nan')
+    return {'p50_us': percentile(0.5), 'p99_us': percentile(0.99), 'max_us': micros[-1] if micros else float('nan'),
+            'lost': ticks - len(latencies), 'cpu_s': cpu}
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    logging.basicConfig(level=logging.INFO)
+
+    # Compare inotify against sleep polling on a temporary bridge directory
+    for polling in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            result = benchmark(directory, polling=polling)
+        logger.info(f"{'polling' if polling else 'inotify'}: {result}")
@@ -0,0 +1,161 @@
+import heapq
+import logging
+from itertools import count, islice, takewhile
+
+from market_data import INTERVALS, Bars, Ticks, datetime_to_ns, from_ns
+
+
+logger = logging.getLogger(__name__)
+
+# Rows converted to Python objects at a time when iterating columnar data,
+# so a stream never holds more than this many events
+BLOCK_SIZE = 4096
+
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+
+def records(items, field='time'):
+    """Events of time-ordered dicts (e.g. candle or tick dicts), keyed by their `field` timestamp."""
+    for item in items:
+        yield datetime_to_ns(item[field]), item
+
+
+def bar_events(bars: Bars, interval: str = None, at: str = 'open'):
+    """
+    Events of bars as {'time', 'open', 'high', 'low', 'close', 'volume'} dicts with UTC timestamps.
+
+    :param at: 'open' emits each bar at its open time (as the legacy `run`
+        loops did); 'close' at its open time + `interval`, when a live bot
+        would actually receive it.
+    """
+    if at not in ('open', 'close'):
+        raise ValueError(f"Unknown bar event time: {at!r}")
+    shift = INTERVALS[interval] if at == 'close' else 0
+    for lo in range(0, len(bars), BLOCK_SIZE):
+        hi = lo + BLOCK_SIZE
+        times = bars.time[lo:hi]
+        columns = [getattr(bars, name)[lo:hi].tolist() for name in BAR_FIELDS]
+        for time_ns, time, *values in zip((times + shift).tolist(), from_ns(times, tz='UTC'), *columns):
+            yield time_ns, {'time': time, **dict(zip(BAR_FIELDS, values))}
+
+
+def tick_events(tick_chunks):
+    """
+    Events of `Ticks` chunks (e.g. from `tick_stream.stream_ticks`) as
+    {'time', 'price' (bid), 'ask', 'bid'} dicts with UTC timestamps.
+
+    Chunks are consumed lazily, one block of rows at a time.
+    """
+    if isinstance(tick_chunks, Ticks):
+        tick_chunks = [tick_chunks]
+    for ticks in tick_chunks:
+        for lo in range(0, len(ticks), BLOCK_SIZE):
+            hi = lo + BLOCK_SIZE
+            times = ticks.time[lo:hi]
+            for time_ns, time, ask, bid in zip(times.tolist(), from_ns(times, tz='UTC'),
+                                               ticks.ask[lo:hi].tolist(), ticks.bid[lo:hi].tolist()):
+                yield time_ns, {'time': time, 'price': bid, 'ask': ask, 'bid': bid}
+
+
+def timer_events(start, every, end=None):
+    """
+    Events every `every` (an interval name or int nanoseconds) from `start`
+    until before `end`, with their UTC timestamp as payload; endless when
+    `end` is None.
+    """
+    step = INTERVALS[every] if isinstance(every, str) else int(every)
+    times = count(datetime_to_ns(start), step)
+    if end is not None:
+        end_ns = datetime_to_ns(end)
+        times = takewhile(lambda time_ns: time_ns < end_ns, times)
+    while True:
+        block = list(islice(times, BLOCK_SIZE))
+        if not block:
+            return
+        yield from zip(block, from_ns(block, tz='UTC'))
+
+
+class EventStream:
+    """
+    Time-ordered merge of several lazy event streams, dispatched to typed handlers.
+
+    Each stream is an iterable of (int64 ns UTC time, payload) pairs already
+    in time order, e.g. from `bar_events`, `tick_events`, `timer_events` or
+    `records`. `heapq.merge` keeps one pending event per stream, so memory
+    does not grow with the length of the streams and nothing is sorted.
+    Events at the same time are delivered in the order their streams were
+    added (add candles before ticks to see a candle before the ticks at its
+    timestamp).
+    """
+
+    def __init__(self):
+        self._streams = []
+        self._handlers = {}
+
+    def add(self, kind: str, events, handler=None):
+        """
+        Add a stream of `kind` events.
+
+        :param handler: Called with each event's payload; can also be set for
+            a kind with `on`.
+        """
+        self._streams.append(self._tagged(kind, events))
+        if handler is not None:
+            self.on(kind, handler)
+        return self
+
+    def on(self, kind: str, handler):
+        self._handlers[kind] = handler
+        return self
+
+    def __iter__(self):
+        """(time, kind, payload) events of all streams, in time order."""
+        return heapq.merge(*self._streams, key=_event_time)
+
+    def run(self) -> int:
+        """Dispatch every event to the handler of its kind; returns the number of events."""
+        handlers = self._handlers
+        dispatched = 0
+        for _, kind, payload in self:
+            handler = handlers.get(kind)
+            if handler is None:
+                raise KeyError(f"No handler for {kind!r} events")
+            handler(payload)
+            dispatched += 1
+        logger.debug(f"Dispatched {dispatched} events")
+        return dispatched
+
+    @staticmethod
+    def _tagged(kind, events):
+        last = None
+        for time_ns, payload in events:
+            if last is not None and time_ns < last:
+                raise ValueError(f"{kind!r} events are not in time order: {from_ns([time_ns], tz='UTC')[0]} "
+                                 f"after {from_ns([last], tz='UTC')[0]}")
+            last = time_ns
+            yield time_ns, kind, payload
+
+
+def _event_time(event):
+    return event[0]
+
+
+if __name__ == '__main__':
+    from bar_store import BarStore
+    from tick_stream import stream_ticks
+
+    logging.basicConfig(level=logging.INFO)
+
+    # Replay stored SPXm 5-minute and hourly candles, the tick files and a 15-minute timer
+    # in time order, as a multi-stream backtest would see them
+    store = BarStore('./data/store')
+    seen = {}
+    events = EventStream()
+    for interval in ('5m', '1h'):
+        events.add(f'candle_{interval}', bar_events(store.read('SPXm', interval), interval, at='close'))
+    events.add('tick', tick_events(stream_ticks('./spxm_data/*_ticks_*.csv')))
+    events.add('timer', timer_events('2025-01-21', '15m', end='2025-01-22'))
+    for kind in ('candle_5m', 'candle_1h', 'tick', 'timer'):
+        events.on(kind, lambda payload, kind=kind: seen.__setitem__(kind, seen.get(kind, 0) + 1))
+    events.run()
+    logger.info(f"Events by kind: {seen}")
@@ -0,0 +1,228 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+# Fibonacci ratios relative to the [nbi, nti] range, keyed like the live strategy levels.
+FIBONACCI_RATIOS = {
+    'fibo_base': 0.0,
+    'fibo_38': 0.382,
+    'fibo_50': 0.50,
+    'fibo_61': 0.618,
+    'fibo_top': 1.0,
+    'fibo_138': 1.382,
+    'fibo_150': 1.50,
+    'fibo_161': 1.618,
+    'fibo_200': 2.0,
+    'fibo_n200': -1.0,
+    'fibo_n161': -0.618,
+    'fibo_n138': -0.382,
+}
+
+# (level name, bearish Z, bullish Z), ordered by ascending price.
+# Crossing a level downwards yields the bearish code, upwards the bullish one.
+ZONE_TRANSITIONS = (
+    ('fibo_n200', -5, -4),
+    ('fibo_n161', -3, -2),
+    ('fibo_n138', -1, 0),
+    ('fibo_base', 1, 2),
+    ('fibo_38', 3, 4),
+    ('fibo_50', 5, 6),
+    ('fibo_61', 7, 8),
+    ('fibo_top', 9, 10),
+    ('fibo_138', 11, 12),
+    ('fibo_161', 13, 14),
+    ('fibo_200', 15, 16),
+)
+
+ZONE_ALPHABET = tuple(range(-5, 17))
+
+
+def fibonacci_levels(nbi: float, nti: float) -> dict:
+    """Return the Fibonacci price levels for base price `nbi` and top price `nti`."""
+    if nti <= nbi:
+        raise ValueError("'nti' must be greater than 'nbi' for Fibonacci calculations")
+
+    size_ = nti - nbi
+    levels = {name: nbi + ratio * size_ for name, ratio in FIBONACCI_RATIOS.items()}
+    # Anchors are stored exactly rather than as nbi + 1.0 * size_.
+    levels['fibo_top'] = nti
+    return levels
+
+
+class ZoneEngine:
+    """
+    Computes the Fibonacci zone (Z) sequence of a price series.
+
+    A price that falls through one or more levels takes the bearish code of the
+    lowest level crossed; a price that rises through one or more levels takes
+    the bullish code of the highest level crossed. Otherwise Z is unchanged.
+    """
+
+    def __init__(self, levels: dict):
+        prices = [levels[name] for name, _, _ in ZONE_TRANSITIONS]
+        if any(lo >= hi for lo, hi in zip(prices, prices[1:])):
+            raise ValueError("Fibonacci levels must be strictly increasing")
+
+        self.levels = np.array(prices, dtype=np.float64)
+        self.bearish_codes = np.array([code for _, code, _ in ZONE_TRANSITIONS], dtype=np.int8)
+        self.bullish_codes = np.array([code for _, _, code in ZONE_TRANSITIONS], dtype=np.int8)
+
+        # Plain lists for the scalar path, where bisect beats NumPy call overhead.
+        self._levels_list = prices
+        self._bearish_list = [int(code) for code in self.bearish_codes]
+        self._bullish_list = [int(code) for code in self.bullish_codes]
+
+    @classmethod
+    def from_anchors(cls, nbi: float, nti: float):
+        return cls(fibonacci_levels(nbi, nti))
+
+    def step(self, ref_price: float, prev_ref_price: float, Z: int) -> int:
+        """Return the zone after moving from `prev_ref_price` to `ref_price`."""
+        levels = self._levels_list
+
+        # Lowest level with ref_price < level <= prev_ref_price
+        idx = bisect_right(levels, ref_price)
+        if idx < len(levels) and ref_price < levels[idx] <= prev_ref_price:
+            return self._bearish_list[idx]
+
+        # Highest level with prev_ref_price <= level < ref_price
+        idx = bisect_left(levels, ref_price) - 1
+        if idx >= 0 and prev_ref_price <= levels[idx] < ref_price:
+            return self._bullish_list[idx]
+
+        return Z
+
+    def compute(self, closes, Z: int = 0, prev_close: float = 0.0) -> np.ndarray:
+        """
+        Return the Z sequence (int8) for a whole array of closes.
+
+        :param closes: Reference prices in chronological order.
+        :param Z: Zone before the first close.
+        :param prev_close: Reference price before the first close.
+        """
+        closes = np.asarray(closes, dtype=np.float64)
+        if closes.size == 0:
+            return np.empty(0, dtype=np.int8)
+
+        prev = np.empty_like(closes)
+        prev[0] = prev_close
+        prev[1:] = closes[:-1]
+
+        levels = self.levels
+        last = len(levels) - 1
+
+        down = np.searchsorted(levels, closes, side='right')
+        down_idx = np.minimum(down, last)
+        crossed_down = (down <= last) & (closes < levels[down_idx]) & (levels[down_idx] <= prev)
+
+        up = np.searchsorted(levels, closes, side='left') - 1
+        up_idx = np.maximum(up, 0)
+        crossed_up = (up >= 0) & (levels[up_idx] < closes) & (prev <= levels[up_idx])
+
+        codes = np.where(crossed_down, self.bearish_codes[down_idx], self.bullish_codes[up_idx])
+
+        # Forward-fill the code of the most recent crossing.
+        positions = np.where(crossed_down | crossed_up, np.arange(closes.size), -1)
+        np.maximum.accumulate(positions, out=positions)
+
+        zones = np.full(closes.size, Z, dtype=np.int8)
+        has_event = positions >= 0
+        zones[has_event] = codes[positions[has_event]]
+        return zones
+
+
+class LevelSchedule:
+    """
+    Versioned history of Fibonacci anchors, each effective from a timestamp.
+
+    Every `add` creates a new version; at time t the levels of the latest
+    version effective at or before t apply (the newest version wins on equal
+    timestamps, and bars before the first version use the first one). Zones
+    are computed segment by segment, carrying Z and the previous close across
+    level switches, so re-anchoring never changes the zones before it.
+    """
+
+    def __init__(self, versions=()):
+        # (effective_from_ns, version, nbi, nti), kept sorted
+        self._versions = []
+        self._engines = {}
+        for effective, nbi, nti in versions:
+            self.add(effective, nbi, nti)
+
+    @classmethod
+    def single(cls, nbi: float, nti: float):
+        """A schedule with one level set applying to all times."""
+        return cls([(np.iinfo(np.int64).min, nbi, nti)])
+
+    def __len__(self):
+        return len(self._versions)
+
+    @property
+    def versions(self):
+        """(effective_from_ns, nbi, nti) of every version, in effective order."""
+        return [(effective, nbi, nti) for effective, _, nbi, nti in self._versions]
+
+    @property
+    def current(self):
+        """(nbi, nti) of the latest effective version, i.e. the levels in force from its time on."""
+        _, _, nbi, nti = self._versions[-1]
+        return nbi, nti
+
+    @property
+    def key(self):
+        """Hashable identity of the schedule, for cache keys."""
+        return tuple(self.versions)
+
+    def add(self, effective_from: int, nbi: float, nti: float) -> int:
+        """Add anchors effective from `effective_from` (int64 ns); returns that time."""
+        fibonacci_levels(nbi, nti)  # Validate before storing
+        effective_from = int(effective_from)
+        version = len(self._versions)
+        self._versions.append((effective_from, version, float(nbi), float(nti)))
+        self._versions.sort()
+        return effective_from
+
+    def _index_at(self, times):
+        starts = np.array([effective for effective, _, _, _ in self._versions], dtype=np.int64)
+        return np.maximum(np.searchsorted(starts, times, side='right') - 1, 0)
+
+    def anchors_at(self, time_ns: int):
+        """(nbi, nti) in force at `time_ns`."""
+        _, _, nbi, nti = self._versions[int(self._index_at([time_ns])[0])]
+        return nbi, nti
+
+    def engine(self, nbi: float, nti: float) -> ZoneEngine:
+        key = (nbi, nti)
+        if key not in self._engines:
+            self._engines[key] = ZoneEngine.from_anchors(nbi, nti)
+        return self._engines[key]
+
+    def compute(self, times, closes, Z: int = 0, prev_close: float = 0.0) -> np.ndarray:
+        """
+        Z sequence of time-ordered closes, switching levels at version boundaries.
+
+        :param times: int64 ns timestamps of the closes.
+        """
+        if not self._versions:
+            raise ValueError("The level schedule is empty")
+        times = np.asarray(times, dtype=np.int64)
+        closes = np.asarray(closes, dtype=np.float64)
+        zones = np.empty(closes.size, dtype=np.int8)
+        if not closes.size:
+            return zones
+
+        index = self._index_at(times)
+        bounds = np.flatnonzero(np.diff(index)) + 1
+        for start, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [closes.size]))):
+            _, _, nbi, nti = self._versions[index[start]]
+            zones[start:end] = self.engine(nbi, nti).compute(closes[start:end], Z=Z, prev_close=prev_close)
+            Z, prev_close = int(zones[end - 1]), float(closes[end - 1])
+        return zones
+
+    def to_list(self):
+        return [[effective, nbi, nti] for effective, nbi, nti in self.versions]
+
+    @classmethod
+    def from_list(cls, versions):
+        return cls([tuple(version) for version in versions])
@@ -0,0 +1,168 @@
+import logging
+
+import numpy as np
+
+from market_data import INTERVALS, Bars, Ticks
+
+
+logger = logging.getLogger(__name__)
+
+NS_PER_SECOND = 10**9
+
+# Order handling of the live bot (the CassandraTickProcessor timers in ON_TD_Cassandra_V2__v3.py)
+CLOSE_RETRY_INTERVAL = 10 * NS_PER_SECOND
+CLOSE_RETRY_WINDOW = 4 * 60 * NS_PER_SECOND  # Afterwards only close in profit
+QUOTE_TIMEOUT = 1800 * NS_PER_SECOND  # No quote for this long: the market is closed
+RETRY_BLOCK = 4096  # Close retries evaluated per NumPy pass
+
+
+def synthetic_ticks(bars: Bars, interval: str = '1h', spread: float = 0.5) -> Ticks:
+    """
+    Ticks approximating bars where no tick files exist: four quotes per bar
+    along the usual open -> low -> high -> close path (open -> high -> low ->
+    close for down bars) at a third of the bar apart, last one a second before
+    the bar closes, quoted `spread` wide around the bar prices.
+    """
+    step = INTERVALS[interval]
+    up = bars.close >= bars.open
+    path = np.stack((bars.open, np.where(up, bars.low, bars.high), np.where(up, bars.high, bars.low), bars.close),
+                    axis=1)
+    offsets = np.array([0, step // 3, 2 * step // 3, step - NS_PER_SECOND], dtype=np.int64)
+    times = (bars.time[:, None] + offsets).ravel()
+    mid = path.ravel()
+    return Ticks(times, mid + spread / 2, mid - spread / 2)
+
+
+class FillSimulator:
+    """
+    Market fills of the live bot's orders against recorded (or synthetic) ticks.
+
+    Orders are sent at their decision instant, as the session timers of the
+    live bot do, and fill `latency` later at the quote in force then (the
+    last tick at or before it): buys at the ask and closes at the bid,
+    `slippage` points worse. An order meeting no quote for `quote_timeout`
+    hit a closed market and is not filled. Closes follow the live retry
+    logic: an attempt at the close time and one every `retry_interval`
+    after, past `retry_window` only while the position is in profit.
+    Brokers reject a `reject_rate` share of the requests, drawn from a
+    seeded generator.
+
+    Lookups are binary searches over the tick times, so a fill costs
+    O(log n) whatever the tick archive size; pass memory-mapped ticks from
+    `BarStore.read(symbol, 'tick')` to avoid loading them. Retries are
+    evaluated `RETRY_BLOCK` at a time.
+    """
+
+    def __init__(self, ticks: Ticks, latency: int = 0, slippage: float = 0.0, reject_rate: float = 0.0,
+                 quote_timeout: int = QUOTE_TIMEOUT, retry_interval: int = CLOSE_RETRY_INTERVAL,
+                 retry_window: int = CLOSE_RETRY_WINDOW, seed=None):
+        """
+        :param latency: Nanoseconds between sending an order and its fill.
+        :param quote_timeout: Nanoseconds without a quote after which the market counts as closed.
+        """
+        self.ticks = ticks
+        self.latency = int(latency)
+        self.slippage = slippage
+        self.reject_rate = reject_rate
+        self.quote_timeout = int(quote_timeout)
+        self.retry_interval = int(retry_interval)
+        self.retry_window = int(retry_window)
+        self.rng = np.random.default_rng(seed)
+
+        self.attempts = 0
+        self.rejections = 0
+
+    def covers(self, time_ns: int) -> bool:
+        """Whether `time_ns` lies within the ticks, i.e. whether fills there are simulated."""
+        return len(self.ticks) > 0 and int(self.ticks.time[0]) <= time_ns <= int(self.ticks.time[-1])
+
+    def buy(self, time_ns: int):
+        """
+        Open a long position sent at `time_ns`.
+
+        :return: (fill time, ask price), or None when the market is closed or the
+            request is rejected (the bot does not retry opens).
+        """
+        fill_ns = time_ns + self.latency
+        i = self._quote_at(fill_ns)
+        if not self._market_open(i, fill_ns) or self._rejected():
+            return None
+        return self._fill(fill_ns, i, 'ask')
+
+    def close(self, time_ns: int, open_price: float):
+        """
+        Close a long position opened at `open_price`, first sent at `time_ns`.
+
+        :return: (fill time, bid price), or None when the ticks run out first.
+        """
+        times, bids = self.ticks.time, self.ticks.bid
+        last = int(times[-1]) if len(self.ticks) else time_ns - 1
+        steps = np.arange(RETRY_BLOCK, dtype=np.int64) * self.retry_interval
+        for block in range(time_ns, last + 1, RETRY_BLOCK * self.retry_interval):
+            trials = block + steps
+            trials = trials[trials <= last]
+            # Past the retry window the close is only sent while the last quote shows a profit
+            quotes = np.searchsorted(times, trials, side='right') - 1
+            in_profit = (quotes >= 0) & (bids[np.maximum(quotes, 0)] > open_price)
+            sent = (trials - time_ns < self.retry_window) | in_profit
+            fills = np.searchsorted(times, trials + self.latency, side='right') - 1
+            open_market = (fills >= 0) & (trials + self.latency - times[np.maximum(fills, 0)] <= self.quote_timeout)
+            for k in np.flatnonzero(sent & open_market):
+                if not self._rejected():
+                    return self._fill(int(trials[k]) + self.latency, int(fills[k]), 'bid')
+        return None
+
+    def _quote_at(self, time_ns):
+        """Index of the quote in force at `time_ns`, -1 before the first tick."""
+        return int(np.searchsorted(self.ticks.time, time_ns, side='right')) - 1
+
+    def _market_open(self, i, time_ns):
+        return i >= 0 and time_ns - int(self.ticks.time[i]) <= self.quote_timeout
+
+    def _rejected(self):
+        self.attempts += 1
+        if self.reject_rate and self.rng.random() < self.reject_rate:
+            self.rejections += 1
+            return True
+        return False
+
+    def _fill(self, fill_ns, i, side):
+        price = float(getattr(self.ticks, side)[i])
+        price = price + self.slippage if side == 'ask' else price - self.slippage
+        return fill_ns, price
+
+
+def simulated_fill(fills, order_type, time_ns, price, at_ns, open_price=None):
+    """
+    (time, price) of a backtest order decided on the bar at `time_ns` for `price`.
+
+    Without a simulator, or where its ticks do not reach, that is the bar
+    itself; otherwise the order is filled by `fills` from `at_ns`, the
+    instant the live bot would send it. None when a simulated open is not
+    filled.
+    """
+    if fills is None or not fills.covers(at_ns):
+        return time_ns, price
+    if order_type == 'BUY':
+        return fills.buy(at_ns)
+    filled = fills.close(at_ns, open_price)
+    if filled is None:
+        logger.debug(f"Ticks ran out before the close from {at_ns} was filled; using the bar price")
+        return time_ns, price
+    return filled
+
+
+if __name__ == '__main__':
+    from backtest import ColumnarBacktest, ONBacktest, summarize_orders
+    from bar_loader import load_bars
+
+    logging.basicConfig(level=logging.INFO)
+
+    # ON strategy on 2022.csv with bar-price fills vs. simulated fills on a 0.5-point synthetic spread
+    bars = load_bars('./data/2022.csv')
+    backtest = ColumnarBacktest(bars, market_timezone='UTC')
+    logger.info(f"Bar fills: {summarize_orders(backtest.run(ONBacktest(collect_logs=False)).get_orders())}")
+    fills = FillSimulator(synthetic_ticks(bars, '1h', spread=0.5), latency=250_000_000, reject_rate=0.05, seed=0)
+    orders = backtest.run(ONBacktest(collect_logs=False, fills=fills)).get_orders()
+    logger.info(f"Simulated fills: {summarize_orders(orders)}; "
+                f"{fills.rejections} of {fills.attempts} requests rejected")
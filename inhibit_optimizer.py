@@ -0,0 +1,131 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from backtest import ColumnarBacktest, ONBacktest, ZoneCache, ZONE_CACHE
+from bar_loader import load_bars
+from fibo_zones import ZONE_ALPHABET
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on subset x trade cells evaluated at once for the drawdowns
+CHUNK_CELLS = 1 << 22
+
+
+def session_trades(backtest: ColumnarBacktest, zone_cache: ZoneCache = ZONE_CACHE, **params):
+    """
+    Entry zone and profit of every ON session trade with nothing inhibited.
+
+    :param params: ONBacktest parameters other than V (nbi, nti, Z, session, ...).
+    :return: (zones, profits) arrays in trade order.
+    """
+    strategy = ONBacktest(V=(), collect_logs=False, zone_cache=zone_cache, **params)
+    backtest.run(strategy)
+    orders = strategy.get_orders()
+
+    # Each session trade is only independent of the others if no buy candle
+    # fell inside an open position; otherwise inhibiting one trade could
+    # unblock another one and the closed form below is only approximate.
+    opened = len(orders) + (strategy.current_order is not None)
+    blocked = int(np.count_nonzero(strategy._is_buy)) - opened
+    if blocked:
+        logger.warning(f"{blocked} buy candles fell inside open positions - subset results are approximate")
+
+    zones = np.array([order['K'] for order in orders], dtype=np.int64)
+    profits = np.array([order['Profit'] for order in orders], dtype=np.float64)
+    return zones, profits
+
+
+def zone_table(zones, profits) -> pd.DataFrame:
+    """Per-zone trade count, total profit and hit rate over the zone alphabet."""
+    table = pd.DataFrame({'zone': list(ZONE_ALPHABET)})
+    index = zones - ZONE_ALPHABET[0]
+    size = len(ZONE_ALPHABET)
+    table['trades'] = np.bincount(index, minlength=size)
+    table['profit'] = np.bincount(index, weights=profits, minlength=size)
+    table['wins'] = np.bincount(index, weights=profits > 0, minlength=size).astype(int)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table['hit_rate'] = table['wins'] / table['trades']
+    return table
+
+
+def evaluate_inhibit_sets(zones, profits, with_drawdown: bool = True) -> pd.DataFrame:
+    """
+    Profit, trade count, hit rate and max drawdown of every inhibit vector.
+
+    Since a session is traded iff its entry zone is not inhibited, the result
+    of a set follows from the per-trade profits without simulation. Only
+    zones that were actually observed at entries are enumerated (2^N sets for
+    N observed zones); the others never change the result, so each row stands
+    for every vector of the full alphabet with the same observed part.
+
+    :return: One row per set, best total profit first (then lowest drawdown).
+    """
+    zones = np.asarray(zones, dtype=np.int64)
+    profits = np.asarray(profits, dtype=np.float64)
+    observed, trade_zone = np.unique(zones, return_inverse=True)
+    n = observed.size
+
+    codes = np.arange(1 << n, dtype=np.int64)
+    inhibited = ((codes[:, None] >> np.arange(n)) & 1).astype(bool)
+    allowed = ~inhibited
+
+    zone_profit = np.bincount(trade_zone, weights=profits, minlength=n)
+    zone_trades = np.bincount(trade_zone, minlength=n)
+    zone_wins = np.bincount(trade_zone, weights=profits > 0, minlength=n)
+
+    total_profit = allowed @ zone_profit
+    trades = allowed @ zone_trades
+    wins = allowed @ zone_wins
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hit_rate = wins / trades
+
+    results = pd.DataFrame({
+        'V': [tuple(observed[row].tolist()) for row in inhibited],
+        'total_profit': total_profit,
+        'trades': trades,
+        'hit_rate': hit_rate,
+    })
+    if with_drawdown:
+        results['max_drawdown'] = _max_drawdowns(allowed, trade_zone, profits)
+        order = ['total_profit', 'max_drawdown']
+        ascending = [False, True]
+    else:
+        order, ascending = ['total_profit'], [False]
+    return results.sort_values(order, ascending=ascending, ignore_index=True)
+
+
+def _max_drawdowns(allowed, trade_zone, profits):
+    """Max drawdown of the equity curve of each subset (rows of `allowed`)."""
+    drawdowns = np.zeros(allowed.shape[0])
+    if not profits.size:
+        return drawdowns
+
+    rows = max(1, CHUNK_CELLS // profits.size)
+    for start in range(0, allowed.shape[0], rows):
+        taken = allowed[start:start + rows][:, trade_zone]
+        equity = np.cumsum(np.where(taken, profits, 0.0), axis=1)
+        peak = np.maximum(np.maximum.accumulate(equity, axis=1), 0.0)
+        drawdowns[start:start + rows] = np.max(peak - equity, axis=1)
+    return drawdowns
+
+
+def optimize_inhibit_vector(backtest: ColumnarBacktest, top: int = None, **params) -> pd.DataFrame:
+    """Rank every inhibit vector for the ON strategy on `backtest` (see `evaluate_inhibit_sets`)."""
+    results = evaluate_inhibit_sets(*session_trades(backtest, **params))
+    return results if top is None else results.head(top)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    backtest = ColumnarBacktest(load_bars('./data/2022.csv'), market_timezone='UTC')
+
+    zones, profits = session_trades(backtest)
+    print(zone_table(zones, profits).query('trades > 0').to_string(index=False))
+
+    results = evaluate_inhibit_sets(zones, profits)
+    print(results.head(20).to_string())
+    results.to_csv('inhibit_sets.csv', index=False)
@@ -0,0 +1,332 @@
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from clock import WALL_CLOCK
+
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Bar interval lengths in nanoseconds
+INTERVALS = {
+    '1m': 60 * 10**9,
+    '5m': 5 * 60 * 10**9,
+    '15m': 15 * 60 * 10**9,
+    '1h': 3600 * 10**9,
+    '1d': 86400 * 10**9,
+}
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+
+def to_ns(timestamps) -> np.ndarray:
+    """Convert datetimes (aware or UTC-naive) to int64 nanoseconds since the epoch."""
+    index = pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True))
+    return index.as_unit('ns').asi8
+
+
+def datetime_to_ns(when) -> int:
+    """Convert a single datetime (aware or UTC-naive), date string or int64 nanoseconds to nanoseconds."""
+    if isinstance(when, (int, np.integer)):
+        return int(when)
+    if isinstance(when, str):
+        when = pd.Timestamp(when)
+    if isinstance(when, pd.Timestamp):
+        return int(when.tz_localize('UTC').value if when.tzinfo is None else when.value)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    delta = when - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
+def from_ns(values, tz='America/New_York'):
+    """Convert int64 nanoseconds since the epoch back to aware timestamps."""
+    return pd.to_datetime(np.asarray(values, dtype=np.int64), utc=True).tz_convert(tz)
+
+
+class Bars:
+    """Columnar OHLCV bar set: int64 ns UTC open times and float64 price columns."""
+
+    COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, time, open, high, low, close, volume=None):
+        self.time = np.asarray(time, dtype=np.int64)
+        self.open = np.asarray(open, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+        self.close = np.asarray(close, dtype=np.float64)
+        self.volume = (np.zeros(self.time.size) if volume is None
+                       else np.asarray(volume, dtype=np.float64))
+
+    def __len__(self):
+        return self.time.size
+
+    def __repr__(self):
+        if not len(self):
+            return 'Bars(empty)'
+        first, last = from_ns(self.time[[0, -1]], tz='UTC')
+        return f'Bars({len(self)} bars, {first} .. {last})'
+
+    @classmethod
+    def empty(cls):
+        return cls(*(np.empty(0) for _ in cls.COLUMNS))
+
+    @classmethod
+    def from_frame(cls, df, time_column=None):
+        """Build bars from a DataFrame with open/high/low/close(/volume) columns in any case."""
+        columns = {str(column).strip().lower(): column for column in df.columns}
+        times = df.index if time_column is None else df[time_column]
+        volume = df[columns['volume']].to_numpy(dtype=float) if 'volume' in columns else None
+        return cls(to_ns(times),
+                   df[columns['open']].to_numpy(dtype=float),
+                   df[columns['high']].to_numpy(dtype=float),
+                   df[columns['low']].to_numpy(dtype=float),
+                   df[columns['close']].to_numpy(dtype=float),
+                   volume)
+
+    def to_frame(self):
+        """Return a DataFrame indexed by UTC timestamps."""
+        index = pd.DatetimeIndex(from_ns(self.time, tz='UTC'), name='time')
+        return pd.DataFrame({name: getattr(self, name) for name in self.COLUMNS[1:]}, index=index)
+
+    def copy(self):
+        return Bars(*(np.array(getattr(self, name)) for name in self.COLUMNS))
+
+    def slice(self, start=None, end=None):
+        """Bars with start <= time < end, as views on the same arrays."""
+        lo = 0 if start is None else int(np.searchsorted(self.time, datetime_to_ns(start), side='left'))
+        hi = len(self) if end is None else int(np.searchsorted(self.time, datetime_to_ns(end), side='left'))
+        return Bars(*(getattr(self, name)[lo:hi] for name in self.COLUMNS))
+
+    @classmethod
+    def concat(cls, parts):
+        """Concatenate bar sets, sorting by time; later parts win on duplicate timestamps."""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        merged = {name: np.concatenate([getattr(part, name) for part in parts]) for name in cls.COLUMNS}
+
+        # Stable sort, then keep the last occurrence of every timestamp
+        order = np.argsort(merged['time'], kind='stable')
+        times = merged['time'][order]
+        keep = np.ones(times.size, dtype=bool)
+        keep[:-1] = times[1:] != times[:-1]
+        order = order[keep]
+        return cls(*(merged[name][order] for name in cls.COLUMNS))
+
+
+class Ticks:
+    """Columnar tick set: int64 ns UTC times and float64 ask/bid prices."""
+
+    COLUMNS = ('time', 'ask', 'bid')
+
+    def __init__(self, time, ask, bid):
+        self.time = np.asarray(time, dtype=np.int64)
+        self.ask = np.asarray(ask, dtype=np.float64)
+        self.bid = np.asarray(bid, dtype=np.float64)
+
+    def __len__(self):
+        return self.time.size
+
+    def __repr__(self):
+        if not len(self):
+            return 'Ticks(empty)'
+        first, last = from_ns(self.time[[0, -1]], tz='UTC')
+        return f'Ticks({len(self)} ticks, {first} .. {last})'
+
+    @classmethod
+    def empty(cls):
+        return cls(*(np.empty(0) for _ in cls.COLUMNS))
+
+    def copy(self):
+        return Ticks(*(np.array(getattr(self, name)) for name in self.COLUMNS))
+
+    def slice(self, start=None, end=None):
+        """Ticks with start <= time < end, as views on the same arrays."""
+        lo = 0 if start is None else int(np.searchsorted(self.time, datetime_to_ns(start), side='left'))
+        hi = len(self) if end is None else int(np.searchsorted(self.time, datetime_to_ns(end), side='left'))
+        return Ticks(*(getattr(self, name)[lo:hi] for name in self.COLUMNS))
+
+    @classmethod
+    def concat(cls, parts):
+        """Concatenate tick sets, sorting by time; ticks sharing a timestamp keep their order."""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        merged = {name: np.concatenate([getattr(part, name) for part in parts]) for name in cls.COLUMNS}
+        order = np.argsort(merged['time'], kind='stable')
+        return cls(*(merged[name][order] for name in cls.COLUMNS))
+
+
+class BarProvider:
+    """Source of historical bars for a symbol and interval."""
+
+    def get_bars(self, symbol: str, interval: str, start, end) -> Bars:
+        """Return the bars with start <= time < end."""
+        raise NotImplementedError
+
+
+class YahooBarProvider(BarProvider):
+    """Bars downloaded from Yahoo Finance."""
+
+    def __init__(self):
+        import yfinance  # Only needed when actually downloading
+        self._yf = yfinance
+
+    def get_bars(self, symbol, interval, start, end):
+        start_dt = from_ns([datetime_to_ns(start)], tz='UTC')[0].to_pydatetime()
+        end_dt = from_ns([datetime_to_ns(end)], tz='UTC')[0].to_pydatetime()
+        data = self._yf.download(symbol, start=start_dt, end=end_dt, interval=interval, progress=False)
+        if data is None or data.empty:
+            return Bars.empty()
+
+        if isinstance(data.columns, pd.MultiIndex):
+            data.columns = data.columns.get_level_values(0)
+        return Bars.from_frame(data).slice(start, end)
+
+
+def read_bars_csv(path) -> Bars:
+    """Read one of the bar CSV files under data/, whatever its dialect (see `bar_loader.load_bars`)."""
+    from bar_loader import load_bars  # bar_loader imports this module
+    return load_bars(path)
+
+
+class CsvBarProvider(BarProvider):
+    """
+    Offline provider serving bars from local CSV files.
+
+    Files are parsed once through the binary cache of `bar_loader`.
+
+    :param files: Mapping of (symbol, interval) to a CSV path, directory or
+                  glob pattern (split exports are merged).
+    """
+
+    DEFAULT_FILES = {
+        ('^GSPC', '1d'): DATA_DIR / 'Yahoo-SP500-2024.11.19.csv',
+        ('GC=F', '1d'): DATA_DIR / 'Yahoo-XAUUSD-2024.11.19.csv',
+        ('^GSPC', '1h'): DATA_DIR / 'sp500_hourly_utc.csv',
+        ('^GSPC', '5m'): DATA_DIR / 'sp500_5m_utc.csv',
+        ('SPXm', '1h'): DATA_DIR / 'SPXm-1H.csv',
+        ('SPX', '5m'): DATA_DIR / 'TVC_SPX_VS',
+    }
+
+    def __init__(self, files=None):
+        self.files = dict(self.DEFAULT_FILES if files is None else files)
+        self._loaded = {}
+
+    def get_bars(self, symbol, interval, start, end):
+        key = (symbol, interval)
+        if key not in self.files:
+            raise KeyError(f"No CSV file configured for {symbol} {interval}")
+        if key not in self._loaded:
+            self._loaded[key] = read_bars_csv(self.files[key])
+        return self._loaded[key].slice(start, end)
+
+
+class CachedBarProvider(BarProvider):
+    """
+    On-disk columnar cache in front of another provider.
+
+    Every (symbol, interval) partition is a directory of .npy column files plus
+    the list of time ranges already fetched. Requests only go upstream for the
+    missing ranges; the rest is served from memory-mapped columns. Ranges closer
+    than two intervals to the present are never marked as covered, since their
+    bars may still be forming, and neither are ranges upstream returned no bars
+    for, since an empty answer may be a failure. The present is the time of
+    `clock`, so a replay on a simulated clock does not cache its future.
+    """
+
+    COVERAGE_FILE = 'coverage.json'
+
+    def __init__(self, upstream: BarProvider, cache_dir, clock=WALL_CLOCK):
+        self.upstream = upstream
+        self.cache_dir = Path(cache_dir)
+        self.clock = clock
+
+    def get_bars(self, symbol, interval, start, end):
+        start_ns, end_ns = datetime_to_ns(start), datetime_to_ns(end)
+        partition = self._partition_dir(symbol, interval)
+        coverage = self._load_coverage(partition)
+
+        gaps = self._missing_ranges(coverage, start_ns, end_ns)
+        if gaps:
+            fetched = []
+            for gap_start, gap_end in gaps:
+                try:
+                    bars = self.upstream.get_bars(symbol, interval, gap_start, gap_end)
+                except Exception as e:
+                    logger.error(f"Upstream error fetching {symbol} {interval}: {e}")
+                    continue
+                if not len(bars):
+                    # yfinance answers failures and rate limits with an empty frame: retry next time
+                    gap = from_ns([gap_start, gap_end], tz='UTC')
+                    logger.warning(f"No {symbol} {interval} bars upstream for {gap[0]} .. {gap[1]}; not cached")
+                    continue
+                fetched.append(bars)
+                coverage.append([gap_start, self._covered_until(gap_end, interval)])
+
+            if fetched:
+                cached = self._load_partition(partition, mmap_mode=None)
+                self._save_partition(partition, Bars.concat([cached] + fetched), coverage)
+
+        # Copy the requested range so no file mapping outlives the call
+        return self._load_partition(partition).slice(start_ns, end_ns).copy()
+
+    def _partition_dir(self, symbol, interval):
+        safe_symbol = ''.join(char if char.isalnum() else '_' for char in symbol)
+        return self.cache_dir / safe_symbol / interval
+
+    def _covered_until(self, end_ns, interval):
+        """End of a fetched range that can be considered final (bars still forming are excluded)."""
+        settle_ns = 2 * INTERVALS.get(interval, INTERVALS['1d'])
+        return min(end_ns, self.clock.time_ns() - settle_ns)
+
+    @staticmethod
+    def _missing_ranges(coverage, start_ns, end_ns):
+        gaps = []
+        cursor = start_ns
+        for lo, hi in sorted(coverage):
+            if hi <= cursor:
+                continue
+            if lo >= end_ns:
+                break
+            if lo > cursor:
+                gaps.append((cursor, lo))
+            cursor = max(cursor, hi)
+        if cursor < end_ns:
+            gaps.append((cursor, end_ns))
+        return gaps
+
+    def _load_coverage(self, partition):
+        path = partition / self.COVERAGE_FILE
+        return json.loads(path.read_text()) if path.is_file() else []
+
+    def _load_partition(self, partition, mmap_mode='r'):
+        if not (partition / 'time.npy').is_file():
+            return Bars.empty()
+        return Bars(*(np.load(partition / f'{name}.npy', mmap_mode=mmap_mode) for name in Bars.COLUMNS))
+
+    def _save_partition(self, partition, bars, coverage):
+        partition.mkdir(parents=True, exist_ok=True)
+        for name in Bars.COLUMNS:
+            tmp_path = partition / f'{name}.tmp.npy'
+            np.save(tmp_path, getattr(bars, name))
+            os.replace(tmp_path, partition / f'{name}.npy')
+
+        # Merge overlapping ranges before storing
+        merged = []
+        for lo, hi in sorted(coverage):
+            if hi <= lo:
+                continue
+            if merged and lo <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], hi)
+            else:
+                merged.append([lo, hi])
+        (partition / self.COVERAGE_FILE).write_text(json.dumps(merged))
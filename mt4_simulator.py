@@ -0,0 +1,243 @@
+import heapq
+import logging
+import tempfile
+from datetime import timezone
+from itertools import count
+from pathlib import Path
+from time import monotonic_ns, sleep
+
+import pandas as pd
+
+from bar_loader import MT4_SERVER_NY_OFFSET
+from clock import SimulatedClock
+from market_data import Ticks
+from scheduler import Scheduler
+
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIME_FORMAT = '%Y.%m.%d %H:%M:%S'
+
+
+class MT4Simulator:
+    """
+    Stand-in for `api.dwx_client` that replays historical ticks to the live strategies.
+
+    Implements the surface they use (`open_orders`, `account_info`,
+    `ACTIVE`, `start`, `subscribe_symbols`, `open_order`, `close_order`)
+    and calls the event handler's `on_tick`, `on_message` and
+    `on_order_event` as the bridge does. Commands are executed like the MT4
+    expert would: `latency` nanoseconds after they were sent, at the quote
+    in force then, buying at the ask and closing at the bid. Time comes from
+    `clock`, which the replay moves to each tick: strategies given the same
+    clock and `scheduler` run on simulated time as fast as they can. Between
+    ticks, commands and timers run in time order, each at its own time.
+    """
+
+    def __init__(self, event_handler=None, clock: SimulatedClock = None, latency: int = 0,
+                 contract_size: float = 1.0, commission: float = 0.0, balance: float = 10000.0,
+                 first_ticket: int = 1, orders_dir=None):
+        """
+        :param commission: Charged per lot on every closed order.
+        :param orders_dir: Order files directory to give the replayed strategies; by default
+            a temporary one, removed with the simulator, as tickets restart at `first_ticket`
+            and must not pick up (or overwrite) the files of live orders or earlier replays.
+        """
+        self.event_handler = event_handler
+        self.clock = clock or SimulatedClock()
+        self.latency = int(latency)
+        self.contract_size = contract_size
+        self.commission = commission
+        if orders_dir is None:
+            self._orders_tmp = tempfile.TemporaryDirectory(prefix='mt4_simulator_orders_')
+            orders_dir = self._orders_tmp.name
+        self.orders_dir = Path(orders_dir)
+
+        self.ACTIVE = True
+        self.START = False
+        self.subscribed_symbols = set()
+        self.market_data = {}
+        self.open_orders = {}
+        self.closed_orders = []
+        self.account_info = {'name': 'simulator', 'number': 0, 'currency': 'USD', 'leverage': 100,
+                             'free_margin': balance, 'balance': balance, 'equity': balance}
+
+        self._tickets = count(first_ticket)
+        self._commands = []  # Heap of (due time, sequence, command, kwargs)
+        self._sequence = count()
+        self.scheduler = Scheduler(self.clock)
+
+    def start(self):
+        self.START = True
+
+    def stop(self):
+        self.ACTIVE = False
+
+    def subscribe_symbols(self, symbols):
+        self.subscribed_symbols = set(symbols)
+
+    def open_order(self, symbol='EURUSD', order_type='buy', lots=0.01, price=0, stop_loss=0, take_profit=0,
+                   magic=0, comment='', expiration=0):
+        self._send('open', symbol=symbol, order_type=order_type, lots=lots, stop_loss=stop_loss,
+                   take_profit=take_profit, magic=magic, comment=comment)
+
+    def close_order(self, ticket, lots=0):
+        self._send('close', ticket=str(ticket), lots=lots)
+
+    def close_all_orders(self):
+        for ticket in list(self.open_orders):
+            self.close_order(ticket)
+
+    def every(self, interval: int, callback, start_ns: int = None):
+        """
+        Call `callback()` every `interval` nanoseconds of simulated time from
+        `start_ns` (default: one interval from now), e.g. to drive a strategy's
+        state refresh, which runs on a wall-clock thread live.
+        """
+        return self.scheduler.call_every(interval, callback, start_ns)
+
+    def tick(self, time_ns: int, symbol: str, bid: float, ask: float):
+        """Advance to one tick: run what is due by then, then pass the tick to the event handler."""
+        # Commands and timers due before the tick run at their own times, on the previous quotes
+        self.run_until(time_ns)
+        self.clock.advance_to(time_ns)
+        self.market_data[symbol] = {'bid': bid, 'ask': ask, 'tick_value': 1.0}
+
+        for order in self.open_orders.values():
+            if order['symbol'] == symbol:
+                order['pnl'] = self._pnl(order, bid, ask)
+
+        if self.START and symbol in self.subscribed_symbols and self.event_handler is not None:
+            self.event_handler.on_tick(symbol, bid, ask)
+
+    def run_until(self, time_ns: int):
+        """
+        Execute the commands and fire the timers due by `time_ns`, always the
+        earliest next (a command first on equal times), with the clock moved
+        to each one's time, so a timer never runs ahead of an earlier command.
+        """
+        scheduler = self.scheduler
+        while True:
+            command_due = self._commands[0][0] if self._commands else None
+            timer_due = scheduler.next_deadline()
+            if command_due is not None and command_due <= time_ns and (timer_due is None or command_due <= timer_due):
+                _, _, command, kwargs = heapq.heappop(self._commands)
+                self.clock.advance_to(command_due)
+                getattr(self, f'_execute_{command}')(**kwargs)
+            elif timer_due is not None and timer_due <= time_ns:
+                # Fires the timers due at that instant, including any they arm for it
+                scheduler.run_until(timer_due)
+            else:
+                return
+
+    def replay(self, tick_chunks, symbol: str, speed: float = None) -> int:
+        """
+        Replay `Ticks` chunks of `symbol` (e.g. from `tick_stream.stream_ticks`
+        or `BarStore.iter_days`) in order; returns the number of ticks.
+
+        :param speed: Pace the ticks at `speed` times real time (e.g. 1000)
+            instead of replaying them as fast as possible.
+        """
+        if isinstance(tick_chunks, Ticks):
+            tick_chunks = [tick_chunks]
+        replayed = 0
+        tick = self.tick
+        first_ns = started = None
+        for ticks in tick_chunks:
+            for time_ns, ask, bid in zip(ticks.time.tolist(), ticks.ask.tolist(), ticks.bid.tolist()):
+                if not self.ACTIVE:
+                    return replayed
+                if speed is not None:
+                    if first_ns is None:
+                        first_ns, started = time_ns, monotonic_ns()
+                    ahead = (time_ns - first_ns) / speed - (monotonic_ns() - started)
+                    if ahead > 0:
+                        sleep(ahead / 10**9)
+                tick(time_ns, symbol, bid, ask)
+            replayed += len(ticks)
+        return replayed
+
+    def _send(self, command, **kwargs):
+        heapq.heappush(self._commands, (self.clock.time_ns() + self.latency, next(self._sequence), command, kwargs))
+
+    def _execute_open(self, symbol, order_type, lots, stop_loss, take_profit, magic, comment):
+        quote = self.market_data.get(symbol)
+        if quote is None:
+            self._error('OPEN_ORDER', f"No quotes for {symbol}")
+            return
+        price = quote['ask'] if order_type == 'buy' else quote['bid']
+        ticket = str(next(self._tickets))
+        self.open_orders[ticket] = {
+            'magic': magic, 'symbol': symbol, 'lots': lots, 'type': order_type,
+            'open_price': price, 'open_time': self._server_time(),
+            'SL': stop_loss, 'TP': take_profit, 'pnl': 0.0,
+            'commission': -self.commission * lots, 'swap': 0.0, 'comment': comment,
+        }
+        self._message(f"Successfully sent order {ticket}: {symbol}, {order_type}, {lots:.2f}, {price}")
+        self._order_event()
+
+    def _execute_close(self, ticket, lots):
+        order = self.open_orders.get(ticket)
+        if order is None:
+            self._error('CLOSE_ORDER', f"Could not close order {ticket}: not found")
+            return
+        quote = self.market_data[order['symbol']]
+        price = quote['bid'] if order['type'] == 'buy' else quote['ask']
+        del self.open_orders[ticket]
+        pnl = self._pnl(order, quote['bid'], quote['ask'])
+        self.closed_orders.append({**order, 'ticket': ticket, 'close_price': price,
+                                   'close_time': self._server_time(), 'pnl': pnl})
+        self.account_info['balance'] += pnl + order['commission']
+        self.account_info['equity'] = self.account_info['balance']
+        self._message(f"Successfully closed order {ticket}: {order['symbol']}, {order['lots']:.2f}, {price}")
+        self._order_event()
+
+    def _pnl(self, order, bid, ask):
+        if order['type'] == 'buy':
+            return (bid - order['open_price']) * order['lots'] * self.contract_size
+        return (order['open_price'] - ask) * order['lots'] * self.contract_size
+
+    def _server_time(self):
+        ny = pd.Timestamp(self.clock.time_ns(), tz=timezone.utc).tz_convert('America/New_York')
+        return (ny.tz_localize(None) + MT4_SERVER_NY_OFFSET).strftime(SERVER_TIME_FORMAT)
+
+    def _message(self, text):
+        if self.event_handler is not None:
+            self.event_handler.on_message({'type': 'INFO', 'message': text})
+
+    def _error(self, error_type, description):
+        logger.warning(f"{error_type}: {description}")
+        if self.event_handler is not None:
+            self.event_handler.on_message({'type': 'ERROR', 'error_type': error_type, 'description': description})
+
+    def _order_event(self):
+        if self.event_handler is not None:
+            self.event_handler.on_order_event()
+
+
+if __name__ == '__main__':
+    import cProfile
+    import pstats
+    from time import perf_counter
+
+    import ON_TD_Cassandra_V2__v3 as live
+    from tick_stream import stream_ticks
+
+    # Replay the live TD strategy over the SPXm tick files unpacked under ./spxm_data and profile it
+    ticks = Ticks.concat(list(stream_ticks('./spxm_data/*_ticks_*.csv')))
+    simulator = MT4Simulator(clock=SimulatedClock(int(ticks.time[0])), latency=200_000_000, commission=3.0)
+    processor = live.TickProcessor(None, dwx=simulator, clock=simulator.clock, scheduler=simulator.scheduler)
+    processor.set_strategy(live.TDCassandraTickProcessor(orders_dir=simulator.orders_dir))
+
+    profiler = cProfile.Profile()
+    started = perf_counter()
+    profiler.enable()
+    replayed = simulator.replay(ticks, live.SYMBOL)
+    profiler.disable()
+    elapsed = perf_counter() - started
+
+    span = (int(ticks.time[-1]) - int(ticks.time[0])) / 10**9
+    logger.info(f"Replayed {replayed} ticks ({span / 3600:.1f} h of market time) in {elapsed:.2f} s "
+                f"({span / elapsed:.0f}x real time)")
+    logger.info(f"Closed orders: {simulator.closed_orders}")
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(10)
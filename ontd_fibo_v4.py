@@ -5,39 +5,37 @@ from datetime import datetime, time
 import pytz
 import json
 
+from backtest import ON_SESSION, ColumnarBacktest, ONBacktest
+from bar_loader import load_bars
+from bar_store import BarStore
+from event_stream import EventStream, records
+from fibo_zones import ZoneEngine, fibonacci_levels
+from session_calendar import SessionCalendar, day_ordinal
+
 
 DEBUG = False
 DEBUG_SESSION_LEVEL = True
 
-data = pd.read_csv('./data/2022.csv', sep=';', parse_dates=['Date'], dayfirst=True)
-data['Date'] = pd.to_datetime(data['Date'], utc=True)
-data=data.loc[:, ['Date', 'open', 'high', 'low', 'close']]
-data.rename(columns={'Date': 'time'}, inplace=True)
-
-data_collector = []
-for idx, row in data.iterrows():
-    data_collector.append(row.to_dict())
-    ts = row['time']
-    candle_time = row['time'].astimezone('Europe/Madrid')
-    candle_hour = candle_time.time()
+STORE_DIR = './data/store'
+SYMBOL = 'SPX'
 
-    # if candle_hour.hour == 22:
-    #     r = row.to_dict()
-    #     r['open'] = r['close']
-    #     r['time'] += pd.Timedelta(hours=1)
-    #     data_collector.append(r)
+# Bars come from the columnar store, imported from the CSV on the first run
+# (delete ./data/store to re-import); reads are memory-mapped, not parsed
+store = BarStore(STORE_DIR)
+if not store.days(SYMBOL, '1h'):
+    store.write(SYMBOL, '1h', load_bars('./data/2022.csv'))
+bars = store.read(SYMBOL, '1h')
 
-data = pd.DataFrame(data_collector)
-data.head(10)
+bars.to_frame().head(10)
 
 
 if DEBUG:
-    data = data.iloc[:100]
+    bars = bars.slice(None, bars.time[100])
 
 
 
-# data = data.iloc[:160]
-# data.tail(10)
+# bars = bars.slice(None, bars.time[160])
+# bars.to_frame().tail(10)
 
 
 
@@ -113,8 +111,13 @@ class ONTradingBot:
         self.open_date = None  # Will store the date on which we open a position
 
         # Initialize buy and sell times based on current date/time
+        self.calendar = SessionCalendar(ON_SESSION)
+        self.trading_day = None
         self.buy_time = None
         self.sell_time = None
+        self.buy_ns = None
+        self.sell_ns = None
+        self.milestone_ns = None
         self.set_trading_times(datetime.now(self.market_timezone), verbose=True)
 
         self.verbose = verbose
@@ -128,16 +131,10 @@ class ONTradingBot:
 
 
     def _calc_fibo_levels(self):
-        size_ = self.nti - self.nbi
-        self.fibo_base = self.nbi
-        self.fibo_38 = self.nbi + 0.382 * size_
-        self.fibo_50 = self.nbi + 0.50 * size_
-        self.fibo_61 = self.nbi + 0.618 * size_
-        self.fibo_top = self.nti
-        self.fibo_138 = self.nbi + 1.382 * size_
-        self.fibo_150 = self.nbi + 1.50 * size_
-        self.fibo_161 = self.nbi + 1.618 * size_
-        self.fibo_200 = self.nbi + 2.0 * size_
+        fibo_levels = fibonacci_levels(self.nbi, self.nti)
+        for key, value in fibo_levels.items():
+            setattr(self, key, value)
+        self.zone_engine = ZoneEngine(fibo_levels)
 
         self._prev_ref_price = 10000
 
@@ -156,41 +153,7 @@ class ONTradingBot:
 
 
     def update_state(self, ref_price: float):
-        if ref_price < self.fibo_base and self._prev_ref_price >= self.fibo_base:
-            self.Z = 1
-        elif ref_price < self.fibo_38 and self._prev_ref_price >= self.fibo_38:
-            self.Z = 3
-        elif ref_price < self.fibo_50 and self._prev_ref_price >= self.fibo_50:
-            self.Z = 5
-        elif ref_price < self.fibo_61 and self._prev_ref_price >= self.fibo_61:
-            self.Z = 7
-        elif ref_price < self.fibo_top and self._prev_ref_price >= self.fibo_top:
-            self.Z = 9
-        elif ref_price < self.fibo_138 and self._prev_ref_price >= self.fibo_138:
-            self.Z = 11
-        elif ref_price < self.fibo_161 and self._prev_ref_price >= self.fibo_161:
-            self.Z = 13
-        elif ref_price < self.fibo_161 and self._prev_ref_price >= self.fibo_161:
-            self.Z = 13
-        elif ref_price < self.fibo_200 and self._prev_ref_price >= self.fibo_200:
-            self.Z = 15
-
-        if ref_price > self.fibo_200 and self._prev_ref_price <= self.fibo_200:
-            self.Z = 16
-        elif ref_price > self.fibo_161 and self._prev_ref_price <= self.fibo_161:
-            self.Z = 14
-        elif ref_price > self.fibo_138 and self._prev_ref_price <= self.fibo_138:
-            self.Z = 12
-        elif ref_price > self.fibo_top and self._prev_ref_price <= self.fibo_top:
-            self.Z = 10
-        elif ref_price > self.fibo_61 and self._prev_ref_price <= self.fibo_61:
-            self.Z = 8
-        elif ref_price > self.fibo_50 and self._prev_ref_price <= self.fibo_50:
-            self.Z = 6
-        elif ref_price > self.fibo_38 and self._prev_ref_price <= self.fibo_38:
-            self.Z = 4
-        elif ref_price > self.fibo_base and self._prev_ref_price <= self.fibo_base:
-            self.Z = 2
+        self.Z = self.zone_engine.step(ref_price, self._prev_ref_price, self.Z)
 
         # Verbose logging if enabled
         if self.verbose and False:
@@ -240,13 +203,12 @@ class ONTradingBot:
         Summer:  Buy at 20:45, Sell at 13:05 (next day)
         """
         ts = current_time.astimezone(self.market_timezone)
-        ny_timezone = pytz.timezone('America/New_York')
-        aware_datetime = ny_timezone.localize(datetime(ts.year, ts.month, ts.day, 10, 5))
-        aware_datetime = ny_timezone.localize(datetime(ts.year, ts.month, ts.day, 9, 0))
-        self.sell_time = aware_datetime.astimezone(self.market_timezone).time()
-        aware_datetime = ny_timezone.localize(datetime(ts.year, ts.month, ts.day, 15, 55))
-        aware_datetime = ny_timezone.localize(datetime(ts.year, ts.month, ts.day, 16, 0))
-        self.buy_time = aware_datetime.astimezone(self.market_timezone).time()
+        self.trading_day = day_ordinal(ts)
+        self.sell_ns = self.calendar.instant('sell', self.trading_day)
+        self.buy_ns = self.calendar.instant('buy', self.trading_day)
+        self.milestone_ns = self.calendar.instant('milestone', self.trading_day)
+        self.sell_time = pd.Timestamp(self.sell_ns, tz='UTC').tz_convert(self.market_timezone).time()
+        self.buy_time = pd.Timestamp(self.buy_ns, tz='UTC').tz_convert(self.market_timezone).time()
 
         if verbose:
             print(f"[ONTradingBot] Buy Time: {self.buy_time}, Sell Time: {self.sell_time}")
@@ -262,11 +224,8 @@ class ONTradingBot:
             'Status': self.Z
         })
 
-
-        ny_timezone = pytz.timezone('America/New_York')
-        aware_datetime = ny_timezone.localize(datetime(ts.year, ts.month, ts.day, 16, 0))
-
-        if ts == aware_datetime:
+        # The session close milestone is the 16:00 NY candle
+        if candle['time'].value == self.milestone_ns:
             # update last session
             self.prev_session_last_candle_zone = self.current_session_last_candle_zone
             self.current_session_last_candle_zone = self.Z
@@ -290,17 +249,20 @@ class ONTradingBot:
         - If in a position, close (sell) the next day at self.sell_time.
         """
         candle_time = candle['time'].astimezone(self.market_timezone)
-        candle_hour = candle_time.time()
+        candle_ns = candle['time'].value
 
-        # Update DST-based schedule if the day changed (optional, in case DST toggles mid-year)
-        self.set_trading_times(candle_time)
+        # Update the DST-based schedule when the day changes
+        if day_ordinal(candle_time) != self.trading_day:
+            self.set_trading_times(candle_time)
+        is_buy_candle = candle_ns == self.buy_ns
+        is_sell_candle = candle_ns == self.sell_ns
 
 
         # ----- Session level debug -----
         if DEBUG_SESSION_LEVEL:
-            if candle_hour == self.buy_time:
+            if is_buy_candle:
                 self.session_log['ON_Close'] = candle['close']
-            if candle_hour == self.sell_time:
+            if is_sell_candle:
                 self.session_log['ON_Open'] = candle['close']
 
 
@@ -308,7 +270,7 @@ class ONTradingBot:
         # If no position is open, check if it's the exact buy_time
 
         # print(f'self.position_open: {self.position_open}; candle_hour: {candle_hour}; self.buy_time: {self.buy_time}, {candle_time.date()} {self.open_date} {candle_hour}, self.sell_time: {self.sell_time}')
-        if (not self.position_open) and (candle_hour == self.buy_time) and not (self.current_session_last_candle_zone in self.V): # prev_session_last_candle_zone
+        if (not self.position_open) and is_buy_candle and not (self.current_session_last_candle_zone in self.V): # prev_session_last_candle_zone
             self.execute_order('BUY', candle['close'], candle_time, self.current_session_last_candle_zone)
             self.open_date = candle_time.date()
             self.position_open = True
@@ -319,14 +281,14 @@ class ONTradingBot:
         # 2) The candle hour is the self.sell_time
         elif self.position_open:
             # Check if the date is strictly greater and the time is the sell_time
-            if (candle_time.date() > self.open_date) and (candle_hour == self.sell_time):
+            if (candle_time.date() > self.open_date) and is_sell_candle:
                 self.execute_order('STOP', candle['open'], candle_time, None)
                 self.position_open = False
                 self.open_date = None
 
 
 
-        if candle_hour.minute == 0: # Only hourly candles.
+        if candle_time.minute == 0: # Only hourly candles.
             self.update_fibo_zone(candle)
 
 
@@ -392,23 +354,13 @@ class ONTradingBot:
 
     def run(self, candles, ticks):
         """
-        Processes lists of candles and ticks in chronological order, simulating live operation.
+        Processes time-ordered iterables of candle and tick dicts in chronological order, simulating live operation.
+        The streams are merged lazily (see event_stream.EventStream); a candle goes before the ticks at its time.
         """
-        candles_sorted = sorted(candles, key=lambda x: x['time'])
-        ticks_sorted = sorted(ticks, key=lambda x: x['time'])
-
-        i, j = 0, 0
-        while i < len(candles_sorted) or j < len(ticks_sorted):
-            next_candle_time = candles_sorted[i]['time'] if i < len(candles_sorted) else None
-            next_tick_time = ticks_sorted[j]['time'] if j < len(ticks_sorted) else None
-
-            # Decide which event (candle or tick) happens next in time
-            if next_candle_time and (not next_tick_time or next_candle_time <= next_tick_time):
-                self.receive_hourly_candle(candles_sorted[i])
-                i += 1
-            elif next_tick_time:
-                self.receive_tick(ticks_sorted[j])
-                j += 1
+        events = EventStream()
+        events.add('candle', records(candles), self.receive_5M_candle)
+        events.add('tick', records(ticks), self.receive_tick)
+        events.run()
 
     def get_orders(self):
         """
@@ -440,11 +392,9 @@ class ONTradingBot:
 
 
 
-bot = ONTradingBot()
-
-
-for idx, row in data.iterrows():
-    bot.receive_5M_candle(row)
+# Replay the candles on typed columns; ONBacktest reproduces ONTradingBot.receive_5M_candle
+backtest = ColumnarBacktest(bars, market_timezone='UTC')
+bot = backtest.run(ONBacktest(session_debug=DEBUG_SESSION_LEVEL, verbose=True))
 
 # Retrieve and print all orders
 orders = bot.get_orders()
@@ -0,0 +1,157 @@
+import heapq
+import logging
+from itertools import count
+from threading import Condition, Thread
+
+from clock import WALL_CLOCK
+
+
+logger = logging.getLogger(__name__)
+
+NS_PER_SECOND = 10**9
+
+
+class Timer:
+    """Handle of a scheduled callback; `cancel` it to drop it before it fires."""
+
+    __slots__ = ('when', 'interval', 'callback', 'offload', 'cancelled', '_running')
+
+    def __init__(self, when, interval, callback, offload):
+        self.when = when
+        self.interval = interval
+        self.callback = callback
+        self.offload = offload
+        self.cancelled = False
+        self._running = None
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """
+    Deadline scheduler for the few timed events of a trading day (session
+    open/close, close retries, state refreshes), so nothing has to be
+    checked on every tick.
+
+    Timers live in a heap ordered by deadline. Live, `start` runs them on a
+    background thread that sleeps until the next deadline, so they fire on
+    time even when no ticks arrive. In a replay the driver calls
+    `run_until` with the time of each event instead, which fires the due
+    timers in order with a `SimulatedClock` moved to each deadline.
+
+    A clock with a `refresh` method (`CachedClock`) is refreshed before the
+    due timers are looked up, so their callbacks read the time they fire at.
+    """
+
+    def __init__(self, clock=WALL_CLOCK):
+        self.clock = clock
+        self._heap = []  # (deadline, sequence, timer)
+        self._sequence = count()
+        self._condition = Condition()
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self):
+        return sum(not timer.cancelled for _, _, timer in self._heap)
+
+    def call_at(self, when_ns: int, callback, offload: bool = False) -> Timer:
+        """
+        Call `callback()` at `when_ns` (int64 ns UTC); at once if that is past.
+
+        :param offload: Run it on its own thread when the scheduler runs live,
+            for slow work (e.g. network fetches) that must not delay other timers.
+        """
+        return self._push(Timer(int(when_ns), None, callback, offload))
+
+    def call_later(self, delay_ns: int, callback, offload: bool = False) -> Timer:
+        return self.call_at(self.clock.time_ns() + delay_ns, callback, offload)
+
+    def call_every(self, interval_ns: int, callback, start_ns: int = None, offload: bool = False) -> Timer:
+        """Call `callback()` every `interval_ns` from `start_ns` (default: one interval from now)."""
+        first = self.clock.time_ns() + interval_ns if start_ns is None else start_ns
+        return self._push(Timer(int(first), int(interval_ns), callback, offload))
+
+    def next_deadline(self):
+        """Deadline of the next live timer, or None."""
+        with self._condition:
+            self._drop_cancelled()
+            return self._heap[0][0] if self._heap else None
+
+    def run_until(self, time_ns: int) -> int:
+        """Fire every timer due by `time_ns`, in deadline order; returns how many fired."""
+        advance_to = getattr(self.clock, 'advance_to', None)
+        fired = 0
+        while True:
+            with self._condition:
+                self._drop_cancelled()
+                if not self._heap or self._heap[0][0] > time_ns:
+                    return fired
+                when, _, timer = heapq.heappop(self._heap)
+                if timer.interval is not None:
+                    # Re-armed before the call, so the callback can still cancel it
+                    timer.when = when + timer.interval
+                    heapq.heappush(self._heap, (timer.when, next(self._sequence), timer))
+            if advance_to is not None and self._thread is None:
+                advance_to(when)
+            self._fire(timer)
+            fired += 1
+
+    def start(self):
+        """Run the timers on a background thread, in real time."""
+        self._stopped = False
+        self._thread = Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _push(self, timer):
+        with self._condition:
+            heapq.heappush(self._heap, (timer.when, next(self._sequence), timer))
+            if self._heap[0][2] is timer:
+                self._condition.notify()  # New earliest deadline: wake the thread to re-arm its wait
+        return timer
+
+    def _drop_cancelled(self):
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+
+    def _fire(self, timer):
+        if timer.offload and self._thread is not None:
+            if timer._running is not None and timer._running.is_alive():
+                logger.warning(f"Skipping {timer.callback}: its previous run has not finished")
+                return
+            timer._running = Thread(target=self._call, args=(timer,), daemon=True)
+            timer._running.start()
+        else:
+            self._call(timer)
+
+    @staticmethod
+    def _call(timer):
+        try:
+            timer.callback()
+        except Exception as e:
+            logger.error(f"Timer callback {timer.callback} failed: {e}")
+
+    def _now(self):
+        refresh = getattr(self.clock, 'refresh', None)
+        return refresh() if refresh is not None else self.clock.time_ns()
+
+    def _run(self):
+        while True:
+            self.run_until(self._now())
+            with self._condition:
+                if self._stopped:
+                    return
+                self._drop_cancelled()
+                timeout = None
+                if self._heap:
+                    timeout = max(0, self._heap[0][0] - self._now()) / NS_PER_SECOND
+                if timeout is None or timeout > 0:
+                    self._condition.wait(timeout)
@@ -0,0 +1,101 @@
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from market_data import datetime_to_ns
+
+
+NS_PER_MINUTE = 60 * 10**9
+NS_PER_DAY = 86400 * 10**9
+
+MARKET_TIMEZONE = 'America/New_York'
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def local_day_and_time(times, tz):
+    """
+    Split UTC nanosecond timestamps into local calendar days and times of day.
+
+    :return: (day ordinals since 1970-01-01, nanoseconds since local midnight)
+    """
+    index = pd.DatetimeIndex(pd.to_datetime(np.asarray(times, dtype=np.int64), utc=True))
+    local = index.tz_convert(tz).tz_localize(None).as_unit('ns').asi8
+    day = local // NS_PER_DAY
+    return day, local - day * NS_PER_DAY
+
+
+def day_ordinal(when) -> int:
+    """Day number since 1970-01-01 of a date or datetime (its own wall-clock date)."""
+    if isinstance(when, datetime):
+        when = when.date()
+    return when.toordinal() - _EPOCH_ORDINAL
+
+
+class SessionCalendar:
+    """
+    UTC instants of daily session events defined in the market timezone.
+
+    Events are wall-clock times, e.g. {'open': (15, 50), 'close': (9, 30)};
+    their UTC instants are computed once per day, with DST handled by the
+    timezone database, and cached as int64 nanoseconds so that hot loops only
+    compare integers. Days are ordinals since 1970-01-01 (see `day_ordinal`).
+
+    :param events: Mapping of event name to (hour, minute).
+    :param tz: Timezone the event times are expressed in.
+    :param weekend: Weekdays (Monday=0) without a session.
+    """
+
+    def __init__(self, events, tz=MARKET_TIMEZONE, weekend=(5, 6)):
+        self.events = {name: (int(hour), int(minute)) for name, (hour, minute) in events.items()}
+        self.tz = tz
+        self.weekend = frozenset(weekend)
+        self._cache = {}  # (event, day) -> ns
+
+    def instants(self, event, days) -> np.ndarray:
+        """UTC nanoseconds of `event` on each of the given day ordinals (vectorized)."""
+        hour, minute = self.events[event]
+        days = np.asarray(days, dtype=np.int64)
+        unique, inverse = np.unique(days, return_inverse=True)
+        wall = unique * NS_PER_DAY + (hour * 60 + minute) * NS_PER_MINUTE
+        local = pd.DatetimeIndex(wall.astype('datetime64[ns]')).tz_localize(
+            self.tz, ambiguous=np.zeros(unique.size, dtype=bool), nonexistent='shift_forward')
+        return local.as_unit('ns').asi8[inverse]
+
+    def instant(self, event, day) -> int:
+        """UTC nanoseconds of `event` on a single day ordinal, cached."""
+        key = (event, day)
+        value = self._cache.get(key)
+        if value is None:
+            value = self._cache[key] = int(self.instants(event, [day])[0])
+        return value
+
+    def build(self, start, end):
+        """Precompute every event instant for the days from `start` to `end` (inclusive)."""
+        first, last = day_ordinal(pd.Timestamp(start)), day_ordinal(pd.Timestamp(end))
+        days = np.arange(first, last + 1, dtype=np.int64)
+        for event in self.events:
+            self._cache.update(zip(((event, day) for day in days.tolist()),
+                                   self.instants(event, days).tolist()))
+        return self
+
+    def is_session_day(self, day) -> bool:
+        # 1970-01-01 was a Thursday (weekday 3)
+        return (day + 3) % 7 not in self.weekend
+
+    def next(self, event, after) -> int:
+        """
+        First instant of `event` strictly after `after` on a session day.
+
+        :param after: Aware datetime or int64 nanoseconds since the epoch.
+        """
+        after_ns = datetime_to_ns(after)
+        # The event's local date is at most one day away from the UTC date
+        day = after_ns // NS_PER_DAY - 1
+        while True:
+            if self.is_session_day(day):
+                instant = self.instant(event, day)
+                if instant > after_ns:
+                    return instant
+            day += 1
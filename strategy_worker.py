@@ -0,0 +1,101 @@
+import logging
+from queue import Full, Queue
+from threading import Lock, Thread
+
+from clock import WALL_CLOCK
+
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 1024  # Pending events per strategy
+
+
+class StrategyWorker:
+    """
+    Runs one strategy's event handlers on its own thread, fed through a
+    bounded queue, so a slow strategy cannot hold up the others (or the
+    bridge thread delivering the events).
+
+    Has the handler methods of a strategy (`on_tick`, `on_message`,
+    `on_order_event`), which only enqueue the event. Ticks are queued with
+    their arrival time on `clock` and handed to the strategy's `on_tick` as
+    `time_ns`, so it can tell when they came in, however late it handles them.
+
+    Nothing is dropped by default: when the queue is full, submitting blocks
+    until the strategy catches up. Strategies that only need the latest
+    price opt in to conflation (`conflate_ticks`): while a tick of a symbol
+    is waiting, newer ones only replace it, so a strategy that falls behind
+    gets the latest price rather than a growing backlog, ticks never take
+    more than one slot per symbol and are dropped rather than block.
+
+    Handlers run in order on the worker thread; an exception is logged and
+    the worker carries on with the next event.
+    """
+
+    def __init__(self, strategy, maxsize: int = QUEUE_SIZE, clock=WALL_CLOCK, conflate: bool = None,
+                 name: str = None):
+        """
+        :param conflate: Conflate ticks; by default the strategy's `conflate_ticks`.
+        """
+        self.strategy = strategy
+        self.queue = Queue(maxsize)
+        self.clock = clock
+        self.conflate = getattr(strategy, 'conflate_ticks', False) if conflate is None else conflate
+        self.conflated = 0  # Ticks replaced by a newer one before they were handled
+        self.dropped = 0  # Ticks dropped because the queue was full
+        self._quotes = {}  # symbol -> latest (bid, ask, time_ns) waiting to be handled, when conflating
+        self._lock = Lock()
+        self._thread = Thread(target=self._run, name=name or f'{type(strategy).__name__}-worker', daemon=True)
+        self._thread.start()
+
+    def on_tick(self, symbol, bid, ask):
+        time_ns = self.clock.time_ns()
+        if not self.conflate:
+            self.queue.put(('tick', (symbol, bid, ask, time_ns)))
+            return
+
+        with self._lock:
+            pending = symbol in self._quotes
+            self._quotes[symbol] = (bid, ask, time_ns)
+        if pending:
+            self.conflated += 1
+            return
+        try:
+            self.queue.put_nowait(('tick', symbol))
+        except Full:
+            with self._lock:
+                self._quotes.pop(symbol, None)
+            self.dropped += 1
+
+    def on_message(self, message):
+        self.queue.put(('message', message))
+
+    def on_order_event(self):
+        self.queue.put(('order_event', None))
+
+    def stop(self, timeout=None):
+        """Handle the events already queued, then end the thread."""
+        self.queue.put((None, None))
+        self._thread.join(timeout)
+
+    def _run(self):
+        strategy = self.strategy
+        while True:
+            event, payload = self.queue.get()
+            if event is None:
+                return
+            try:
+                if event == 'tick':
+                    if self.conflate:
+                        with self._lock:
+                            bid, ask, time_ns = self._quotes.pop(payload)
+                        strategy.on_tick(payload, bid, ask, time_ns=time_ns)
+                    else:
+                        symbol, bid, ask, time_ns = payload
+                        strategy.on_tick(symbol, bid, ask, time_ns=time_ns)
+                elif event == 'message':
+                    strategy.on_message(payload)
+                else:
+                    strategy.on_order_event()
+            except Exception as e:
+                logger.error(f"{type(strategy).__name__} failed handling {event}: {e}")
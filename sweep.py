@@ -0,0 +1,161 @@
+import inspect
+import itertools
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from backtest import ON_SESSION, TD_SESSION, ColumnarBacktest, ONBacktest, TDBacktest, summarize_orders
+from bar_loader import load_bars
+from market_data import Bars
+
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = {
+    # name: (strategy class, default session, market timezone of the backtest)
+    'ON': (ONBacktest, ON_SESSION, 'UTC'),
+    'TD': (TDBacktest, TD_SESSION, 'Europe/Madrid'),
+}
+
+# Per-process state set up by the pool initializer
+_worker = {}
+
+
+def parameter_grid(grid):
+    """
+    Expand a parameter grid into one dict per combination.
+
+    :param grid: Mapping of parameter name to candidate values, or a list of
+                 such mappings whose expansions are concatenated.
+    """
+    if isinstance(grid, dict):
+        grid = [grid]
+    combos = []
+    for part in grid:
+        names = list(part)
+        combos.extend(dict(zip(names, values)) for values in itertools.product(*(part[name] for name in names)))
+    return combos
+
+
+def share_bars(bars: Bars, directory) -> Path:
+    """Write the bar columns as .npy files that workers memory-map read-only."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in Bars.COLUMNS:
+        np.save(directory / f'{name}.npy', getattr(bars, name))
+    return directory
+
+
+def load_shared_bars(directory) -> Bars:
+    return Bars(*(np.load(Path(directory) / f'{name}.npy', mmap_mode='r') for name in Bars.COLUMNS))
+
+
+def make_strategy(params):
+    """
+    Build the backtest strategy for one parameter combination.
+
+    `strategy` selects 'ON' (default) or 'TD'; session event names ('buy',
+    'sell', 'milestone') take (hour, minute) New York times; every other key is
+    passed to the strategy constructor (e.g. nbi, nti, Z, V).
+
+    :raises ValueError: For an unknown strategy, a key its constructor does
+        not take (e.g. V for TD) or parameters the strategy rejects.
+    """
+    params = dict(params)
+    name = params.pop('strategy', 'ON')
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {name!r}")
+    cls, session, _ = STRATEGIES[name]
+    session = dict(session)
+    for event in session:
+        if event in params:
+            session[event] = tuple(params.pop(event))
+    unknown = set(params) - set(inspect.signature(cls).parameters)
+    if unknown:
+        raise ValueError(f"{name} does not take {', '.join(sorted(unknown))}")
+    if cls is ONBacktest:
+        params.setdefault('collect_logs', False)
+    return cls(session=session, **params)
+
+
+def _init_worker(bars_dir):
+    _worker['bars'] = load_shared_bars(bars_dir)
+    _worker['backtests'] = {}
+
+
+def _backtest(strategy_name):
+    """The worker's ColumnarBacktest for the strategy's market timezone, built once."""
+    tz = STRATEGIES[strategy_name][2]
+    backtests = _worker['backtests']
+    if tz not in backtests:
+        backtests[tz] = ColumnarBacktest(_worker['bars'], market_timezone=tz)
+    return backtests[tz]
+
+
+def _run_combo(params):
+    try:
+        strategy = make_strategy(params)
+    except ValueError as e:
+        logger.warning(f"Skipping {params}: {e}")
+        return None
+    _backtest(params.get('strategy', 'ON')).run(strategy)
+    return {**params, **summarize_orders(strategy.get_orders())}
+
+
+def run_sweep(bars: Bars, grid, max_workers=None, chunksize=None) -> pd.DataFrame:
+    """
+    Run every combination of `grid` (see `parameter_grid`) in a process pool.
+
+    The bars are written once to a temporary directory and memory-mapped by
+    the workers, so the data is neither pickled per task nor copied per worker.
+    Zone sequences are memoized per worker (`backtest.ZONE_CACHE`); listing the
+    inhibit vector `V` last in the grid keeps combinations that share nbi/nti
+    in the same chunk.
+
+    :return: One row per valid combination with its parameters, total_profit,
+             trades, hit_rate and max_drawdown, best total profit first.
+    """
+    combos = parameter_grid(grid)
+    max_workers = max_workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(combos) // (4 * max_workers))
+
+    with tempfile.TemporaryDirectory(prefix='sweep_bars_') as tmp:
+        bars_dir = share_bars(bars, tmp)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(str(bars_dir),)) as pool:
+            results = list(pool.map(_run_combo, combos, chunksize=chunksize))
+
+    results = pd.DataFrame([result for result in results if result is not None])
+    if results.empty:
+        return results
+    return results.sort_values('total_profit', ascending=False, ignore_index=True)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    bars = load_bars('./data/2022.csv')
+
+    grid = [
+        {
+            'strategy': ['ON'],
+            'nbi': [3400.0, 3594.52, 3800.0],
+            'nti': [4600.0, 4808.93, 5000.0],
+            'V': [(3, 5, 6, 7, 9), (-5, -3, 3, 4, 5, 6, 7, 9)],
+            'buy': [(15, 0), (16, 0)],
+        },
+        {
+            'strategy': ['TD'],
+            'buy': [(11, 30), (12, 0)],
+            'sell': [(15, 30), (15, 55)],
+        },
+    ]
+    results = run_sweep(bars, grid)
+    print(results.head(20).to_string())
+    results.to_csv('sweep_results.csv', index=False)
@@ -0,0 +1,208 @@
+from collections import deque
+
+import numpy as np
+
+from fibo_zones import LevelSchedule
+
+
+HIGH = 1
+LOW = -1
+
+
+def rolling_max(values, window: int) -> np.ndarray:
+    """
+    Trailing maximum over `window` values, i.e. max(values[i - window + 1:i + 1]).
+
+    Van Herk/Gil-Werman block prefix/suffix maxima, so the cost is O(n)
+    whatever the window; the first `window - 1` outputs are -inf.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = values.size
+    out = np.full(n, -np.inf)
+    if window <= 0 or n < window:
+        return out
+
+    blocks = -(-n // window)
+    padded = np.full(blocks * window, -np.inf)
+    padded[:n] = values
+    padded = padded.reshape(blocks, window)
+    prefix = np.maximum.accumulate(padded, axis=1).ravel()
+    suffix = np.maximum.accumulate(padded[:, ::-1], axis=1)[:, ::-1].ravel()
+
+    end = np.arange(window - 1, n)
+    out[window - 1:] = np.maximum(suffix[end - window + 1], prefix[end])
+    return out
+
+
+def pivot_highs(high, order: int) -> np.ndarray:
+    """
+    Indices of pivot highs: bars strictly higher than the `order` bars on each
+    side (scipy's argrelextrema with np.greater, except that a pivot needs a
+    full window on both sides, so the last `order` bars are never pivots).
+    """
+    high = np.asarray(high, dtype=np.float64)
+    n = high.size
+    if order < 1 or n < 2 * order + 1:
+        return np.empty(0, dtype=np.int64)
+
+    window_max = rolling_max(high, order)
+    center = np.arange(order, n - order)
+    left = window_max[center - 1]            # max(high[i - order:i])
+    right = window_max[center + order]       # max(high[i + 1:i + order + 1])
+    return center[(high[center] > left) & (high[center] > right)]
+
+
+def pivot_lows(low, order: int) -> np.ndarray:
+    """Indices of pivot lows (see `pivot_highs`)."""
+    return pivot_highs(-np.asarray(low, dtype=np.float64), order)
+
+
+def swing_points(high, low, order: int):
+    """
+    Pivot highs and lows merged in bar order.
+
+    :return: (index, kind, price) arrays, kind being HIGH or LOW.
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    highs, lows = pivot_highs(high, order), pivot_lows(low, order)
+
+    index = np.concatenate((highs, lows))
+    kind = np.concatenate((np.full(highs.size, HIGH), np.full(lows.size, LOW))).astype(np.int8)
+    price = np.concatenate((high[highs], low[lows]))
+    order_ = np.argsort(index, kind='stable')
+    return index[order_], kind[order_], price[order_]
+
+
+def anchors_from_swings(index, kind, price):
+    """
+    Fibonacci anchors (nbi, nti) spanned by the last swing: the latest pivot
+    and the latest pivot of the opposite kind before it. None if there is no
+    such pair or the swing has no height.
+    """
+    if not len(index):
+        return None
+    last = len(index) - 1
+    opposite = np.flatnonzero(np.asarray(kind[:last]) != kind[last])
+    if not opposite.size:
+        return None
+    pair = (float(price[opposite[-1]]), float(price[last]))
+    nbi, nti = min(pair), max(pair)
+    return (nbi, nti) if nti > nbi else None
+
+
+def propose_anchors(high, low, order: int):
+    """Base/top anchors for `fibonacci_levels` from the last swing of a bar series (see `anchors_from_swings`)."""
+    return anchors_from_swings(*swing_points(high, low, order))
+
+
+def swing_schedule(times, high, low, order: int, every: int, initial) -> LevelSchedule:
+    """
+    Periodic re-anchoring schedule for backtests, without lookahead.
+
+    Every `every` bars the anchors are re-proposed from the swings confirmed
+    so far (a pivot is confirmed `order` bars after it happened) and a new
+    version takes effect at that bar if they changed.
+
+    :param times: int64 ns bar timestamps.
+    :param initial: (nbi, nti) in force until the first proposal.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    index, kind, price = swing_points(high, low, order)
+    schedule = LevelSchedule.single(*initial)
+
+    # Last pivot of the opposite kind before each pivot: the one before its run of equal kinds
+    run_start = np.zeros(index.size, dtype=np.int64)
+    if index.size:
+        starts = np.flatnonzero(np.diff(kind)) + 1
+        run_start[starts] = starts
+        np.maximum.accumulate(run_start, out=run_start)
+    opposite = run_start - 1
+    confirmed_at = index + order
+
+    current = tuple(initial)
+    for bar in range(every, times.size, every):
+        last = int(np.searchsorted(confirmed_at, bar, side='left')) - 1
+        if last < 0 or opposite[last] < 0:
+            continue
+        pair = (float(price[opposite[last]]), float(price[last]))
+        anchors = (min(pair), max(pair))
+        if anchors[1] > anchors[0] and anchors != current:
+            schedule.add(times[bar], *anchors)
+            current = anchors
+    return schedule
+
+
+class SwingDetector:
+    """
+    Incremental pivot detector for live bars.
+
+    Keeps the last 2 * order + 1 bars and monotonic deques of window maxima and
+    minima, so each `update` is amortized O(1); a pivot is confirmed `order`
+    bars after it happened, exactly when `swing_points` would report it.
+
+    :param order: Bars required on each side of a pivot.
+    :param history: Number of confirmed pivots kept.
+    """
+
+    def __init__(self, order: int, history: int = 64):
+        if order < 1:
+            raise ValueError("order must be at least 1")
+        self.order = order
+        self.span = 2 * order + 1
+        self._highs = np.empty(self.span)
+        self._lows = np.empty(self.span)
+        self._times = [None] * self.span
+        self._count = 0
+        self._max_candidates = deque()  # Bar numbers with non-increasing highs
+        self._min_candidates = deque()  # Bar numbers with non-decreasing lows
+        self.pivots = deque(maxlen=history)  # (bar number, time, kind, price)
+
+    def update(self, time, high, low=None):
+        """
+        Add a bar and return the pivots it confirms as (bar number, time, kind, price) tuples.
+
+        :param low: Defaults to `high` for close-only series.
+        """
+        low = high if low is None else low
+        seq = self._count
+        slot = seq % self.span
+        self._highs[slot], self._lows[slot], self._times[slot] = high, low, time
+        self._count += 1
+
+        oldest = self._count - self.span
+        for candidates in (self._max_candidates, self._min_candidates):
+            if candidates and candidates[0] < oldest:
+                candidates.popleft()
+        while self._max_candidates and self._highs[self._max_candidates[-1] % self.span] < high:
+            self._max_candidates.pop()
+        self._max_candidates.append(seq)
+        while self._min_candidates and self._lows[self._min_candidates[-1] % self.span] > low:
+            self._min_candidates.pop()
+        self._min_candidates.append(seq)
+
+        confirmed = []
+        if self._count < self.span:
+            return confirmed
+
+        # The window is full; its center is a pivot if it is the unique extreme.
+        # Equal values are kept in the deques, so a tie shows up as the next candidate.
+        center = seq - self.order
+        for kind, candidates, values in ((HIGH, self._max_candidates, self._highs),
+                                         (LOW, self._min_candidates, self._lows)):
+            if candidates[0] != center:
+                continue
+            price = values[center % self.span]
+            if len(candidates) > 1 and values[candidates[1] % self.span] == price:
+                continue
+            pivot = (center, self._times[center % self.span], kind, float(price))
+            self.pivots.append(pivot)
+            confirmed.append(pivot)
+        return confirmed
+
+    def anchors(self):
+        """(nbi, nti) of the last confirmed swing, or None (see `anchors_from_swings`)."""
+        if not self.pivots:
+            return None
+        _, _, kind, price = zip(*self.pivots)
+        return anchors_from_swings(range(len(kind)), np.array(kind), np.array(price))
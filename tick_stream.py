@@ -0,0 +1,121 @@
+import logging
+import re
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from bar_loader import expand_sources, localize
+from event_stream import EventStream, bar_events, tick_events
+from market_data import Bars, Ticks, datetime_to_ns
+
+
+logger = logging.getLogger(__name__)
+
+# ExportTickDataToCSV-001.mq4 writes <symbol>_ticks_<YYYY-MM-DD>.csv with fixed-width
+# 'YYYY-MM-DD HH:MM:SS.mmm' UTC times (TimeGMT, as is the file date), re-writing the
+# header every time the expert restarts on the same day's file
+TICK_COLUMNS = ('datetime', 'Ask', 'Bid')
+TIME_WIDTH = 23
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+_FILE_DATE = re.compile(r'_ticks_(\d{4}-\d{2}-\d{2})\.csv$')
+
+
+def read_tick_chunks(path, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Yield the ticks of one daily tick file as `Ticks` chunks of at most `chunk_size` rows.
+
+    Only one chunk is in memory at a time. Repeated header lines are dropped.
+    """
+    # Times are read as fixed-width bytes, which NumPy parses to datetime64 directly,
+    # and repeated headers parse as NaN prices instead of breaking the float columns
+    reader = pd.read_csv(path, usecols=list(TICK_COLUMNS), dtype={'datetime': f'S{TIME_WIDTH}'},
+                         na_values={'Ask': ['Ask'], 'Bid': ['Bid']}, chunksize=chunk_size)
+    with reader:
+        for chunk in reader:
+            ask = chunk['Ask'].to_numpy(dtype=np.float64)
+            bid = chunk['Bid'].to_numpy(dtype=np.float64)
+            times = chunk['datetime'].to_numpy()
+            header = np.isnan(ask) & np.isnan(bid)
+            if header.any():
+                times, ask, bid = times[~header], ask[~header], bid[~header]
+            if not times.size:
+                continue
+            yield Ticks(localize(times.astype('datetime64[ms]'), 'UTC'), ask, bid)
+
+
+def stream_ticks(sources, start=None, end=None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Yield ticks with start <= time < end from daily tick files, in time order.
+
+    Files are read in name order (i.e. by date) and skipped without being
+    opened when their date is more than a day outside the range. Ticks older
+    than the last one yielded (e.g. from overlapping files) are dropped.
+
+    :param sources: A file, directory, glob pattern, or a list of these.
+    """
+    start_ns = None if start is None else datetime_to_ns(start)
+    end_ns = None if end is None else datetime_to_ns(end)
+    last = None
+    dropped = 0
+
+    for path in expand_sources(sources):
+        match = _FILE_DATE.search(path.name)
+        if match:
+            # Named by the UTC date the file was opened on; it runs until the server day
+            # rolls over, so it can reach well into the next UTC day
+            day = date.fromisoformat(match.group(1))
+            day_start = datetime_to_ns(pd.Timestamp(day, tz='UTC'))
+            day_end = datetime_to_ns(pd.Timestamp(day + timedelta(days=2), tz='UTC'))
+            if (start_ns is not None and day_end <= start_ns) or (end_ns is not None and day_start >= end_ns):
+                continue
+
+        for ticks in read_tick_chunks(path, chunk_size):
+            if start_ns is not None or end_ns is not None:
+                ticks = ticks.slice(start_ns, end_ns)
+            if last is not None and len(ticks) and ticks.time[0] < last:
+                keep = ticks.time >= last
+                dropped += int(np.count_nonzero(~keep))
+                ticks = Ticks(*(getattr(ticks, name)[keep] for name in Ticks.COLUMNS))
+            if not len(ticks):
+                continue
+            if np.any(ticks.time[1:] < ticks.time[:-1]):
+                order = np.argsort(ticks.time, kind='stable')
+                ticks = Ticks(*(getattr(ticks, name)[order] for name in Ticks.COLUMNS))
+            last = int(ticks.time[-1])
+            yield ticks
+
+    if dropped:
+        logger.warning(f"Dropped {dropped} out-of-order ticks")
+
+
+def replay(bot, tick_chunks, bars: Bars, interval: str = '5m', candle_handler: str = 'receive_5M_candle'):
+    """
+    Feed a trading bot its candles and ticks in time order.
+
+    Ticks go to `bot.receive_tick` as {'time', 'price' (bid), 'ask', 'bid'}
+    dicts and candles to `candle_handler` as {'time', 'open', 'high', 'low',
+    'close', 'volume'} dicts, with UTC timestamps. A candle is only known
+    once it closed, so it is delivered at its close time, before the ticks
+    at or after that time.
+    """
+    events = EventStream()
+    # Candles first, so a candle goes before the ticks at its close time
+    events.add('candle', bar_events(bars, interval, at='close'), getattr(bot, candle_handler))
+    events.add('tick', tick_events(tick_chunks), bot.receive_tick)
+    events.run()
+
+
+if __name__ == '__main__':
+    from bar_store import BarStore
+
+    logging.basicConfig(level=logging.INFO)
+
+    # Import the daily tick files unpacked under ./spxm_data into the bar store, one chunk at a time
+    store = BarStore('./data/store')
+    count = 0
+    for ticks in stream_ticks('./spxm_data/*_ticks_*.csv'):
+        store.write('SPXm', 'tick', ticks)
+        count += len(ticks)
+    logger.info(f"Imported {count} ticks; stored days: {store.days('SPXm', 'tick')}")
@@ -0,0 +1,277 @@
+import json
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+
+import numpy as np
+
+from fibo_zones import LevelSchedule
+from market_data import datetime_to_ns
+
+
+logger = logging.getLogger(__name__)
+
+
+class ZoneStateStore:
+    """
+    Append-only history of hourly closes and their Fibonacci zones.
+
+    Columns live in growable NumPy arrays (int64 ns timestamps, float64 closes,
+    int8 zones). When a directory is given, each column is mirrored to a raw
+    binary file that is only truncated back to the merge point and appended to,
+    so persisting a refresh costs as much as the refreshed bars.
+
+    Zones are computed with either a single `ZoneEngine` or a `LevelSchedule`;
+    re-anchoring adds a schedule version and recomputes only the bars from its
+    effective time onwards, reusing the stored prefix.
+    """
+
+    COLUMNS = (
+        ('times', np.int64),
+        ('closes', np.float64),
+        ('zones', np.int8),
+    )
+    META_FILE = 'meta.json'
+
+    def __init__(self, directory=None, capacity=1024):
+        self.directory = Path(directory) if directory is not None else None
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.COLUMNS}
+        self._size = 0
+        self._persisted = 0  # Rows already on disk and still valid
+        self.anchors = None  # (nbi, nti) in force: the schedule's current anchors, if it has one
+        self.schedule = None  # LevelSchedule of every anchor version, if any
+        # (nbi, nti) the owner was last configured with, so it can tell a changed setting
+        # from anchors switched at runtime
+        self.configured_anchors = None
+        self.seed = (0, 0.0)  # (Z, close) before the first stored bar
+        self.version = 0  # Bumped on every change of the bars, so derived data can be cached
+
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._load()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def times(self) -> np.ndarray:
+        return self._columns['times'][:self._size]
+
+    @property
+    def closes(self) -> np.ndarray:
+        return self._columns['closes'][:self._size]
+
+    @property
+    def zones(self) -> np.ndarray:
+        return self._columns['zones'][:self._size]
+
+    def last(self):
+        """Return (time_ns, close, Z) of the latest bar, or None when empty."""
+        if not self._size:
+            return None
+        i = self._size - 1
+        return int(self.times[i]), float(self.closes[i]), int(self.zones[i])
+
+    def locate(self, time_ns: int) -> int:
+        """Index of the first stored bar at or after `time_ns` (binary search)."""
+        return int(np.searchsorted(self.times, time_ns, side='left'))
+
+    def asof(self, when, method='nearest', tolerance=None) -> int:
+        """
+        Index of the stored bar matching `when`, or -1 if there is none.
+
+        :param when: Aware datetime or int64 nanoseconds since the epoch.
+        :param method: 'before' (last bar at or before `when`), 'after' (first
+                       bar at or after `when`) or 'nearest' (earlier bar on ties).
+        :param tolerance: Maximum distance to `when`, as a timedelta or seconds.
+        """
+        if method not in ('nearest', 'before', 'after'):
+            raise ValueError(f"Unknown as-of method: {method}")
+
+        target = datetime_to_ns(when)
+        times = self.times
+        right = int(np.searchsorted(times, target, side='right'))
+
+        if method == 'before':
+            idx = right - 1
+        else:
+            left = right - 1 if right and times[right - 1] == target else right
+            idx = left if left < self._size else -1
+            if method == 'nearest' and right:
+                before = right - 1
+                if idx < 0 or target - times[before] <= times[idx] - target:
+                    idx = before
+
+        if idx < 0:
+            return -1
+        if tolerance is not None:
+            if not isinstance(tolerance, timedelta):
+                tolerance = timedelta(seconds=tolerance)
+            tolerance_ns = (tolerance // timedelta(microseconds=1)) * 1000
+            if abs(int(times[idx]) - target) > tolerance_ns:
+                return -1
+        return idx
+
+    def zone_at(self, when, method='nearest', tolerance=None):
+        """Return the Z of the bar matching `when` (see `asof`), or None."""
+        idx = self.asof(when, method=method, tolerance=tolerance)
+        return None if idx < 0 else int(self.zones[idx])
+
+    def truncate(self, size: int):
+        """Drop every bar from index `size` onwards."""
+        self._size = min(self._size, max(size, 0))
+        self._persisted = min(self._persisted, self._size)
+        self.version += 1
+
+    def append(self, times, closes, zones):
+        """Append already computed bars; `times` must start after the last stored bar."""
+        times = np.asarray(times, dtype=np.int64)
+        n = times.size
+        if n == 0:
+            return
+        if self._size and times[0] <= self.times[-1]:
+            raise ValueError("Appended bars must be newer than the stored history")
+
+        self._reserve(self._size + n)
+        end = self._size + n
+        self._columns['times'][self._size:end] = times
+        self._columns['closes'][self._size:end] = closes
+        self._columns['zones'][self._size:end] = zones
+        self._size = end
+        self.version += 1
+
+    def merge(self, times, closes, engine) -> int:
+        """
+        Merge a freshly downloaded, time-ordered batch of bars.
+
+        Stored bars from the first new timestamp onwards are replaced; zones are
+        computed only for the new bars, seeded from the last bar kept.
+
+        :return: Index of the first replaced or appended bar.
+        """
+        times = np.asarray(times, dtype=np.int64)
+        closes = np.asarray(closes, dtype=np.float64)
+        if times.size == 0:
+            return self._size
+
+        start = self.locate(times[0])
+        self.truncate(start)
+
+        if start:
+            Z, prev_close = int(self.zones[start - 1]), float(self.closes[start - 1])
+        else:
+            Z, prev_close = self.seed
+
+        self.append(times, closes, self._compute(engine, times, closes, Z, prev_close))
+        return start
+
+    def recompute(self, engine, anchors=None, start: int = 0):
+        """
+        Recompute zones from bar `start` onwards, e.g. after the levels changed.
+
+        :param engine: ZoneEngine, or a LevelSchedule that becomes the store's schedule.
+        """
+        start = min(max(start, 0), self._size)
+        if start:
+            Z, prev_close = int(self.zones[start - 1]), float(self.closes[start - 1])
+        else:
+            Z, prev_close = self.seed
+
+        self.zones[start:] = self._compute(engine, self.times[start:], self.closes[start:], Z, prev_close)
+        self._persisted = min(self._persisted, start)
+        self.version += 1
+        if isinstance(engine, LevelSchedule):
+            self.schedule = engine
+        if anchors is not None:
+            self.anchors = tuple(anchors)
+
+    def reanchor(self, when, nbi: float, nti: float) -> int:
+        """
+        Switch to the levels of (nbi, nti) from `when` onwards.
+
+        Adds a version to the schedule (started from the current anchors if the
+        store has none) and recomputes only the bars at or after `when`. The
+        anchors in force become the schedule's `current` ones: back-dated before
+        a later version, the new levels only apply up to that version.
+
+        :param when: Aware datetime, date string or int64 nanoseconds since the epoch.
+        :return: Index of the first recomputed bar.
+        """
+        if self.schedule is None:
+            if self.anchors is None and self._size:
+                raise ValueError("Cannot re-anchor zones computed with unknown anchors")
+            self.schedule = LevelSchedule.single(*(self.anchors or (nbi, nti)))
+
+        when_ns = self.schedule.add(datetime_to_ns(when), nbi, nti)
+        start = self.locate(when_ns)
+        self.recompute(self.schedule, anchors=self.schedule.current, start=start)
+        logger.info(f"Re-anchored zones to ({nbi}, {nti}) from bar {start} of {self._size}")
+        return start
+
+    def flush(self):
+        """Write bars not yet on disk; a no-op for in-memory stores."""
+        if self.directory is None:
+            return
+
+        for name, dtype in self.COLUMNS:
+            path = self._column_path(name)
+            itemsize = np.dtype(dtype).itemsize
+            with open(path, 'r+b' if path.exists() else 'w+b') as fp:
+                fp.truncate(self._persisted * itemsize)
+                fp.seek(0, os.SEEK_END)
+                fp.write(self._columns[name][self._persisted:self._size].tobytes())
+        self._persisted = self._size
+
+        meta = {'anchors': self.anchors, 'seed': self.seed,
+                'schedule': self.schedule.to_list() if self.schedule is not None else None,
+                'configured_anchors': self.configured_anchors}
+        tmp_path = self.directory / (self.META_FILE + '.tmp')
+        tmp_path.write_text(json.dumps(meta))
+        os.replace(tmp_path, self.directory / self.META_FILE)
+
+    @staticmethod
+    def _compute(engine, times, closes, Z, prev_close):
+        if isinstance(engine, LevelSchedule):
+            return engine.compute(times, closes, Z=Z, prev_close=prev_close)
+        return engine.compute(closes, Z=Z, prev_close=prev_close)
+
+    def _column_path(self, name):
+        return self.directory / f'{name}.bin'
+
+    def _reserve(self, size):
+        capacity = self._columns['times'].size
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity)
+        for name, dtype in self.COLUMNS:
+            column = np.empty(capacity, dtype=dtype)
+            column[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = column
+
+    def _load(self):
+        meta_path = self.directory / self.META_FILE
+        if meta_path.is_file():
+            meta = json.loads(meta_path.read_text())
+            self.anchors = tuple(meta['anchors']) if meta.get('anchors') else None
+            self.seed = tuple(meta.get('seed', self.seed))
+            if meta.get('schedule'):
+                self.schedule = LevelSchedule.from_list(meta['schedule'])
+            if meta.get('configured_anchors'):
+                self.configured_anchors = tuple(meta['configured_anchors'])
+
+        loaded = {}
+        for name, dtype in self.COLUMNS:
+            path = self._column_path(name)
+            loaded[name] = np.fromfile(path, dtype=dtype) if path.is_file() else np.empty(0, dtype=dtype)
+
+        # An interrupted flush can leave columns of unequal length; keep the common prefix.
+        size = min(column.size for column in loaded.values())
+        if any(column.size != size for column in loaded.values()):
+            logger.warning(f"Zone store columns in {self.directory} have unequal lengths - truncating to {size}")
+
+        self._reserve(size)
+        for name, column in loaded.items():
+            self._columns[name][:size] = column[:size]
+        self._size = size
+        self._persisted = 0 if any(column.size != size for column in loaded.values()) else size